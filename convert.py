@@ -10,18 +10,28 @@
 功能特性：
 - 支持多种输入格式（jpg, jpeg, png, webp, bmp, tiff等）
 - 支持两种输出格式（AVIF和JXL）
+- 编码器可选Pillow插件或 avifenc/cjxl 命令行工具，均在第一次使用时才加载
 - 自动扫描目录下的所有图片文件
 - 转换为现代图像格式但保持原文件名
 - 智能压缩比检测，自动跳过无效转换
 - 支持dry-run模式（预览不执行）
-- 多线程并行处理，加速转换
+- 多线程或多进程并行处理，加速转换
 - 可选择删除原始文件备份
+- 可选增量转换清单，重复运行时跳过未变化的文件
+- 可只处理git变更的文件或指定的文件列表，无需扫描整个目录（适合CI）
 - 进度显示和详细日志记录
 
 压缩优化：
 - 自动检测转换效果，只转换能有效压缩的图片
 - 如果转换后体积变大，自动跳过
 - 可设置最小压缩比阈值
+- 可选预测过滤，跳过几乎不可能有收益的完整编码
+- 可选内容寻址编码缓存，重复图片只需计算摘要和复制
+- 可选响应式变体模式，一次解码生成多尺寸、多格式文件及 srcset 映射
+
+其他用法：
+- convert_bytes() 在内存中把图片字节编码为目标格式，可作为库调用
+- serve 子命令启动常驻的本地转换服务，构建工具无需每张图片都启动Python
 
 使用示例：
     python image_to_avif_keep_name.py /path/to/images
@@ -32,46 +42,65 @@
 """
 
 import os
+import re
 import sys
 import time
 import argparse
+import base64
 import logging
+import contextlib
+import enum
+import glob
+import collections
 import shutil
+import signal
+import socketserver
+import sqlite3
+import subprocess
+import functools
+import hashlib
+import heapq
+import http.server
+import importlib
+import importlib.util
+import io
+import json
+import zlib
+import random
 import tempfile
+import urllib.parse
 import threading
+import multiprocessing
 import concurrent.futures
 from pathlib import Path
 from datetime import datetime
-from typing import List, Tuple, Set, Dict
+from typing import TYPE_CHECKING, List, Tuple, Set, Dict, Optional, Iterator, NamedTuple
 from tqdm import tqdm
 
 try:
     from PIL import Image
     from PIL import ImageFile
+    from PIL import ImageSequence
+    from PIL import features
 
     # 允许加载截断的图片
     ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-    # 检查AVIF支持
-    import pillow_avif
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
 
-    HAS_AVIF = True
-except ImportError as e:
-    HAS_AVIF = False
-    MISSING_PACKAGES = []
-    if 'PIL' in str(e):
-        MISSING_PACKAGES.append('Pillow')
-    if 'pillow_avif' in str(e):
-        MISSING_PACKAGES.append('pillow-avif')
+# AVIF/JXL 编码插件和命令行工具在第一次使用时才加载，见 ENCODER_BACKENDS
 
-# 检查JXL支持
-try:
-    import pillow_jxl
+# watchdog、NumPy 和 asyncio 导入较慢，只在用到它们的功能中导入；这里只查找是否安装，不执行模块代码
+# 检查watchdog支持（监视模式使用inotify等系统通知，没有时退回到轮询）
+HAS_WATCHDOG = importlib.util.find_spec('watchdog') is not None
 
-    HAS_JXL = True
-except ImportError:
-    HAS_JXL = False
-    MISSING_PACKAGES.append('pillow-jpegxl')
+# 检查NumPy支持（图像分析和自适应质量搜索需要）
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+if TYPE_CHECKING:
+    import numpy as np
 
 # 支持的图片格式
 SUPPORTED_FORMATS = {
@@ -79,20 +108,138 @@ SUPPORTED_FORMATS = {
     '.tiff', '.tif', '.gif', '.ico'
 }
 
+# Markdown中的图片引用：行内图片、引用式链接定义和HTML的 <img src>
+# 第1组为链接之前的文本，第2组为链接本身，改写链接时只替换第2组
+MARKDOWN_LINK_PATTERNS = (
+    re.compile(r'(!\[[^\]]*\]\(\s*<?)([^)\s>]+)'),
+    re.compile(r'^(\s{0,3}\[[^\]]+\]:\s*<?)([^\s>]+)'),
+    re.compile(r'(<img\b[^>]*?\bsrc\s*=\s*["\'])([^"\']+)', re.I),
+)
+
+# Pillow 能输出动画的格式（pillow_jxl 只能编码单帧，命令行编码器后端不支持动画）
+ANIMATED_FORMATS = ('avif', 'webp')
+
+# 动画帧缺少显示时长时使用的默认值（毫秒）
+ANIMATION_DEFAULT_DURATION = 100
+
+# 动画帧并行做模式转换的线程数
+ANIMATION_CONVERT_WORKERS = 4
+
+# 扫描目录时每个识别任务处理的文件数
+DISCOVERY_BATCH_SIZE = 64
+
+# 扫描目录时同时进行的任务数上限
+DISCOVERY_MAX_PENDING = 32
+
+# 每个工作线程/进程最多排队的转换任务数
+PIPELINE_DEPTH = 4
+
+# heuristic预测：目标编码器在常见内容上每像素至少需要的比特数（按源格式）
+# 源文件已经低于该值时，转换几乎不可能变小
+PREDICT_BPP_FLOOR = {
+    'png': 0.2,
+    'gif': 0.2,
+    'jpeg': 0.4,
+    'webp': 0.4,
+    'avif': 0.4,  # 扩展名不是 .avif、实际内容为AVIF的文件
+    'ico': float('inf'),  # 图标文件几乎总是无法获得收益
+}
+# 不在上表中的源格式没有下限，heuristic模式不会预测跳过
+
+# probe预测：从原图均匀取 PREDICT_PROBE_GRID × PREDICT_PROBE_GRID 块原始分辨率的小块，
+# 拼接后做一次最快档位的试探编码。缩小整图会让细节变得密集，大图的估算能偏大十倍以上
+PREDICT_PROBE_SIZE = 256
+PREDICT_PROBE_GRID = 2
+
+# probe预测：最快档位的体积比正常档位大，在文档图片上实测完整编码为试探估算的 0.37~0.9 倍。
+# 按下限修正，宁可多做完整编码也不误跳过能压缩的文件
+PREDICT_PROBE_CORRECTION = 0.35
+
+# 抽查样本少于该数时不报告误判率
+PREDICT_MIN_AUDIT_SAMPLES = 10
+
+# 响应式变体的文件名，例如 foo-960w.avif；扫描时跳过这些生成的文件
+VARIANT_NAME_RE = re.compile(r'-\d+w\.(avif|webp|jxl)$', re.IGNORECASE)
+
+VARIANT_MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jxl': 'image/jxl',
+}
+
+# 自适应质量搜索：计算SSIM前亮度平面缩小到的最大边长
+SSIM_MAX_SIDE = 512
+
+# 图像分析：采样的最大像素数
+ANALYSIS_MAX_SAMPLES = 1_000_000
+
+# 图像分析：RGB分量差不超过该值视为灰度
+ANALYSIS_GRAY_TOLERANCE = 2
+
+# 图像分析：相邻像素亮度差超过该值计为边缘
+ANALYSIS_EDGE_THRESHOLD = 32
+
+# 图像分析：颜色数不超过该值的图形（调色板图、示意图）使用无损编码
+ANALYSIS_LOSSLESS_MAX_COLORS = 256
+
+# 图像分析：边缘密度达到该值视为文字截图类内容，颜色数不超过上限时同样使用无损编码
+ANALYSIS_TEXT_EDGE_DENSITY = 0.08
+ANALYSIS_TEXT_MAX_COLORS = 4096
+
+# 内存调度：各像素模式在Pillow中每像素占用的字节数（RGB按4字节存储）
+MODE_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'PA': 2, 'I;16': 2, 'I': 4, 'F': 4}
+
+# 内存调度：各编码器每像素工作内存的估计值（字节），包括色彩空间转换和编码缓冲区
+ENCODER_BYTES_PER_PIXEL = {'avif': 12, 'jxl': 24, 'webp': 8}
+
+# 内存调度：每个任务与图片大小无关的固定开销
+MEMORY_JOB_OVERHEAD = 16 * 1024 * 1024
+
+# 各处理阶段所属的类别，用于判断运行瓶颈
+STAGE_CATEGORIES = {
+    'discover': 'io',
+    'backup': 'io',
+    'cache': 'io',
+    'write': 'io',
+    'decode': 'decode',
+    'mode_convert': 'decode',
+    'resize': 'decode',
+    'predict': 'encode',
+    'quality_search': 'encode',
+    'read': 'io',
+    'analyze': 'decode',
+    'trial_encode': 'encode',
+    'encode': 'encode',
+}
+
+BOTTLENECK_NAMES = {
+    'io': 'I/O 受限（扫描、备份、写入）',
+    'decode': '解码受限（解码、模式转换）',
+    'encode': '编码受限（编码器）',
+}
+
+# 耗时直方图的分桶上界（秒），按4倍递增
+HISTOGRAM_BOUNDS = [0.001, 0.004, 0.016, 0.064, 0.256, 1.024, 4.096]
+
 
 # 日志配置
-def setup_logging(log_file: str) -> logging.Logger:
+def setup_logging(log_file: str, console_level: int = logging.INFO) -> logging.Logger:
     """设置日志记录"""
     logger = logging.getLogger('avif_converter')
     logger.setLevel(logging.DEBUG)
 
+    # 同一进程中多次创建转换器时，先移除旧的处理器，避免日志重复输出
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
     # 文件处理器
     fh = logging.FileHandler(log_file, encoding='utf-8')
     fh.setLevel(logging.DEBUG)
 
     # 控制台处理器
     ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
+    ch.setLevel(console_level)
 
     # 格式化器
     formatter = logging.Formatter(
@@ -108,507 +255,3975 @@ def setup_logging(log_file: str) -> logging.Logger:
     return logger
 
 
-class ImageConverter:
-    """图像转换器类，支持AVIF和JXL格式"""
+def sniff_image_format(file_path: Path) -> Optional[str]:
+    """通过文件开头的魔数识别图片格式，只读取少量字节，不调用 Image.open
 
-    def __init__(self, directory: str, format: str = 'avif', quality: int = 80,
-                 dry_run: bool = False, recursive: bool = True, delete_backup: bool = False,
-                 check_compression: bool = True, min_compression_ratio: float = 0.05,
-                 threads: int = 1, effort: int = 7, show_report: bool = True):
-        self.directory = Path(directory)
-        self.format = format.lower()  # 'avif' 或 'jxl'
-        self.quality = quality
-        self.dry_run = dry_run
-        self.recursive = recursive
-        self.delete_backup = delete_backup
-        self.threads = max(1, threads)  # 至少使用1个线程
-        self.stats_lock = threading.Lock()  # 用于保护统计数据的线程锁
-        self.effort = effort  # JXL特有的参数，压缩速度与质量的平衡，1-9
-        self.check_compression = check_compression
-        self.min_compression_ratio = min_compression_ratio  # 最小压缩比，默认5%
-        self.show_report = show_report  # 是否在结束时显示详细报告
+    返回值与 Pillow 的格式名一致（小写），无法识别时返回None。
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(64)
+    except OSError:
+        return None
 
-        # 统计信息
-        self.stats = {
-            'found_images': 0,
-            'converted': 0,
-            'failed': 0,
-            'skipped_larger': 0,  # 因体积变大而跳过的文件
-            'skipped_minimal': 0,  # 因压缩效果不明显而跳过的文件
-            'total_original_size': 0,
-            'total_converted_size': 0,
-            'total_saved_size': 0,  # 总节省空间
-            'format_counts': {},  # 各种格式的统计
-            'conversion_time': 0,  # 总转换时间
-            'max_compression': 0,  # 最大压缩率
-            'min_compression': 100,  # 最小压缩率
-            'avg_compression': 0,  # 平均压缩率
-            'errors': []
-        }
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    # JXL裸码流或ISOBMFF容器
+    if header.startswith(b'\xff\x0a') or header.startswith(b'\x00\x00\x00\x0cJXL \r\n\x87\n'):
+        return 'jxl'
+    # AVIF：ftyp盒的主品牌或兼容品牌中包含 avif/avis
+    if header[4:8] == b'ftyp':
+        box_size = int.from_bytes(header[:4], 'big')
+        brands = header[8:min(max(box_size, 16), len(header))]
+        for i in range(0, len(brands) - 3, 4):
+            if brands[i:i + 4] in (b'avif', b'avis'):
+                return 'avif'
+        return None
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if header.startswith(b'\x00\x00\x01\x00'):
+        return 'ico'
+    if header.startswith(b'BM'):
+        return 'bmp'
+    return None
 
-        # 设置日志
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        log_file = self.directory / f'avif_conversion_{timestamp}.log'
-        self.logger = setup_logging(str(log_file))
 
-        self.logger.info(f"开始处理目录: {self.directory}")
-        self.logger.info(f"参数 - 输出格式: {self.format.upper()}, 质量: {self.quality}, 递归: {self.recursive}, "
-                         f"预览模式: {self.dry_run}, 删除备份: {self.delete_backup}, "
-                         f"检测压缩比: {self.check_compression}, 最小压缩比: {self.min_compression_ratio:.1%}, "
-                         f"线程数: {self.threads}" +
-                         (f", 压缩速度等级: {self.effort}" if self.format == 'jxl' else ""))
+def _fsync_path(path: Path):
+    """将文件或目录的内容刷写到磁盘"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # 部分平台（如Windows）无法以只读方式打开目录
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
-    def find_images(self) -> List[Path]:
-        """查找所有支持的图片文件"""
-        images = []
 
-        if self.recursive:
-            pattern = '**/*'
+def _file_digest(file_path: Path) -> str:
+    """计算文件内容的SHA-256摘要（只读取字节，不解码图片）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def git_changed_files(directory: str, ref: str = 'HEAD') -> List[str]:
+    """用git列出目录下相对 ref 新增或修改的文件（含暂存区、工作区改动和未跟踪文件）
+
+    返回相对于 directory 的路径；已删除的文件不包含在内。git执行失败时抛出 RuntimeError。
+    """
+    commands = [
+        ['git', 'diff', '--name-only', '--relative', '--diff-filter=ACMRT', '-z', ref, '--', '.'],
+        ['git', 'ls-files', '--others', '--exclude-standard', '-z', '--', '.'],
+    ]
+    paths = []
+    for command in commands:
+        try:
+            result = subprocess.run(command, cwd=directory, capture_output=True, check=True)
+        except FileNotFoundError:
+            raise RuntimeError("找不到git命令")
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(e.stderr.decode('utf-8', 'replace').strip() or f"git 返回 {e.returncode}")
+        paths.extend(p for p in result.stdout.decode('utf-8', 'surrogateescape').split('\0') if p)
+    return [os.path.join(directory, p) for p in dict.fromkeys(paths)]
+
+
+def read_file_list(source: str) -> List[str]:
+    """从文件或标准输入（'-'）读取路径列表，每行一个，忽略空行"""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def iter_markdown_files(roots: List[str]) -> Iterator[Path]:
+    """列出目录下的所有Markdown文件（也可以直接给出文件）"""
+    for root in roots:
+        root = Path(root)
+        if root.is_file():
+            yield root
         else:
-            pattern = '*'
+            yield from sorted(root.rglob('*.md'))
 
-        for file_path in self.directory.glob(pattern):
-            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_FORMATS:
-                # 检查是否已经是目标格式（通过文件头判断）
-                if not self._is_already_converted(file_path):
-                    images.append(file_path)
-                    self.logger.debug(f"找到图片: {file_path}")
 
-                    # 统计原始格式
-                    try:
-                        with self.stats_lock:
-                            with Image.open(file_path) as img:
-                                fmt = img.format.lower() if img.format else file_path.suffix.lower().strip('.')
-                                if fmt in self.stats['format_counts']:
-                                    self.stats['format_counts'][fmt] += 1
-                                else:
-                                    self.stats['format_counts'][fmt] = 1
-                    except Exception:
-                        # 如果无法打开图片，使用文件扩展名作为格式
-                        ext = file_path.suffix.lower().strip('.')
-                        with self.stats_lock:
-                            if ext in self.stats['format_counts']:
-                                self.stats['format_counts'][ext] += 1
-                            else:
-                                self.stats['format_counts'][ext] = 1
-                else:
-                    self.logger.debug(f"跳过已是{self.format.upper()}格式的文件: {file_path}")
+def resolve_markdown_link(link: str, md_file: Path, site_root: str) -> Optional[str]:
+    """把Markdown中的链接解析为本地文件的绝对路径，外部链接返回None
 
-        self.stats['found_images'] = len(images)
-        self.logger.info(f"找到 {len(images)} 个需要转换的图片文件")
-        return images
+    相对链接相对于文档所在目录，以 / 开头的链接相对于站点根目录（VitePress 的 public 目录）；
+    查询参数和锚点被忽略。
+    """
+    if link.startswith(('#', '//')) or re.match(r'^[a-z][a-z0-9+.-]*:', link, re.I):
+        return None
+    path = urllib.parse.unquote(re.split(r'[?#]', link, 1)[0])
+    if not path:
+        return None
+    base = site_root if path.startswith('/') else md_file.parent
+    return os.path.normpath(os.path.abspath(os.path.join(base, path.lstrip('/'))))
 
-    def _is_already_converted(self, file_path: Path) -> bool:
-        """检查文件是否已经是目标格式"""
-        try:
-            with Image.open(file_path) as img:
-                if self.format == 'avif':
-                    return img.format == 'AVIF'
-                elif self.format == 'jxl':
-                    return img.format == 'JXL'
-                return False
-        except Exception:
-            return False
 
-    def _test_compression(self, image_path: Path, original_size: int):
-        """测试转换压缩效果"""
-        try:
-            # 创建临时文件进行测试转换
-            with tempfile.NamedTemporaryFile(suffix=f'.{self.format}', delete=False) as tmp_file:
-                temp_path = Path(tmp_file.name)
+def default_site_root(directory) -> Path:
+    """默认的站点根目录：处理目录下有 public 目录时（VitePress 的静态资源目录）使用它，否则为处理目录本身"""
+    public = Path(directory) / 'public'
+    return public if public.is_dir() else Path(directory)
 
-            try:
-                # 读取并转换图片到临时文件
-                with Image.open(image_path) as img:
-                    # 处理透明度
-                    if img.mode in ('RGBA', 'LA'):
-                        pass
-                    elif img.mode == 'P' and 'transparency' in img.info:
-                        img = img.convert('RGBA')
-                    else:
-                        img = img.convert('RGB')
-
-                    # 保存为目标格式到临时文件
-                    if self.format == 'avif':
-                        img.save(
-                            temp_path,
-                            'AVIF',
-                            quality=self.quality,
-                            optimize=True
-                        )
-                    elif self.format == 'jxl':
-                        img.save(
-                            temp_path,
-                            'JXL',
-                            quality=self.quality,
-                            effort=self.effort,  # JXL特有参数
-                            lossless=False  # 使用有损模式
-                        )
 
-                # 获取转换后文件大小
-                converted_size = temp_path.stat().st_size
+def collect_markdown_references(md_files: List[Path], site_root: str) -> Dict[str, Set[str]]:
+    """逐行扫描Markdown文件，建立 图片绝对路径 -> 引用它的文档 的引用关系"""
+    references: Dict[str, Set[str]] = {}
+    for md_file in md_files:
+        with open(md_file, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                for pattern in MARKDOWN_LINK_PATTERNS:
+                    for match in pattern.finditer(line):
+                        target = resolve_markdown_link(match.group(2), md_file, site_root)
+                        if target and os.path.splitext(target)[1].lower() in SUPPORTED_FORMATS:
+                            references.setdefault(target, set()).add(str(md_file))
+    return references
 
-                # 计算压缩比
-                if converted_size >= original_size:
-                    return 'skip_larger'
 
-                compression_ratio = ((original_size - converted_size) / original_size) * 100
+def rewrite_markdown_links(md_file: Path, site_root: str, format: str) -> int:
+    """把文档中指向已改名图片的链接改为新扩展名，返回改写的链接数
 
-                # 更新压缩率统计
-                with self.stats_lock:
-                    if compression_ratio > self.stats['max_compression']:
-                        self.stats['max_compression'] = compression_ratio
-                    if self.stats['min_compression'] > compression_ratio > 0:
-                        self.stats['min_compression'] = compression_ratio
+    只改写原文件已不存在、而同名的新格式文件存在的链接，因此可以重复执行，
+    中断后续跑的文件也会被改写。逐行流式处理，有改动时写入临时文件后原子替换。
+    """
+    rewritten = 0
 
-                    # 累加到平均压缩率计算
-                    if compression_ratio > 0:
-                        current_count = self.stats['converted']
-                        if current_count > 0:
-                            self.stats['avg_compression'] = ((self.stats['avg_compression'] * current_count) +
-                                                             compression_ratio) / (current_count + 1)
-                        else:
-                            self.stats['avg_compression'] = compression_ratio
+    def replace(match):
+        nonlocal rewritten
+        link = match.group(2)
+        target = resolve_markdown_link(link, md_file, site_root)
+        if (not target or os.path.splitext(target)[1].lower() not in SUPPORTED_FORMATS or
+                os.path.exists(target) or not os.path.exists(os.path.splitext(target)[0] + '.' + format)):
+            return match.group(0)
+        path, rest = re.match(r'([^?#]*)(.*)', link).groups()
+        rewritten += 1
+        return match.group(1) + os.path.splitext(path)[0] + '.' + format + rest
 
-                # 检查是否达到最小压缩比
-                if compression_ratio < (self.min_compression_ratio * 100):
-                    return 'skip_minimal'
+    temp_path = md_file.with_name(f'.{md_file.name}.tmp')
+    try:
+        with open(md_file, encoding='utf-8', newline='') as src, \
+                open(temp_path, 'w', encoding='utf-8', newline='') as dst:
+            for line in src:
+                for pattern in MARKDOWN_LINK_PATTERNS:
+                    line = pattern.sub(replace, line)
+                dst.write(line)
+        if rewritten:
+            shutil.copymode(md_file, temp_path)
+            os.replace(temp_path, md_file)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return rewritten
 
-                return converted_size, compression_ratio
 
-            finally:
-                # 清理临时文件
-                if temp_path.exists():
-                    temp_path.unlink()
+class ImageWatcher:
+    """监视目录中新增或修改的图片
 
-        except Exception as e:
-            self.logger.warning(f"测试压缩时出错 {image_path}: {str(e)}")
-            # 如果测试失败，假设转换有效
-            return original_size * 0.7, 30.0  # 估算70%大小，30%压缩率
+    安装了 watchdog 时使用系统文件通知（Linux上为inotify），空闲时不占用CPU；
+    否则按固定间隔比较各文件的大小和修改时间。文件最后一次变化后经过防抖时间，
+    且大小和修改时间与最后一次变化时相同，才认为已写入完成，交给转换流程。
+    """
 
-    def convert_image(self, image_path: Path) -> bool:
-        """转换单个图片到AVIF格式，保持原文件名"""
+    def __init__(self, converter: 'ImageConverter', debounce: float = 1.0, poll_interval: Optional[float] = None):
+        self.converter = converter
+        self.debounce = debounce
+        self.poll_interval = poll_interval if poll_interval or HAS_WATCHDOG else 2.0
+        self.backend = 'polling' if self.poll_interval else 'watchdog'
+        self._pending: Dict[str, Tuple[float, Optional[Tuple[int, int]]]] = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._poller = None
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple[int, int]]:
         try:
-            # 获取原始文件信息
-            original_size = image_path.stat().st_size
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
 
-            # 在多线程环境中安全更新统计信息
-            with self.stats_lock:
-                self.stats['total_original_size'] += original_size
+    def changed(self, path: str):
+        """记录一次文件变化；临时文件、隐藏文件和不支持的扩展名直接忽略"""
+        name = os.path.basename(path)
+        if name.startswith('.') or os.path.splitext(name)[1].lower() not in SUPPORTED_FORMATS:
+            return
+        with self._condition:
+            self._pending[path] = (time.monotonic(), self._signature(path))
+            self._condition.notify()
 
-            if self.dry_run:
-                # 在预览模式下，如果启用了压缩比检测，进行测试转换
-                if self.check_compression:
-                    test_result = self._test_compression(image_path, original_size)
-                    if test_result == 'skip_larger':
-                        self.logger.info(f"[预览] 跳过（体积会变大）: {image_path}")
-                        return False
-                    elif test_result == 'skip_minimal':
-                        self.logger.info(f"[预览] 跳过（压缩效果不明显）: {image_path}")
-                        return False
+    def dispatch(self, event):
+        """watchdog 的事件回调"""
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved', 'closed'):
+            return
+        self.changed(getattr(event, 'dest_path', None) or event.src_path)
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """轮询方式：列出目录下所有受支持文件的大小和修改时间"""
+        snapshot = {}
+        directories = [self.converter.directory]
+        while directories:
+            _, (subdirs, files) = self.converter._scan_directory(directories.pop())
+            if self.converter.recursive:
+                directories.extend(subdirs)
+            for path in files:
+                signature = self._signature(str(path))
+                if signature is not None:
+                    snapshot[str(path)] = signature
+        return snapshot
+
+    def _poll(self, previous: Dict[str, Tuple[int, int]]):
+        while not self._stopped.wait(self.poll_interval):
+            current = self._snapshot()
+            for path, signature in current.items():
+                if previous.get(path) != signature:
+                    self.changed(path)
+            previous = current
+
+    def start(self):
+        if self.backend == 'watchdog':
+            from watchdog.observers import Observer
+
+            self._observer = Observer()
+            self._observer.schedule(self, str(self.converter.directory), recursive=self.converter.recursive)
+            self._observer.start()
+        else:
+            # 初始快照在返回前取得，start() 之后写入的文件都能被发现
+            self._poller = threading.Thread(target=self._poll, args=(self._snapshot(),), name='watch-poll',
+                                            daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait_ready(self) -> List[Path]:
+        """阻塞直到有文件写入完成，返回这些文件；停止监视后返回空列表"""
+        with self._condition:
+            while not self._stopped.is_set():
+                now = time.monotonic()
+                ready, next_due = [], None
+                for path, (changed_at, signature) in list(self._pending.items()):
+                    due = changed_at + self.debounce
+                    if due > now:
+                        next_due = due if next_due is None else min(next_due, due)
+                        continue
+                    current = self._signature(path)
+                    if current is None:
+                        # 文件已被删除或改名
+                        del self._pending[path]
+                    elif current == signature:
+                        del self._pending[path]
+                        ready.append(Path(path))
                     else:
-                        predicted_size, compression_ratio = test_result
-                        self.logger.info(
-                            f"[预览] 将转换: {image_path} "
-                            f"({self._format_size(original_size)} -> {self._format_size(predicted_size)}, "
-                            f"预计压缩 {compression_ratio:.1f}%)"
-                        )
-                else:
-                    self.logger.info(f"[预览] 将转换: {image_path}")
-                return True
+                        # 仍在写入：以本次检查为新的变化时间继续等待
+                        self._pending[path] = (now, current)
+                        next_due = now + self.debounce if next_due is None else min(next_due, now + self.debounce)
+                if ready:
+                    return sorted(ready)
+                # 没有待处理的文件时一直等待通知，不定期唤醒
+                self._condition.wait(None if next_due is None else max(0.0, next_due - now))
+        return []
 
-            # 实际转换模式
-            # 如果启用压缩比检测，先进行测试
-            if self.check_compression:
-                test_result = self._test_compression(image_path, original_size)
-                if test_result == 'skip_larger':
-                    self.stats['skipped_larger'] += 1
-                    self.logger.info(f"跳过（转换后体积更大）: {image_path.name}")
-                    return False
-                elif test_result == 'skip_minimal':
-                    self.stats['skipped_minimal'] += 1
-                    self.logger.info(f"跳过（压缩效果不明显）: {image_path.name}")
-                    return False
 
-            # 创建备份文件名
-            backup_path = image_path.with_suffix(f'{image_path.suffix}.backup')
+class ConversionManifest:
+    """增量转换清单
 
-            # 读取并转换图片
-            with Image.open(image_path) as img:
-                # 处理透明度
-                if img.mode in ('RGBA', 'LA'):
-                    # 保持透明度
-                    pass
-                elif img.mode == 'P' and 'transparency' in img.info:
-                    # 调色板模式带透明度，转换为RGBA
-                    img = img.convert('RGBA')
-                else:
-                    # 转换为RGB模式
-                    img = img.convert('RGB')
+    以SQLite文件保存每个图片上一次的处理结果，键为相对路径，并记录文件大小、
+    修改时间和内容摘要。再次运行时，大小和修改时间都未变化的文件无需打开即可跳过；
+    修改时间变化（例如重新检出代码）但内容摘要相同的文件同样跳过。
+    跳过结论还记录了得出它时的编码参数签名，参数变化后需要重新判断。
+    """
 
-                # 备份原文件
-                shutil.copy2(image_path, backup_path)
-                self.logger.debug(f"创建备份: {backup_path}")
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            output_format TEXT NOT NULL,
+            quality INTEGER NOT NULL,
+            effort INTEGER NOT NULL,
+            result_size INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            encode_signature TEXT NOT NULL DEFAULT ''
+        )
+    """
 
-                # 保存为目标格式，但使用原文件名
-                if self.format == 'avif':
-                    img.save(
-                        image_path,  # 使用原文件路径
-                        'AVIF',
-                        quality=self.quality,
-                        optimize=True
-                    )
-                elif self.format == 'jxl':
-                    img.save(
-                        image_path,  # 使用原文件路径
-                        'JXL',
-                        quality=self.quality,
-                        effort=self.effort,  # JXL特有参数
-                        lossless=False  # 使用有损模式
-                    )
-                if self.format == 'webp':
-                    img.save(
-                        image_path,  # 使用原文件路径
-                        'WEBP',
-                        quality=self.quality,
-                        optimize=True
-                    )
-
-            # 获取转换后文件大小
-            converted_size = image_path.stat().st_size
-
-            # 在多线程环境中安全更新统计信息
-            with self.stats_lock:
-                self.stats['total_converted_size'] += converted_size
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self.SCHEMA)
+            # 旧版本创建的清单没有编码参数签名，其中的跳过结论都会重新判断
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(files)')}
+            if 'encode_signature' not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN encode_signature TEXT NOT NULL DEFAULT ''")
 
-            # 计算压缩比和节省空间
-            saved_size = original_size - converted_size
-            self.stats['total_saved_size'] += saved_size
-            compression_ratio = (saved_size / original_size) * 100
+    def __getstate__(self):
+        """数据库连接不能跨进程传递，子进程中按需重新连接"""
+        return {'db_path': self.db_path}
 
-            self.logger.info(
-                f"转换成功: {image_path.name} "
-                f"({self._format_size(original_size)} -> {self._format_size(converted_size)}, "
-                f"压缩 {compression_ratio:.1f}%)"
+    def __setstate__(self, state):
+        self.db_path = state['db_path']
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, key: str) -> Optional[sqlite3.Row]:
+        """查询文件上一次的处理记录"""
+        return self._connect().execute('SELECT * FROM files WHERE path = ?', (key,)).fetchone()
+
+    def record(self, key: str, st: os.stat_result, content_hash: str, outcome: str,
+               output_format: str, quality: int, effort: int, result_size: int, encode_signature: str):
+        """写入或更新一个文件的处理记录"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, outcome, output_format, '
+                'quality, effort, result_size, updated_at, encode_signature) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, st.st_size, st.st_mtime_ns, content_hash, outcome, output_format,
+                 quality, effort, result_size, datetime.now().isoformat(timespec='seconds'), encode_signature)
             )
 
-            # 如果需要，删除备份文件
-            if self.delete_backup and backup_path.exists():
-                backup_path.unlink()
-                self.logger.debug(f"删除备份: {backup_path}")
+    def touch(self, key: str, st: os.stat_result):
+        """内容未变但修改时间变化时，刷新记录中的大小和修改时间"""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                         (st.st_size, st.st_mtime_ns, key))
 
-            # 在多线程环境中安全更新统计信息
-            with self.stats_lock:
-                self.stats['converted'] += 1
-            return True
 
-        except Exception as e:
-            error_msg = f"转换失败 {image_path}: {str(e)}"
-            self.logger.error(error_msg)
+class ConversionJournal:
+    """批量转换的预写日志
 
-            # 在多线程环境中安全更新统计信息
-            with self.stats_lock:
-                self.stats['errors'].append(error_msg)
-                self.stats['failed'] += 1
+    以JSON Lines追加记录每个文件的状态：pending（已提交）、encoding（开始处理，
+    可能已创建临时文件和备份）、committed、skipped、failed。状态在处理前后各写一次，
+    运行中断后，最后状态不是终态的文件就是需要恢复和重新处理的文件。
+    每条记录通过一次 O_APPEND 写入完成，多个线程和进程可以同时追加。
+    运行正常结束后日志被删除，监视模式中每批文件处理完后清空，只有中断的运行会留下日志。
+    """
 
-            # 如果转换失败，恢复原文件
-            backup_path = image_path.with_suffix(f'{image_path.suffix}.backup')
-            if backup_path.exists():
-                try:
-                    shutil.copy2(backup_path, image_path)
-                    backup_path.unlink()
-                    self.logger.info(f"已恢复原文件: {image_path}")
-                except Exception as restore_error:
-                    self.logger.error(f"恢复原文件失败: {restore_error}")
+    TERMINAL_STATES = ('committed', 'skipped', 'failed')
 
-            return False
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = str(path)
+        self.fsync = fsync
+        self._fd = None
 
-    def _format_size(self, size_bytes: int) -> str:
-        """格式化文件大小"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size_bytes < 1024:
-                return f"{size_bytes:.1f} {unit}"
-            size_bytes /= 1024
-        return f"{size_bytes:.1f} TB"
+    def __getstate__(self):
+        """文件描述符不能跨进程传递，子进程中按需重新打开"""
+        return {'path': self.path, 'fsync': self.fsync}
 
-    def print_statistics(self):
-        """打印统计信息"""
-        if not self.show_report:
-            return
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._fd = None
 
-        print("\n" + "=" * 70)
-        print(f"图像转换报告 ({self.format.upper()}格式)")
-        print("=" * 70)
+    def load(self) -> Dict[str, Dict]:
+        """读取日志，返回每个文件最后一条记录；中断时写了一半的末行被忽略"""
+        entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
 
-        # 基本统计信息
-        print(
-            f"处理完成 │ 找到图片: {self.stats['found_images']} │ 成功转换: {self.stats['converted']} │ 失败: {self.stats['failed']}")
+    def reset(self, entries: Optional[Dict[str, Dict]] = None):
+        """重写日志：只保留给定的记录（压缩续跑的日志），不给定时清空"""
+        self.close()
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in (entries or {}).values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
 
-        # 显示跳过的文件统计
-        if self.check_compression:
-            total_skipped = self.stats['skipped_larger'] + self.stats['skipped_minimal']
-            print(
-                f"跳过文件 │ 总计: {total_skipped} │ 体积变大: {self.stats['skipped_larger']} │ 压缩效果不明显: {self.stats['skipped_minimal']}")
+    def record(self, key: str, state: str, **fields):
+        """追加一条状态记录"""
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        entry = {'key': key, 'state': state, 'time': time.time(), **fields}
+        os.write(self._fd, (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+        if self.fsync:
+            os.fsync(self._fd)
 
-        # 空间节省统计
-        if self.stats['total_original_size'] > 0:
-            original_size_mb = self.stats['total_original_size'] / (1024 * 1024)
+    def truncate(self):
+        """清空日志；其他进程以 O_APPEND 打开的描述符之后仍追加到同一个文件"""
+        with contextlib.suppress(FileNotFoundError):
+            os.truncate(self.path, 0)
 
-            if self.stats['converted'] > 0:
-                converted_size_mb = self.stats['total_converted_size'] / (1024 * 1024)
-                saved_mb = self.stats['total_saved_size'] / (1024 * 1024)
-                saved_percent = (self.stats['total_saved_size'] / self.stats['total_original_size']) * 100
+    def remove(self):
+        """删除日志文件，运行正常结束后不再需要恢复"""
+        self.close()
+        Path(self.path).unlink(missing_ok=True)
 
-                print("\n" + "-" * 70)
-                print("空间节省统计")
-                print("-" * 70)
-                print(f"原始总大小    : {original_size_mb:.2f} MB")
-                print(f"转换后总大小  : {converted_size_mb:.2f} MB")
-                print(f"节省空间      : {saved_mb:.2f} MB")
-                print(f"总体压缩率    : {saved_percent:.2f}%")
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
-                # 计算平均压缩效果
-                if self.stats['converted'] > 0:
-                    avg_compression = (self.stats['total_saved_size'] /
-                                       (self.stats['total_original_size'] -
-                                        (self.stats['total_original_size'] - self.stats['total_converted_size']))) * 100
-                    print(f"平均压缩率    : {avg_compression:.2f}%")
 
-                # 显示格式统计信息
-                if self.stats['format_counts'] and len(self.stats['format_counts']) > 0:
-                    print("\n" + "-" * 70)
-                    print("原始图片格式统计")
-                    print("-" * 70)
-                    for fmt, count in sorted(self.stats['format_counts'].items(), key=lambda x: x[1], reverse=True):
-                        percent = (count / self.stats['found_images']) * 100 if self.stats['found_images'] > 0 else 0
-                        print(f"{fmt.upper():<10}: {count:>5} 个文件 ({percent:.1f}%)")
+class ImageInfo(NamedTuple):
+    """从文件头读取的图片元数据"""
+    format: str
+    mode: str
+    size: Tuple[int, int]
+    frames: int = 1
 
-        # 显示压缩比检测信息
-        if self.check_compression:
-            print("\n" + "-" * 70)
-            print("压缩检测设置")
-            print("-" * 70)
-            print(f"检测阈值      : {self.min_compression_ratio:.1%}")
-            print(f"跳过体积变大  : {self.stats['skipped_larger']} 个文件")
-            print(f"跳过效果不佳  : {self.stats['skipped_minimal']} 个文件")
 
-        # 显示错误信息
-        if self.stats['errors']:
-            print("\n" + "-" * 70)
-            print("错误列表")
-            print("-" * 70)
-            for error in self.stats['errors'][:5]:  # 只显示前5个错误
-                print(f"  - {error}")
-            if len(self.stats['errors']) > 5:
-                print(f"  ... 还有 {len(self.stats['errors']) - 5} 个错误")
+class Prediction(enum.Enum):
+    """预测过滤对一个文件的结论"""
+    ENCODE = 'encode'  # 未被预测跳过，正常完整编码
+    SKIPPED = 'skipped'  # 预测跳过，结果已记录，不再编码
+    AUDIT = 'audit'  # 预测跳过但被抽中检验，仍做完整编码
 
-        # 总结报告
-        if self.stats['total_original_size'] > 0 and self.stats['converted'] > 0:
-            saved_mb = self.stats['total_saved_size'] / (1024 * 1024)
-            saved_percent = (self.stats['total_saved_size'] / self.stats['total_original_size']) * 100
 
-            print("\n" + "=" * 70)
-            print(
-                f"总结: 成功将 {self.stats['converted']} 个图片转换为 {self.format.upper()} 格式，节省了 {saved_mb:.2f} MB 空间 ({saved_percent:.2f}%)")
+class AnimationNotSupported(Exception):
+    """目标格式的编码器不支持动画"""
+
+
+def _read_image_info(img: 'Image.Image', path: Path) -> ImageInfo:
+    """从已打开（未解码）的图片读取元数据"""
+    return ImageInfo((img.format or path.suffix.strip('.')).lower(), img.mode, img.size,
+                     getattr(img, 'n_frames', 1))
+
+
+class DecodeCache:
+    """解码结果的内存缓存
+
+    同一文件在一次运行中可能被多次使用（预测探测和完整编码）。元数据和像素数据分开缓存：
+    元数据只需读取文件头，占用很小，不计入内存预算；解码后的像素按估算大小计入预算，
+    超出时淘汰最久未使用的条目（LRU）。键包含文件大小和修改时间，文件被替换后旧条目自然失效。
+    已读入内存的文件内容（异步模式预读的数据）从内存解码，键为内容摘要，与读入后磁盘上的变化无关。
+    缓存中的图像可能被多个线程共享，使用者不能原地修改。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._info: Dict[Tuple, ImageInfo] = {}
+        self._pixels: 'collections.OrderedDict[Tuple, Image.Image]' = collections.OrderedDict()
+        self._sizes: Dict[Tuple, int] = {}
+        self.bytes_used = 0
+
+    def __getstate__(self):
+        """每个子进程使用各自的缓存，只传递内存预算"""
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    @staticmethod
+    def _key(path: Path, source: Optional[bytes] = None) -> Tuple:
+        if source is not None:
+            return os.fspath(path), len(source), hashlib.blake2b(source, digest_size=16).hexdigest()
+        st = os.stat(path)
+        return os.fspath(path), st.st_size, st.st_mtime_ns
+
+    def info(self, path: Path, source: Optional[bytes] = None) -> ImageInfo:
+        """读取图片的格式、模式和尺寸，不解码像素；source 为已读入内存的文件内容"""
+        key = self._key(path, source)
+        info = self._info.get(key)
+        if info is None:
+            with Image.open(io.BytesIO(source) if source is not None else path) as img:
+                info = _read_image_info(img, path)
+            self._info[key] = info
+        return info
+
+    def decode(self, path: Path, source: Optional[bytes] = None) -> Tuple['Image.Image', bool]:
+        """返回解码后的图像和是否命中缓存；source 为已读入内存的文件内容"""
+        key = self._key(path, source)
+        with self._lock:
+            img = self._pixels.get(key)
+            if img is not None:
+                self._pixels.move_to_end(key)
+                return img, True
+
+        with Image.open(io.BytesIO(source) if source is not None else path) as opened:
+            opened.load()
+            self._info[key] = _read_image_info(opened, path)
+            # 关闭文件会释放像素数据，复制一份与文件无关的图像（保留调色板和透明度等信息）
+            img = opened.copy()
+
+        size = img.width * img.height * len(img.getbands())
+        if size <= self.max_bytes:
+            with self._lock:
+                if key not in self._pixels:
+                    self._pixels[key] = img
+                    self._sizes[key] = size
+                    self.bytes_used += size
+                while self.bytes_used > self.max_bytes:
+                    old_key, _ = self._pixels.popitem(last=False)
+                    self.bytes_used -= self._sizes.pop(old_key)
+        return img, False
+
+    def forget(self, path: Path):
+        """文件被替换后丢弃它的缓存条目"""
+        name = os.fspath(path)
+        with self._lock:
+            for key in [k for k in self._pixels if k[0] == name]:
+                del self._pixels[key]
+                self.bytes_used -= self._sizes.pop(key)
+            for key in [k for k in self._info if k[0] == name]:
+                del self._info[key]
+
+
+def estimate_peak_memory(info: ImageInfo, format: str, analyze: bool = False) -> int:
+    """按文件头中的尺寸和模式估算转换一个图片的峰值内存（字节），不解码
+
+    峰值包括解码后的像素、转换为RGB/RGBA后的副本和编码器的工作内存，
+    启用图像分析时再加上NumPy分析用到的临时数组。动画的所有帧同时保存在内存中。
+    """
+    width, height = info.size
+    pixels = width * height
+    peak = pixels * (info.frames * (MODE_BYTES_PER_PIXEL.get(info.mode, 4) + 4) +
+                     ENCODER_BYTES_PER_PIXEL.get(format, 16))
+    if analyze:
+        peak += pixels * 8
+    return peak + MEMORY_JOB_OVERHEAD
+
+
+class MemoryScheduler:
+    """按预估峰值内存准入任务的调度器
+
+    候选任务先进入等待队列，只有预估内存不超过剩余预算的任务才会被取出。
+    交替取出能放下的最大和最小任务，使大图和小图交错执行：大图不会同时挤在一起，
+    小图也不会被大图长期阻塞。预估超过整个预算的任务只在没有其他任务运行时单独执行。
+    budget 为None时不限制内存，按加入顺序取出。调度器只在调度线程中使用，不加锁。
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.in_use = 0
+        self.running = 0
+        self._queue: List[Tuple[int, Path]] = []
+        self._largest_next = True
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, image_path: Path, estimate: int = 0):
+        self._queue.append((estimate, image_path))
+
+    def pop(self) -> Optional[Tuple[Path, int]]:
+        """取出下一个可以开始的任务，返回 (路径, 预估内存)；内存不足或队列为空时返回None"""
+        if not self._queue:
+            return None
+
+        if self.budget is None:
+            index = 0
         else:
-            print("\n" + "=" * 70)
-            print(f"总结: 没有成功转换任何图片")
+            available = self.budget - self.in_use
+            fitting = [i for i, (estimate, _) in enumerate(self._queue) if estimate <= available]
+            if fitting:
+                pick = max if self._largest_next else min
+                index = pick(fitting, key=lambda i: self._queue[i][0])
+                self._largest_next = not self._largest_next
+            elif self.running:
+                return None
+            else:
+                index = min(range(len(self._queue)), key=lambda i: self._queue[i][0])
+
+        estimate, image_path = self._queue.pop(index)
+        self.in_use += estimate
+        self.running += 1
+        return image_path, estimate
+
+    def release(self, estimate: int):
+        """任务结束，归还它占用的预算"""
+        self.in_use -= estimate
+        self.running -= 1
+
+
+class LocalDirectoryBackend:
+    """本地目录形式的内容寻址缓存存储
+
+    条目按键名的前两位分目录保存，读取时刷新修改时间，总大小超过上限时按修改时间
+    淘汰最久未使用的条目（LRU）。写入先落到临时文件再原子改名，多个进程或多台机器
+    共享同一目录（例如网络盘、CI缓存目录）时不会读到写了一半的条目。
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes  # 0 表示不限制大小
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 当前进程对缓存总大小的估计，首次写入时扫描得到，淘汰时重新校准
+        self._approx_size = None
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str, dest: Path) -> bool:
+        """把缓存条目复制到dest，未命中时返回False"""
+        entry = self._entry_path(key)
+        try:
+            shutil.copyfile(entry, dest)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def put(self, key: str, src: Path):
+        """保存一个缓存条目"""
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=entry.parent, prefix='.tmp-', delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, entry)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if self.max_bytes:
+            if self._approx_size is None:
+                self._approx_size = self._scan_size()
+            else:
+                self._approx_size += entry.stat().st_size
+            if self._approx_size > self.max_bytes:
+                self.evict()
+
+    def _scan_entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for path in self.root.glob('*/*'):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._scan_entries())
+
+    def evict(self):
+        """按最近使用时间淘汰条目，直到总大小降到上限的90%"""
+        entries = sorted(self._scan_entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._approx_size = total
+
+
+class EncodeCache:
+    """内容寻址的编码结果缓存
+
+    键由源文件内容摘要、目标格式、质量/速度等级和编码器版本共同决定，内容相同的图片
+    （无论路径、分支或机器）只需编码一次。本地目录作为一级缓存，可选的远程后端作为
+    二级缓存：远程后端是任何实现了 get(key, dest) -> bool 和 put(key, src) 的对象，
+    在进程池模式下还需要可序列化。
+    """
+
+    def __init__(self, local: LocalDirectoryBackend, remote=None):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key: str, dest: Path) -> bool:
+        """查找缓存并写入dest；远程命中时同时回填本地缓存"""
+        if self.local.get(key, dest):
+            return True
+        if self.remote is not None and self.remote.get(key, dest):
+            self.local.put(key, dest)
+            return True
+        return False
+
+    def put(self, key: str, src: Path):
+        """保存编码结果到本地和远程缓存"""
+        self.local.put(key, src)
+        if self.remote is not None:
+            self.remote.put(key, src)
+
+
+def load_cache_backend(spec: str, url: Optional[str]):
+    """按 'module:ClassName' 加载远程缓存后端，构造参数为 --cache-url"""
+    module_name, _, class_name = spec.partition(':')
+    if not module_name or not class_name:
+        raise ValueError(f"缓存后端格式应为 module:ClassName: {spec}")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class(url) if url is not None else backend_class()
+
+
+class EncoderUnavailable(Exception):
+    """编码器后端不可用（缺少Python包或命令行工具）"""
+
+
+class EncoderSettings(NamedTuple):
+    """编码器后端的运行设置，未指定的项使用编码器的默认值"""
+    threads: int = 0  # 编码器内部线程数，0为编码器默认
+    speed: Optional[int] = None  # AVIF速度等级 0-10（0最慢/质量最高）
+    tiles: Optional[object] = None  # AVIF分块：'auto' 或 (行数log2, 列数log2)
+    jobs: Optional[int] = None  # 同时运行的命令行编码器进程数，默认为CPU核数
+
+
+class PillowEncoder:
+    """通过 Pillow 及其编码插件编码；插件在第一次使用时才导入"""
+
+    name = 'pillow'
+
+    def __init__(self, format: str, plugin: Optional[str], package: str, feature: Optional[str] = None):
+        self.format = format
+        self.plugin = plugin  # 提供编码支持的插件模块
+        self.package = package  # 安装插件的pip包名
+        self.feature = feature  # Pillow 自带的编码支持（PIL.features 中的名称）
+        self.animation = format in ANIMATED_FORMATS
+        self._available = None
+
+    def load(self) -> bool:
+        """导入编码插件，返回是否可用；结果会被缓存"""
+        if self._available is None:
+            self._available = self._load()
+        return self._available
+
+    def _load(self) -> bool:
+        if not HAS_PIL:
+            return False
+        if self.plugin:
+            try:
+                importlib.import_module(self.plugin)
+                return True
+            except ImportError:
+                pass
+        return self.feature is not None and features.check(self.feature)
+
+    def missing(self) -> str:
+        return f"运行 pip install {self.package}"
+
+    def version(self) -> str:
+        """编码器版本标识，编码器升级后缓存自动失效"""
+        versions = [f"Pillow-{getattr(Image, '__version__', 'unknown')}"]
+        if self.plugin in sys.modules:
+            versions.append(f"{self.plugin}-{getattr(sys.modules[self.plugin], '__version__', 'unknown')}")
+        return '+'.join(versions)
+
+    def encode(self, img: 'Image.Image', target, quality: int, effort: int, lossless: bool = False,
+               fast: bool = False, settings: EncoderSettings = EncoderSettings(), **options):
+        """编码图像写入 target（路径或文件对象），options 原样传给 Pillow（如动画参数）"""
+        if self.format == 'avif':
+            if fast:
+                options['speed'] = 10
+            elif settings.speed is not None:
+                options['speed'] = settings.speed
+            if settings.threads:
+                options['max_threads'] = settings.threads
+            if settings.tiles == 'auto':
+                options['autotiling'] = True
+            elif settings.tiles:
+                options['tile_rows'], options['tile_cols'] = settings.tiles
+            img.save(target, 'AVIF', quality=quality, optimize=True, **options)
+        elif self.format == 'jxl':
+            if settings.threads:
+                options['num_threads'] = settings.threads
+            img.save(target, 'JXL', quality=quality, effort=1 if fast else effort, lossless=lossless, **options)
+        elif self.format == 'webp':
+            if fast:
+                options['method'] = 0
+            img.save(target, 'WEBP', quality=quality, optimize=True, lossless=lossless, **options)
+
+
+class CommandEncoder:
+    """通过命令行工具编码
+
+    每张图片启动一个编码器进程，图像经标准输入传入；同时运行的进程数由信号量限制
+    （EncoderSettings.jobs），各进程内部再按 threads 使用多线程。不支持动画。
+    """
+
+    name = ''
+    format = ''
+    program = ''
+    animation = False
+
+    def __init__(self):
+        self._path = None
+        self._version = None
+        self._slots: Dict[int, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        if self._path is None:
+            self._path = shutil.which(self.program) or ''
+        return bool(self._path)
+
+    def missing(self) -> str:
+        return f"安装 {self.program} 并加入 PATH"
+
+    def version(self) -> str:
+        if self._version is None:
+            result = subprocess.run([self._path, '--version'], capture_output=True, text=True)
+            lines = (result.stdout or result.stderr).strip().splitlines()
+            self._version = f"{self.program}-{lines[0] if lines else 'unknown'}"
+        return self._version
+
+    def _run(self, args: List[str], data: bytes, jobs: Optional[int]) -> bytes:
+        """在进程数上限内运行编码器，返回标准输出"""
+        jobs = jobs or os.cpu_count() or 1
+        with self._lock:
+            slots = self._slots.setdefault(jobs, threading.BoundedSemaphore(jobs))
+        with slots:
+            result = subprocess.run([self._path] + args, input=data, capture_output=True)
+        if result.returncode != 0:
+            message = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            raise RuntimeError(f"{self.program} 编码失败: {message[-1] if message else result.returncode}")
+        return result.stdout
+
+    @staticmethod
+    def _write(target, data: bytes):
+        if hasattr(target, 'write'):
+            target.write(data)
+        else:
+            Path(target).write_bytes(data)
+
+
+class AvifencEncoder(CommandEncoder):
+    """libavif 的 avifenc：图像以 YUV4MPEG2（4:4:4）经标准输入传入
+
+    avifenc 不能写到标准输出，编码结果先写入临时文件再读回。
+    """
+
+    name = 'avifenc'
+    format = 'avif'
+    program = 'avifenc'
+
+    @staticmethod
+    def _y4m(img: 'Image.Image') -> bytes:
+        """转换为全范围BT.601的 YUV4MPEG2；带透明度时使用 libavif 支持的 C444alpha"""
+        alpha = img.mode in ('RGBA', 'LA')
+        planes = [plane.tobytes() for plane in img.convert('RGB').convert('YCbCr').split()]
+        if alpha:
+            planes.append(img.getchannel('A').tobytes())
+        header = (f"YUV4MPEG2 W{img.width} H{img.height} F25:1 Ip A1:1 "
+                  f"{'C444alpha' if alpha else 'C444'} XCOLORRANGE=FULL\n")
+        return header.encode('ascii') + b'FRAME\n' + b''.join(planes)
+
+    def encode(self, img: 'Image.Image', target, quality: int, effort: int, lossless: bool = False,
+               fast: bool = False, settings: EncoderSettings = EncoderSettings(), **options):
+        if options:
+            raise AnimationNotSupported(f"{self.program} 不支持动画")
+        speed = 10 if fast else settings.speed
+        args = ['--stdin', '--cicp', '1/13/6', '-q', str(quality), '--qalpha', str(quality)]
+        if speed is not None:
+            args += ['--speed', str(speed)]
+        if settings.threads:
+            args += ['--jobs', str(settings.threads)]
+        if settings.tiles == 'auto':
+            args.append('--autotiling')
+        elif settings.tiles:
+            args += ['--tilerowslog2', str(settings.tiles[0]), '--tilecolslog2', str(settings.tiles[1])]
+
+        with tempfile.NamedTemporaryFile(prefix='avifenc-', suffix='.avif', delete=False) as tmp_file:
+            output = Path(tmp_file.name)
+        try:
+            self._run(args + [str(output)], self._y4m(img), settings.jobs)
+            self._write(target, output.read_bytes())
+        finally:
+            output.unlink(missing_ok=True)
+
+
+class CjxlEncoder(CommandEncoder):
+    """libjxl 的 cjxl：图像以PNG经标准输入传入，编码结果从标准输出读取"""
+
+    name = 'cjxl'
+    format = 'jxl'
+    program = 'cjxl'
+
+    def encode(self, img: 'Image.Image', target, quality: int, effort: int, lossless: bool = False,
+               fast: bool = False, settings: EncoderSettings = EncoderSettings(), **options):
+        if options:
+            raise AnimationNotSupported(f"{self.program} 不支持动画")
+        source = io.BytesIO()
+        img.save(source, 'PNG', compress_level=1)
+        args = ['-', '-', '--quiet', '-e', str(1 if fast else effort)]
+        args += ['-d', '0'] if lossless else ['-q', str(quality)]
+        if settings.threads:
+            args += ['--num_threads', str(settings.threads)]
+        self._write(target, self._run(args, source.getvalue(), settings.jobs))
+
+
+# 各输出格式可用的编码器后端，auto 按顺序选择第一个可用的
+ENCODER_BACKENDS = {
+    'avif': {'pillow': PillowEncoder('avif', 'pillow_avif', 'pillow-avif-plugin', feature='avif'),
+             'avifenc': AvifencEncoder()},
+    'jxl': {'pillow': PillowEncoder('jxl', 'pillow_jxl', 'pillow-jxl-plugin'),
+            'cjxl': CjxlEncoder()},
+    'webp': {'pillow': PillowEncoder('webp', None, 'Pillow', feature='webp')},
+}
+
+
+def get_encoder(format: str, backend: str = 'auto'):
+    """取得可用的编码器后端，不可用时抛出 EncoderUnavailable
+
+    backend 为 'auto' 时按注册顺序选择第一个可用的后端（Pillow优先）；
+    指定的后端不适用于该格式时同样按 'auto' 处理。
+    """
+    backends = ENCODER_BACKENDS.get(format)
+    if backends is None:
+        raise EncoderUnavailable(f"不支持的格式: {format}")
+    if backend in backends:
+        encoder = backends[backend]
+        if not encoder.load():
+            raise EncoderUnavailable(f"{format.upper()} 编码器 {backend} 不可用，请{encoder.missing()}")
+        return encoder
+    for encoder in backends.values():
+        if encoder.load():
+            return encoder
+    hints = '；或'.join(encoder.missing() for encoder in backends.values())
+    raise EncoderUnavailable(f"缺少{format.upper()}编码支持，请{hints}")
+
+
+def encoder_available(format: str, backend: str = 'auto') -> bool:
+    """输出格式是否有可用的编码器"""
+    try:
+        get_encoder(format, backend)
+        return True
+    except EncoderUnavailable:
+        return False
+
+
+def _parse_tiles(value: str):
+    """解析AVIF分块设置：auto 或 行数log2x列数log2（如 1x2）"""
+    if value == 'auto':
+        return value
+    rows, _, cols = value.lower().partition('x')
+    try:
+        tiles = (int(rows), int(cols))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分块设置应为 auto 或 ROWSxCOLS（log2）: {value}")
+    if not all(0 <= n <= 6 for n in tiles):
+        raise argparse.ArgumentTypeError(f"分块数的log2必须在 0-6 之间: {value}")
+    return tiles
+
+
+# 单文件处理结果 -> 汇总统计中对应的计数项
+RESULT_OUTCOMES = {
+    'converted': 'converted',
+    'variants': 'converted',
+    'failed': 'failed',
+    'skip_larger': 'skipped_larger',
+    'skip_minimal': 'skipped_minimal',
+    'skip_predicted': 'skipped_predicted',
+    'skip_animated': 'skipped_animated',
+}
+
+# 工作线程累计的计数项，汇总时直接相加
+WORKER_COUNTERS = ('total_original_size', 'animations', 'search_encodes',
+                   'predict_audited', 'predict_wrong', 'predict_missed',
+                   'cache_hits', 'cache_misses', 'decode_cache_hits', 'decode_cache_misses',
+                   'variants_generated', 'analysis_lossless', 'analysis_grayscale', 'analysis_alpha_dropped')
+
+# 压缩率统计中报告的百分位
+COMPRESSION_PERCENTILES = (50, 90, 95)
+
+
+class FileResult:
+    """单个文件的处理结果，只保存汇总统计需要的字段"""
+
+    __slots__ = ('outcome', 'original_size', 'converted_size', 'error')
+
+    def __init__(self, outcome: str, original_size: int = 0, converted_size: int = 0, error: Optional[str] = None):
+        self.outcome = outcome
+        self.original_size = original_size
+        self.converted_size = converted_size
+        self.error = error
+
+    def to_list(self) -> list:
+        return [self.outcome, self.original_size, self.converted_size, self.error]
+
+
+class WorkerStats:
+    """一个工作线程（或子进程中的一次任务）的统计
+
+    只由所属线程写入，处理文件时不需要加锁；转换结束后由 ImageConverter._aggregate_stats 统一汇总。
+    """
+
+    __slots__ = ('results', 'counters', 'qualities', 'stage_times', 'stage_events', 'variants')
+
+    def __init__(self):
+        self.results: List[FileResult] = []
+        self.counters: Dict[str, int] = collections.Counter()
+        self.qualities: List[int] = []
+        self.stage_times: Dict[str, List[float]] = {}
+        self.stage_events: List[tuple] = []
+        self.variants: Dict[str, Dict] = {}
+
+
+def summarize_results(results: List[FileResult]) -> Dict:
+    """汇总单文件结果：各类结果的数量、总大小和成功转换文件的压缩率（最大、最小、平均和百分位）"""
+    summary = dict.fromkeys(set(RESULT_OUTCOMES.values()), 0)
+    for outcome, count in collections.Counter(r.outcome for r in results).items():
+        summary[RESULT_OUTCOMES[outcome]] += count
+    summary['errors'] = [r.error for r in results if r.outcome == 'failed' and r.error]
+
+    written = [r for r in results if r.outcome in ('converted', 'variants')]
+    converted = [r for r in results if r.outcome == 'converted' and r.original_size > 0]
+    summary['total_converted_size'] = sum(r.converted_size for r in written)
+
+    if HAS_NUMPY:
+        import numpy as np
+
+        original = np.fromiter((r.original_size for r in converted), dtype=np.int64, count=len(converted))
+        encoded = np.fromiter((r.converted_size for r in converted), dtype=np.int64, count=len(converted))
+        saved = original - encoded
+        ratios = saved / original * 100 if len(converted) else np.empty(0)
+        summary['total_saved_size'] = int(saved.sum())
+        ratio_list = ratios.tolist()
+        percentiles = np.percentile(ratios, COMPRESSION_PERCENTILES).tolist() if len(converted) else []
+    else:
+        saved_list = [r.original_size - r.converted_size for r in converted]
+        summary['total_saved_size'] = sum(saved_list)
+        ratio_list = [saved / r.original_size * 100 for saved, r in zip(saved_list, converted)]
+        percentiles = [_percentile(ratio_list, p) for p in COMPRESSION_PERCENTILES] if ratio_list else []
+
+    summary['max_compression'] = max(ratio_list, default=0)
+    summary['min_compression'] = min(ratio_list, default=100)
+    summary['avg_compression'] = sum(ratio_list) / len(ratio_list) if ratio_list else 0
+    summary['compression_percentiles'] = {f'p{p}': value for p, value in zip(COMPRESSION_PERCENTILES, percentiles)}
+    return summary
+
+
+class ImageConverter:
+    """图像转换器类，支持AVIF和JXL格式"""
+
+    def __init__(self, directory: str, format: str = 'avif', quality: int = 80,
+                 dry_run: bool = False, recursive: bool = True, delete_backup: bool = False,
+                 check_compression: bool = True, min_compression_ratio: float = 0.05,
+                 threads: int = 1, effort: int = 7, show_report: bool = True,
+                 executor: str = 'thread', manifest_path: Optional[str] = None,
+                 predict: str = 'off', predict_margin: float = 1.25, predict_min_pixels: int = 1024,
+                 predict_audit_rate: float = 0.05, quiet: bool = False,
+                 report_json: Optional[str] = None, trace_json: Optional[str] = None,
+                 backup_mode: str = 'copy', backup_dir: Optional[str] = None, fsync: bool = False,
+                 cache: Optional[EncodeCache] = None, variants: bool = False,
+                 variant_widths: Tuple[int, ...] = (480, 960, 1920), variant_formats: Tuple[str, ...] = ('avif', 'webp'),
+                 variants_sidecar: Optional[str] = None, target_ssim: Optional[float] = None,
+                 quality_range: Tuple[int, int] = (30, 95), search_steps: int = 6, analyze: bool = False,
+                 journal_path: Optional[str] = None, resume: bool = False, files: Optional[List[str]] = None,
+                 decode_cache_mb: int = 0, io_workers: int = 4, prefetch: int = 8,
+                 max_memory: Optional[int] = None, rename: bool = False,
+                 markdown_files: Optional[List[Path]] = None, site_root: Optional[str] = None, shard: Optional[Tuple[int, int]] = None,
+                 shard_by: str = 'hash', shard_report: Optional[str] = None, encoder: str = 'auto',
+                 encoder_settings: EncoderSettings = EncoderSettings()):
+        self.directory = Path(directory)
+        self.format = format.lower()  # 'avif' 或 'jxl'
+        self.quality = quality
+        self.dry_run = dry_run
+        self.recursive = recursive
+        self.delete_backup = delete_backup
+        self.backup_mode = backup_mode  # 备份方式：'copy'、'hardlink'、'dir' 或 'none'
+        self.backup_dir = Path(backup_dir) if backup_dir else None  # 'dir' 方式的备份目录
+        self.fsync = fsync  # 替换原文件前后是否刷写到磁盘
+        self.threads = max(1, threads)  # 至少使用1个线程
+        self.executor = executor  # 并行方式：'thread'（线程池）、'process'（进程池）或 'async'（异步流水线）
+        self.io_workers = max(1, io_workers)  # 异步模式中读写文件的线程数
+        self.prefetch = max(0, prefetch)  # 异步模式中提前读入内存、等待编码的文件数
+        self.max_memory = max_memory  # 并行任务预估峰值内存的总预算（字节），为None时不限制
+        self.stats_lock = threading.Lock()  # 用于保护统计数据的线程锁
+        self.effort = effort  # JXL特有的参数，压缩速度与质量的平衡，1-9
+        self.encoder = encoder  # 编码器后端名称，见 ENCODER_BACKENDS
+        self.encoder_settings = encoder_settings
+        self.check_compression = check_compression
+        self.min_compression_ratio = min_compression_ratio  # 最小压缩比，默认5%
+        self.show_report = show_report  # 是否在结束时显示详细报告
+        self.predict = predict  # 预测过滤方式：'off'、'heuristic' 或 'probe'
+        self.predict_margin = predict_margin  # 预测的安全系数，越大越保守
+        self.predict_min_pixels = predict_min_pixels  # 像素数低于此值的图片直接预测跳过
+        self.predict_audit_rate = predict_audit_rate  # 预测跳过后仍做完整编码抽查的比例
+        self.report_json = report_json  # 运行报告JSON的输出路径
+        self.trace_json = trace_json  # Chrome trace的输出路径
+        # 只有需要导出时才逐条收集计时事件，避免大目录下占用过多内存
+        self.collect_events = bool(report_json or trace_json)
+        # 响应式变体模式：为每个原图生成多个尺寸和格式，原图不变
+        self.variants = variants
+        self.variant_widths = sorted(variant_widths)
+        self.variant_formats = list(variant_formats)
+        self.variants_sidecar = variants_sidecar or str(self.directory / 'image-variants.json')
+        # 自适应质量：为每个图片搜索满足目标SSIM的最低质量，未启用时为None
+        self.target_ssim = target_ssim
+        self.quality_range = quality_range
+        self.search_steps = search_steps
+        # 编码前分析图像内容，按图片选择无损/有损、像素模式和速度等级
+        self.analyze = analyze
+        # 编码结果缓存，未启用时为None
+        self.cache = cache
+        # 解码结果的内存缓存，未启用时为None
+        self.decode_cache = DecodeCache(decode_cache_mb * 1024 * 1024) if decode_cache_mb > 0 else None
+        # 指定的候选文件列表（git变更、--files-from 或Markdown引用），为None时扫描整个目录
+        self.files = files
+        # 改名模式：写入新扩展名的文件（foo.png -> foo.avif）并删除原文件，而不是原地替换
+        self.rename = rename
+        # 改名后需要更新图片链接的Markdown文件
+        self.markdown_files = markdown_files or []
+        # 以 / 开头的Markdown链接所相对的站点根目录
+        self.site_root = Path(site_root) if site_root else default_site_root(self.directory)
+        # 多机分片：(K, N) 表示只处理N个分片中的第K个（K从1开始），为None时处理全部文件
+        self.shard = shard
+        self.shard_by = shard_by  # 分片方式：'hash'（按相对路径哈希）或 'size'（按文件大小均衡）
+        self.shard_report = shard_report or (f'image-shard-{shard[0]}-of-{shard[1]}.json' if shard else None)
+        # 增量转换清单，未启用时为None
+        self.manifest = ConversionManifest(manifest_path) if manifest_path else None
+        # 转换任务的预写日志，用于中断后恢复和续跑；预览和变体模式不修改原图，不需要日志
+        self.journal = (ConversionJournal(journal_path or self.directory / '.image-journal.jsonl', fsync)
+                        if not (dry_run or variants) else None)
+        self.resume = resume
+        # 续跑时上次运行已处理完成（转换或跳过）的文件
+        self.resume_done: Set[str] = set()
+
+        # 统计信息：工作线程各自记录单文件结果和计数，转换结束后汇总到 self.stats
+        self.stats = _new_stats()
+        self.results: List[FileResult] = []
+        self._reset_worker_stats()
+
+        # 设置日志
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.log_file = str(self.directory / f'avif_conversion_{timestamp}.log')
+        # quiet模式下控制台只输出警告和错误，详细信息仍写入日志文件
+        self.console_level = logging.WARNING if quiet else logging.INFO
+        self.logger = setup_logging(self.log_file, self.console_level)
+
+        self.logger.info(f"开始处理目录: {self.directory}")
+        self.logger.info(f"参数 - 输出格式: {self.format.upper()}, 质量: {self.quality}, 递归: {self.recursive}, "
+                         f"预览模式: {self.dry_run}, 删除备份: {self.delete_backup}, 备份方式: {self.backup_mode}, "
+                         f"检测压缩比: {self.check_compression}, 最小压缩比: {self.min_compression_ratio:.1%}, "
+                         f"并行数: {self.threads} ({self.executor})" +
+                         (f", 压缩速度等级: {self.effort}" if self.format == 'jxl' else "") +
+                         (f", 编码器: {self.encoder}" if self.encoder != 'auto' else "") +
+                         (f", 转换清单: {self.manifest.db_path}" if self.manifest else "") +
+                         (f", 预测过滤: {self.predict}" if self.predict != 'off' else "") +
+                         (f", 编码缓存: {self.cache.local.root}" if self.cache else "") +
+                         (f", 解码缓存: {decode_cache_mb} MB" if self.decode_cache else "") +
+                         (f", 内存预算: {self._format_size(max_memory)}" if max_memory else "") +
+                         (", 改用新扩展名: 是" if self.rename else "") +
+                         (f", 分片: {shard[0]}/{shard[1]} ({shard_by})" if shard else "") +
+                         (f", 响应式变体: {list(self.variant_widths)} × {self.variant_formats}" if self.variants else "") +
+                         (f", 目标SSIM: {self.target_ssim} (质量 {self.quality_range[0]}-{self.quality_range[1]})"
+                          if self.target_ssim is not None else "") +
+                         (", 图像分析: 开启" if self.analyze else "") +
+                         (f", 续跑: {self.journal.path}" if self.resume and self.journal else "") +
+                         (f", 指定文件: {len(self.files)} 个" if self.files is not None else ""))
+
+    def __getstate__(self):
+        """序列化时去掉线程锁和日志对象，以便把转换器传给子进程"""
+        state = self.__dict__.copy()
+        del state['stats_lock']
+        del state['logger']
+        del state['_local']
+        state['results'] = []
+        state['_worker_stats_list'] = []
+        # 续跑过滤只在主进程的扫描阶段使用
+        state['resume_done'] = set()
+        return state
+
+    def __setstate__(self, state):
+        """在子进程中恢复转换器，重新创建线程锁并接入同一个日志文件"""
+        self.__dict__.update(state)
+        self.stats_lock = threading.Lock()
+        self._local = threading.local()
+        self.logger = logging.getLogger('avif_converter')
+        # spawn方式启动的子进程没有继承日志处理器，需要重新配置
+        if not self.logger.handlers:
+            self.logger = setup_logging(self.log_file, self.console_level)
+
+    def _reset_worker_stats(self):
+        """丢弃各线程的统计记录，之后每个线程首次记录时重新登记"""
+        self._local = threading.local()
+        self._worker_stats_list: List[WorkerStats] = []
+
+    def _worker_stats(self) -> WorkerStats:
+        """当前线程的统计记录；只在线程第一次使用时加锁登记"""
+        state = getattr(self._local, 'stats', None)
+        if state is None:
+            state = self._local.stats = WorkerStats()
+            with self.stats_lock:
+                self._worker_stats_list.append(state)
+        return state
+
+    def _count(self, key: str, amount: int = 1):
+        """累加当前线程的计数"""
+        self._worker_stats().counters[key] += amount
+
+    def _record_result(self, outcome: str, original_size: int = 0, converted_size: int = 0,
+                       error: Optional[str] = None):
+        """记录一个文件的处理结果"""
+        self._worker_stats().results.append(FileResult(outcome, original_size, converted_size, error))
+
+    def _aggregate_stats(self):
+        """把各线程（及子进程返回）的统计记录汇总到 self.stats
+
+        计数直接相加，结果数量、总大小和压缩率由全部单文件结果一次算出，
+        因此多次汇总（如监视模式）时结果仍然准确。
+        """
+        with self.stats_lock:
+            states = self._worker_stats_list
+            self._reset_worker_stats()
+
+        for state in states:
+            self.results.extend(state.results)
+            for key, value in state.counters.items():
+                self.stats[key] += value
+            self.stats['chosen_qualities'].extend(state.qualities)
+            for stage, durations in state.stage_times.items():
+                self.stats['stage_times'].setdefault(stage, []).extend(durations)
+            self.stats['stage_events'].extend(state.stage_events)
+            self.stats['variants'].update(state.variants)
+
+        self.stats.update(summarize_results(self.results))
+
+    def find_images(self) -> List[Path]:
+        """查找所有支持的图片文件"""
+        images = sorted(self.iter_images())
+        self.logger.info(f"找到 {len(images)} 个需要转换的图片文件")
+        return images
+
+    def iter_images(self) -> Iterator[Path]:
+        """边扫描边产出需要转换的图片，同时累计发现阶段的统计信息"""
+        for file_path, status, fmt in self._discover():
+            if status == 'unchanged':
+                # 清单中记录过且未变化的文件，无需打开直接跳过
+                self.stats['skipped_unchanged'] += 1
+                self.logger.debug(f"跳过未变化的文件: {file_path}")
+            elif status == 'converted':
+                self.logger.debug(f"跳过已是{self.format.upper()}格式的文件: {file_path}")
+            elif status == 'resumed':
+                self.stats['skipped_resumed'] += 1
+                self.logger.debug(f"跳过上次运行已处理的文件: {file_path}")
+            else:
+                self.logger.debug(f"找到图片: {file_path}")
+
+                # 统计原始格式，无法识别文件头时使用文件扩展名
+                fmt = fmt or file_path.suffix.lower().strip('.')
+                self.stats['format_counts'][fmt] = self.stats['format_counts'].get(fmt, 0) + 1
+                self.stats['found_images'] += 1
+                yield file_path
+
+    def _discover(self) -> Iterator[Tuple[Path, str, Optional[str]]]:
+        """并行扫描目录并识别文件格式
+
+        目录列举（os.scandir）和文件头识别都在线程池中进行，
+        每个文件只读取开头几十个字节。结果为 (路径, 状态, 格式)，
+        状态为 'unchanged'、'resumed'、'converted' 或 'candidate'。
+        """
+        # 尚未提交的扫描任务；同时进行的任务数有上限，使扫描不会远远领先于转换
+        if self.files is not None:
+            # 指定了文件列表时不遍历目录，只识别列表中的文件
+            files = self._listed_files()
+            backlog = collections.deque((self._classify_files, files[i:i + DISCOVERY_BATCH_SIZE])
+                                        for i in range(0, len(files), DISCOVERY_BATCH_SIZE))
+        else:
+            backlog = collections.deque([(self._scan_directory, self.directory)])
+        pending = set()
+        with concurrent.futures.ThreadPoolExecutor(thread_name_prefix='discover') as pool:
+            while backlog or pending:
+                while backlog and len(pending) < DISCOVERY_MAX_PENDING:
+                    fn, arg = backlog.popleft()
+                    pending.add(pool.submit(fn, arg))
+
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    kind, items = future.result()
+                    if kind == 'classified':
+                        yield from items
+                        continue
+
+                    subdirs, files = items
+                    if self.recursive:
+                        backlog.extend((self._scan_directory, d) for d in subdirs)
+                    for i in range(0, len(files), DISCOVERY_BATCH_SIZE):
+                        backlog.append((self._classify_files, files[i:i + DISCOVERY_BATCH_SIZE]))
+
+    def _scan_directory(self, directory: Path):
+        """列出目录下的子目录和扩展名受支持的图片文件"""
+        subdirs, files = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        # 不跟随目录的符号链接，避免循环
+                        if entry.is_dir(follow_symlinks=False):
+                            # 备份目录位于处理目录内时不扫描其中的原图备份
+                            if self.backup_dir is None or Path(entry.path).resolve() != self.backup_dir.resolve():
+                                subdirs.append(Path(entry.path))
+                        elif (entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS
+                              and not VARIANT_NAME_RE.search(entry.name)):
+                            files.append(Path(entry.path))
+                    except OSError:
+                        continue
+        except OSError as e:
+            self.logger.warning(f"无法读取目录 {directory}: {e}")
+        return 'listed', (subdirs, files)
+
+    def _listed_files(self) -> List[Path]:
+        """筛选指定列表中位于处理目录内、扩展名受支持且存在的文件，筛选规则与目录扫描相同"""
+        root = os.path.abspath(self.directory)
+        backup_root = os.path.abspath(self.backup_dir) if self.backup_dir else None
+        files = []
+        for name in dict.fromkeys(self.files):
+            path = os.path.abspath(name)
+            relative = os.path.relpath(path, root)
+            if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+                self.logger.debug(f"忽略处理目录之外的文件: {name}")
+                continue
+            if not self.recursive and os.sep in relative:
+                continue
+            if backup_root and (path + os.sep).startswith(backup_root + os.sep):
+                continue
+            file_name = os.path.basename(path)
+            if (os.path.splitext(file_name)[1].lower() in SUPPORTED_FORMATS and
+                    not VARIANT_NAME_RE.search(file_name) and os.path.isfile(path)):
+                files.append(self.directory / relative)
+        return files
+
+    def _classify_files(self, files: List[Path]):
+        """识别一批文件的状态和格式"""
+        results = []
+        for file_path in files:
+            if not self._in_shard(file_path):
+                continue
+            with self._stage('discover', file_path):
+                if self.resume_done and self._relative_key(file_path) in self.resume_done:
+                    results.append((file_path, 'resumed', None))
+                    continue
+                if self._is_unchanged(file_path):
+                    results.append((file_path, 'unchanged', None))
+                    continue
+                fmt = sniff_image_format(file_path)
+            # 变体是另外写入的文件，原图已是目标格式时同样需要生成
+            done = fmt == self.format and not self.variants
+            results.append((file_path, 'converted' if done else 'candidate', fmt))
+        return 'classified', results
+
+    def _in_shard(self, file_path: Path) -> bool:
+        """按相对路径的哈希判断文件是否属于本分片；各节点不需要任何协调就能得到相同的划分"""
+        if self.shard is None or self.shard_by != 'hash':
+            return True
+        index, count = self.shard
+        return zlib.crc32(self._relative_key(file_path).encode('utf-8')) % count == index - 1
+
+    def _walk_files(self) -> Iterator[Path]:
+        """顺序遍历目录，列出扩展名受支持的文件（不识别格式）"""
+        if self.files is not None:
+            yield from self._listed_files()
+            return
+        directories = [self.directory]
+        while directories:
+            _, (subdirs, files) = self._scan_directory(directories.pop())
+            if self.recursive:
+                directories.extend(subdirs)
+            yield from files
+
+    def _assign_size_shard(self) -> List[Path]:
+        """按文件大小均衡地分片，返回本分片的文件
+
+        所有节点对同一份文件列表做相同的贪心分配：文件按大小从大到小（相同时按路径）
+        依次放入当前总大小最小的分片（相同时取编号小的），结果只取决于文件列表本身。
+        """
+        index, count = self.shard
+        entries = sorted(((path.stat().st_size, self._relative_key(path), path) for path in self._walk_files()),
+                         key=lambda entry: (-entry[0], entry[1]))
+        loads = [(0, shard) for shard in range(count)]
+        assigned = []
+        for size, _, path in entries:
+            load, shard = heapq.heappop(loads)
+            if shard == index - 1:
+                assigned.append(path)
+            heapq.heappush(loads, (load + size, shard))
+        return assigned
+
+    def _relative_key(self, file_path: Path) -> str:
+        """相对于处理目录的路径，用作清单键和备份目录中的位置，便于在不同检出位置之间复用"""
+        return file_path.relative_to(self.directory).as_posix()
+
+    def _is_unchanged(self, file_path: Path) -> bool:
+        """根据清单判断文件自上次处理后是否未变化，且上次的结论在当前参数下仍然成立"""
+        if self.manifest is None:
+            return False
+
+        key = self._relative_key(file_path)
+        row = self.manifest.lookup(key)
+        if row is None or row['output_format'] != self.format:
+            return False
+
+        if row['outcome'] != 'converted':
+            if not self.check_compression:
+                # 关闭压缩比检测时任何文件都要转换，之前的跳过结论不再适用
+                return False
+            # 跳过结论与全部编码参数有关（质量、图像分析、自适应质量、编码器后端和速度等）；
+            # 压缩比阈值可能变化，按记录的大小重新判断
+            if row['encode_signature'] != self._encode_signature():
+                return False
+            if row['outcome'] == 'skip_predicted' and self.predict == 'off':
+                return False
+            if row['outcome'] == 'skip_minimal':
+                ratio = (row['size'] - row['result_size']) / row['size'] if row['size'] else 0
+                if ratio >= self.min_compression_ratio:
+                    return False
+
+        st = file_path.stat()
+        if st.st_size == row['size'] and st.st_mtime_ns == row['mtime_ns']:
+            return True
+
+        # 修改时间变化（例如重新检出）时，用内容摘要确认文件是否真的改变
+        if st.st_size == row['size'] and _file_digest(file_path) == row['content_hash']:
+            self.manifest.touch(key, st)
+            return True
+        return False
+
+    def _record_outcome(self, file_path: Path, outcome: str, result_size: int, content_hash: Optional[str] = None,
+                        output_path: Optional[Path] = None):
+        """把处理结果写入日志和清单；改名模式下 output_path 为实际写入的文件"""
+        self._journal(file_path, 'committed' if outcome == 'converted' else 'skipped', outcome=outcome)
+        self._record_manifest(file_path, outcome, result_size, content_hash, output_path)
+
+    def _record_manifest(self, file_path: Path, outcome: str, result_size: int, content_hash: Optional[str] = None,
+                         output_path: Optional[Path] = None):
+        """把处理结果写入清单"""
+        if self.manifest is None:
+            return
+        output_path = output_path or file_path
+        if content_hash is None:
+            content_hash = _file_digest(output_path)
+        self.manifest.record(self._relative_key(file_path), output_path.stat(), content_hash, outcome,
+                             self.format, self.quality, self.effort, result_size, self._encode_signature())
+
+    def _output_path(self, image_path: Path) -> Path:
+        """编码结果的写入位置：原地替换，或改名模式下同名的新扩展名文件"""
+        return image_path.with_suffix(f'.{self.format}') if self.rename else image_path
+
+    def _check_rename_target(self, image_path: Path):
+        """改名模式下确认新文件不会覆盖其他文件，否则抛出 FileExistsError
+
+        同一目录中的 foo.png 和 foo.jpg 都会改名为 foo.avif，这样的文件都不转换；
+        已经存在的新扩展名文件不是本次写入的，同样不覆盖。
+        """
+        if not self.rename:
+            return
+        output_path = self._output_path(image_path)
+        if output_path.exists():
+            raise FileExistsError(f"目标文件已存在: {output_path}")
+        if self._has_stem_collision(image_path):
+            raise FileExistsError(f"同一目录中有主文件名相同的其他图片，改名后会相互覆盖: {image_path.name}")
+
+    def _journal(self, file_path: Path, state: str, **fields):
+        """向预写日志追加文件状态；日志写入失败不影响转换本身"""
+        if self.journal is None:
+            return
+        try:
+            self.journal.record(self._relative_key(file_path), state, **fields)
+        except OSError as e:
+            self.logger.warning(f"写入任务日志失败 {file_path}: {e}")
+
+    def recover(self):
+        """处理上次运行留下的日志：清理未完成文件的临时文件和备份，并准备本次的日志
+
+        最后状态为 pending 或 encoding 的文件可能处于中间状态：
+        - 同目录下的 .*.tmp 编码临时文件直接删除
+        - 原文件已是目标格式，说明替换已完成，只是结果未写入日志，补记为 committed 并保留备份
+        - 改名模式下新文件已写入时同样补记为 committed，并删除仍然存在的原文件
+        - 原文件丢失时用备份恢复；原文件未被替换时删除本次运行创建的备份
+        续跑时保留已完成文件的记录，否则清空日志重新开始。
+        """
+        entries = self.journal.load()
+        recovered = 0
+        for key, entry in entries.items():
+            if entry['state'] in ConversionJournal.TERMINAL_STATES:
+                continue
+            image_path = self.directory / key
+            try:
+                for temp_path in image_path.parent.glob(f'.{glob.escape(image_path.name)}.*.tmp'):
+                    temp_path.unlink(missing_ok=True)
+                    self.logger.info(f"清理残留临时文件: {temp_path}")
+
+                backup = self.directory / entry['backup'] if entry.get('backup') else None
+                output = self.directory / entry['output'] if entry.get('output') else None
+                if output is not None and output.exists() and sniff_image_format(output) == entry.get('format'):
+                    image_path.unlink(missing_ok=True)
+                    entry = dict(entry, state='committed', outcome='converted', recovered=True)
+                    entries[key] = entry
+                    self.logger.info(f"中断前已写入新文件: {output}")
+                elif not image_path.exists():
+                    if backup is not None and backup.exists():
+                        self._restore_backup(backup, image_path)
+                        self.logger.info(f"已从备份恢复中断时丢失的文件: {image_path}")
+                elif sniff_image_format(image_path) == entry.get('format'):
+                    entry = dict(entry, state='committed', outcome='converted', recovered=True)
+                    entries[key] = entry
+                    self.logger.info(f"中断前已完成替换: {image_path}")
+                elif backup is not None and backup.exists():
+                    backup.unlink()
+                    self.logger.info(f"清理残留备份: {backup}")
+                recovered += 1
+            except OSError as e:
+                self.logger.warning(f"恢复中断的文件失败 {image_path}: {e}")
+
+        if recovered:
+            print(f"已恢复上次中断时未完成的 {recovered} 个文件")
+
+        if self.resume:
+            # 失败的文件续跑时重试，只跳过已转换和已跳过的文件
+            self.resume_done = {key for key, entry in entries.items()
+                                if entry['state'] in ('committed', 'skipped')}
+            self.journal.reset({key: entry for key, entry in entries.items() if key in self.resume_done})
+            self.logger.info(f"续跑：跳过上次已处理的 {len(self.resume_done)} 个文件")
+        else:
+            self.journal.reset()
+
+    def _image_info(self, image_path: Path, source: Optional[bytes] = None) -> ImageInfo:
+        """读取图片元数据，启用解码缓存时从缓存读取；source 为已读入内存的文件内容"""
+        if self.decode_cache is not None:
+            return self.decode_cache.info(image_path, source)
+        with Image.open(io.BytesIO(source) if source is not None else image_path) as img:
+            return _read_image_info(img, image_path)
+
+    @contextlib.contextmanager
+    def _open_image(self, image_path: Path, source: Optional[bytes] = None):
+        """打开图片；启用解码缓存时返回缓存中已解码的图像（不能原地修改）
+
+        source 为已读入内存的文件内容时从内存解码（包括经过解码缓存时），不再读取磁盘。
+        """
+        # 解码缓存只保存单帧，动画直接打开
+        if self.decode_cache is None or self._image_info(image_path, source).frames > 1:
+            with Image.open(io.BytesIO(source) if source is not None else image_path) as img:
+                yield img
+            return
+
+        with self._stage('decode', image_path):
+            img, hit = self.decode_cache.decode(image_path, source)
+        self._count('decode_cache_hits' if hit else 'decode_cache_misses')
+        yield img
+
+    def _prepare_image(self, img: 'Image.Image') -> 'Image.Image':
+        """处理透明度，返回适合目标格式编码的图像"""
+        if img.mode in ('RGBA', 'LA'):
+            # 保持透明度
+            return img
+        if img.mode == 'P' and 'transparency' in img.info:
+            # 调色板模式带透明度，转换为RGBA
+            return img.convert('RGBA')
+        # 转换为RGB模式
+        return img.convert('RGB')
+
+    def _save_image(self, img: 'Image.Image', target, fast: bool = False, format: Optional[str] = None,
+                    quality: Optional[int] = None, lossless: bool = False, effort: Optional[int] = None,
+                    **options):
+        """按目标格式保存图像
+
+        fast为True时使用编码器最快的速度档位，用于预测和试探性编码；
+        format、quality 和 effort 默认为转换器的设置。lossless 只对JXL和WebP有效。
+        options 原样传给编码器，例如动画的 save_all、append_images、duration 和 loop。
+        编码由 ENCODER_BACKENDS 中选定的后端完成。
+        """
+        format = format or self.format
+        self._encoder(format).encode(img, target, quality or self.quality, effort or self.effort,
+                                     lossless=lossless, fast=fast, settings=self.encoder_settings, **options)
+
+    def _encoder(self, format: Optional[str] = None):
+        """输出格式使用的编码器后端；指定的后端不适用于该格式（如变体中的其他格式）时自动选择"""
+        return get_encoder(format or self.format, self.encoder)
+
+    def _new_temp_path(self, image_path: Path) -> Path:
+        """在原图所在目录创建一个空的临时文件
+
+        临时文件与原图位于同一目录，编码结果可以直接通过 os.replace 原子地替换原文件。
+        """
+        with tempfile.NamedTemporaryFile(dir=image_path.parent, prefix=f'.{image_path.name}.',
+                                         suffix=f'.{self.format}.tmp', delete=False) as tmp_file:
+            return Path(tmp_file.name)
+
+    def _encode_to_temp(self, image_path: Path, stage: str = 'encode') -> Path:
+        """将图片编码到同目录下的临时文件，返回临时文件路径
+
+        stage 为编码步骤在计时统计中使用的阶段名。
+        """
+        temp_path = self._new_temp_path(image_path)
+
+        try:
+            self._encode_image(image_path, temp_path, stage)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return temp_path
+
+    def _encode_image(self, image_path: Path, target, stage: str = 'encode', source: Optional[bytes] = None):
+        """解码图片并编码写入 target（路径或文件对象）
+
+        source 为已读入内存的文件内容时从内存解码，用于异步模式中预读的文件。
+        """
+        with self._open_image(image_path, source) as img:
+            if getattr(img, 'is_animated', False):
+                self._encode_animation(img, image_path, target, stage)
+                return
+
+            with self._stage('decode', image_path):
+                img.load()
+            with self._stage('mode_convert', image_path):
+                prepared = self._prepare_image(img)
+            lossless, effort = False, None
+            if self.analyze:
+                with self._stage('analyze', image_path):
+                    mode, lossless, effort = self._plan_encoding(analyze_image(prepared), image_path)
+                with self._stage('mode_convert', image_path):
+                    if prepared.mode != mode:
+                        prepared = prepared.convert(mode)
+            quality = None
+            if self.target_ssim is not None and not lossless:
+                with self._stage('quality_search', image_path):
+                    quality = self._search_quality(prepared, image_path)
+            with self._stage(stage, image_path):
+                self._save_image(prepared, target, quality=quality, lossless=lossless, effort=effort)
+
+    def _encode_animation(self, img: 'Image.Image', image_path: Path, target, stage: str):
+        """编码动画，保留每帧的显示时长和循环次数
+
+        Pillow 读取GIF/WebP动画时已按各帧的处置方式合成出完整画面，逐帧保存完整画面，
+        输出不依赖处置方式也能得到相同的显示效果。帧的解码只能按顺序进行（后一帧在前一帧
+        的画面上合成），各帧的模式转换在线程池中并行。动画不做图像分析和质量搜索。
+        """
+        encoder = self._encoder()
+        if not encoder.animation:
+            raise AnimationNotSupported(f"{self.format.upper()} 编码器 {encoder.name} 不支持动画")
+
+        frames, durations = [], []
+        with self._stage('decode', image_path):
+            default_duration = img.info.get('duration') or ANIMATION_DEFAULT_DURATION
+            for frame in ImageSequence.Iterator(img):
+                frames.append(frame.copy())
+                durations.append(frame.info.get('duration', default_duration))
+            # 没有循环扩展的GIF只播放一次；输出格式中 loop=0 表示无限循环
+            loop = img.info.get('loop', 1)
+
+        with self._stage('mode_convert', image_path):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=ANIMATION_CONVERT_WORKERS) as pool:
+                frames = list(pool.map(lambda f: f.convert('RGBA'), frames))
+                # 所有帧都完全不透明时去掉透明通道
+                if all(f.getextrema()[3][0] == 255 for f in frames):
+                    frames = list(pool.map(lambda f: f.convert('RGB'), frames))
+
+        with self._stage(stage, image_path):
+            self._save_image(frames[0], target, save_all=True, append_images=frames[1:],
+                             duration=durations, loop=loop)
+        self._count('animations')
+        self.logger.debug(f"动画: {image_path.name} {len(frames)} 帧, 循环 {loop}")
+
+    def _plan_encoding(self, analysis: 'ImageAnalysis', image_path: Path) -> Tuple[str, bool, int]:
+        """根据图像分析结果选择编码方式，返回 (像素模式, 是否无损, 速度等级)
+
+        - 灰度内容使用 L/LA 模式，未使用的透明通道被丢弃
+        - 颜色很少的图形，或颜色不多且边缘密集的文字截图，使用无损编码（仅JXL和WebP支持）
+        - 边缘密集的内容提高一级速度等级，以更好地保留文字和线条
+        """
+        mode = 'L' if analysis.grayscale else 'RGB'
+        if analysis.alpha_used:
+            mode += 'A'
+
+        text_like = analysis.edge_density >= ANALYSIS_TEXT_EDGE_DENSITY
+        lossless = self.format in ('jxl', 'webp') and (
+            analysis.colors <= ANALYSIS_LOSSLESS_MAX_COLORS or
+            (text_like and analysis.colors <= ANALYSIS_TEXT_MAX_COLORS)
+        )
+        effort = min(9, self.effort + 1) if text_like else self.effort
+
+        if lossless:
+            self._count('analysis_lossless')
+        if analysis.grayscale:
+            self._count('analysis_grayscale')
+        if analysis.has_alpha and not analysis.alpha_used:
+            self._count('analysis_alpha_dropped')
+
+        self.logger.debug(
+            f"图像分析: {image_path.name} 颜色数 {analysis.colors}, 灰度 {analysis.grayscale}, "
+            f"透明度 {analysis.alpha_used}, 边缘密度 {analysis.edge_density:.3f} -> "
+            f"{mode}, {'无损' if lossless else '有损'}, 速度等级 {effort}"
+        )
+        return mode, lossless, effort
+
+    def _search_quality(self, img: 'Image.Image', image_path: Path) -> int:
+        """在质量区间内二分查找满足目标SSIM的最低质量
+
+        候选编码使用最快档位并只在内存中进行，得分在缩小后的亮度平面上计算；
+        只有最终选定的质量才以完整速度等级编码。区间上限仍达不到目标时使用上限。
+        """
+        reference = _luma_plane(img)
+        low, high = self.quality_range
+        best = high
+        for _ in range(self.search_steps):
+            if low > high:
+                break
+            candidate = (low + high) // 2
+            buffer = io.BytesIO()
+            self._save_image(img, buffer, fast=True, quality=candidate)
+            buffer.seek(0)
+            with Image.open(buffer) as decoded:
+                score = ssim(reference, _luma_plane(decoded, reference.shape))
+            self._count('search_encodes')
+            if score >= self.target_ssim:
+                best = candidate
+                high = candidate - 1
+            else:
+                low = candidate + 1
+
+        self._worker_stats().qualities.append(best)
+        self.logger.debug(f"自适应质量: {image_path.name} -> {best}")
+        return best
+
+    def _evaluate_compression(self, original_size: int, converted_size: int):
+        """根据编码后的大小判断是否值得转换"""
+        # 计算压缩比
+        if converted_size >= original_size:
+            return 'skip_larger'
+
+        compression_ratio = ((original_size - converted_size) / original_size) * 100
+
+        # 检查是否达到最小压缩比
+        if compression_ratio < (self.min_compression_ratio * 100):
+            return 'skip_minimal'
+
+        return converted_size, compression_ratio
+
+    def _predict_skip(self, image_path: Path, original_size: int, source: Optional[bytes] = None) -> Optional[int]:
+        """预测完整编码是否有希望通过压缩比检测
+
+        只读取文件头中的尺寸信息（heuristic模式），或者对从原图取出的几个小块做一次最快档位的
+        试探编码（probe模式）。预测不值得编码时返回预估的转换后大小，否则返回None。
+        source 为已读入内存的文件内容时从内存读取，不再读取磁盘。
+        """
+        # 达到该大小才算通过压缩比检测
+        target_size = original_size * (1 - self.min_compression_ratio)
+
+        info = self._image_info(image_path, source)
+        if info.frames > 1:
+            # 按单帧探测无法估计动画的大小，始终完整编码
+            return None
+        width, height = info.size
+        pixels = width * height
+
+        # 极小的图片（图标等）几乎不可能有收益
+        if pixels < self.predict_min_pixels:
+            return original_size
+
+        if self.predict == 'heuristic':
+            # 源文件每像素比特数已经低于目标编码器的典型下限，说明原图已压缩得很好
+            bpp = original_size * 8 / pixels
+            floor = PREDICT_BPP_FLOOR.get(info.format, 0.0)
+            if bpp * self.predict_margin < floor:
+                return int(floor * pixels / 8)
+            return None
+
+        # probe模式：取原始分辨率的小块用最快档位编码，按像素数放大估算完整编码的大小
+        with self._open_image(image_path, source) as img:
+            probe = self._probe_tiles(self._prepare_image(img))
+            probe_pixels = probe.size[0] * probe.size[1]
+            buffer = io.BytesIO()
+            self._save_image(probe, buffer, fast=True)
+
+        predicted_size = int(buffer.tell() * pixels / probe_pixels * PREDICT_PROBE_CORRECTION)
+        if predicted_size > target_size * self.predict_margin:
+            return predicted_size
+        return None
+
+    @staticmethod
+    def _probe_tiles(img: 'Image.Image') -> 'Image.Image':
+        """从图像中均匀取若干原始分辨率的小块拼成一张试探图，图像本身够小时直接返回"""
+        width, height = img.size
+        grid = PREDICT_PROBE_GRID
+        if width <= PREDICT_PROBE_SIZE * grid and height <= PREDICT_PROBE_SIZE * grid:
+            return img
+        tile_w = min(PREDICT_PROBE_SIZE, width // grid)
+        tile_h = min(PREDICT_PROBE_SIZE, height // grid)
+        probe = Image.new(img.mode, (tile_w * grid, tile_h * grid))
+        for i in range(grid):
+            for j in range(grid):
+                # 各小块位于原图按网格等分后每一格的中心
+                x = (width - tile_w) * (2 * i + 1) // (2 * grid)
+                y = (height - tile_h) * (2 * j + 1) // (2 * grid)
+                probe.paste(img.crop((x, y, x + tile_w, y + tile_h)), (i * tile_w, j * tile_h))
+        return probe
+
+    def _should_audit(self, image_path: Path) -> bool:
+        """按路径确定性地抽取一部分预测跳过的文件，仍做完整编码以检验预测准确率"""
+        key = self._relative_key(image_path).encode('utf-8')
+        return zlib.crc32(key) / 0xFFFFFFFF < self.predict_audit_rate
+
+    def _encode_signature(self) -> str:
+        """影响编码结果的全部参数，作为缓存键的一部分"""
+        signature = f'{self.format}:q{self.quality}:e{self.effort}:{self._encoder().version()}'
+        if self.format == 'avif' and self.encoder_settings.speed is not None:
+            signature += f':speed{self.encoder_settings.speed}'
+        if self.format == 'avif' and self.encoder_settings.tiles:
+            signature += f':tiles{self.encoder_settings.tiles}'
+        if self.target_ssim is not None:
+            low, high = self.quality_range
+            signature += f':ssim{self.target_ssim}:q{low}-{high}:s{self.search_steps}'
+        if self.analyze:
+            signature += ':analyze'
+        return signature
+
+    def _cache_key(self, source_hash: str) -> str:
+        """由源文件摘要和编码参数得到缓存键"""
+        return hashlib.sha256(f'{source_hash}:{self._encode_signature()}'.encode('utf-8')).hexdigest()
+
+    def _backup_path(self, image_path: Path) -> Path:
+        """原文件的备份位置"""
+        if self.backup_mode == 'dir':
+            return self.backup_dir / self._relative_key(image_path)
+        return image_path.with_suffix(f'{image_path.suffix}.backup')
+
+    def _create_backup(self, image_path: Path) -> Optional[Path]:
+        """按备份方式保存原文件，返回备份路径；不需要备份时返回None
+
+        编码结果通过 os.replace 原子地替换原文件，替换前原文件始终完整，
+        因此 --delete-backup 时不再先复制再删除。硬链接方式只增加一个目录项，
+        替换后旧的数据块由备份链接继续持有，不产生任何数据复制。
+        """
+        if self.backup_mode == 'none' or self.delete_backup:
+            return None
+
+        backup_path = self._backup_path(image_path)
+        if self.backup_mode == 'dir':
+            backup_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.backup_mode in ('hardlink', 'dir'):
+            try:
+                backup_path.unlink(missing_ok=True)
+                os.link(image_path, backup_path)
+                return backup_path
+            except OSError as e:
+                # 文件系统不支持硬链接或备份目录在其他设备上时，退回到完整复制
+                self.logger.debug(f"无法创建硬链接备份 {backup_path}: {e}，改为复制")
+
+        shutil.copy2(image_path, backup_path)
+        return backup_path
+
+    def _restore_backup(self, backup_path: Path, image_path: Path):
+        """用备份恢复原文件"""
+        try:
+            os.replace(backup_path, image_path)
+        except OSError:
+            # 备份目录与原文件不在同一设备上
+            shutil.copy2(backup_path, image_path)
+            backup_path.unlink()
+
+    def _test_compression(self, image_path: Path, original_size: int):
+        """测试转换压缩效果（预览模式使用，编码结果不保留）"""
+        try:
+            temp_path = self._encode_to_temp(image_path, stage='trial_encode')
+            try:
+                return self._evaluate_compression(original_size, temp_path.stat().st_size)
+            finally:
+                # 清理临时文件
+                temp_path.unlink(missing_ok=True)
+
+        except AnimationNotSupported:
+            return 'skip_animated'
+        except Exception as e:
+            self.logger.warning(f"测试压缩时出错 {image_path}: {str(e)}")
+            # 如果测试失败，假设转换有效
+            return original_size * 0.7, 30.0  # 估算70%大小，30%压缩率
+
+    def convert_image(self, image_path: Path) -> bool:
+        """转换单个图片到目标格式，保持原文件名
+
+        每个文件只解码、编码一次：编码结果先写入临时文件，
+        通过压缩比检测后再原子地替换原文件，否则直接丢弃。
+        """
+        temp_path = None
+        try:
+            # 获取原始文件信息
+            original_size = image_path.stat().st_size
+
+            self._count('total_original_size', original_size)
+
+            if self.dry_run:
+                # 在预览模式下，如果启用了压缩比检测，进行测试转换
+                if self.check_compression:
+                    test_result = self._test_compression(image_path, original_size)
+                    if test_result == 'skip_larger':
+                        self.logger.info(f"[预览] 跳过（体积会变大）: {image_path}")
+                        return False
+                    elif test_result == 'skip_minimal':
+                        self.logger.info(f"[预览] 跳过（压缩效果不明显）: {image_path}")
+                        return False
+                    elif test_result == 'skip_animated':
+                        self.logger.info(f"[预览] 跳过（{self.format.upper()}不支持动画）: {image_path}")
+                        return False
+                    else:
+                        predicted_size, compression_ratio = test_result
+                        self.logger.info(
+                            f"[预览] 将转换: {image_path} "
+                            f"({self._format_size(original_size)} -> {self._format_size(predicted_size)}, "
+                            f"预计压缩 {compression_ratio:.1f}%)"
+                        )
+                else:
+                    self.logger.info(f"[预览] 将转换: {image_path}")
+                return True
+
+            # 实际转换模式：先确认改名不会覆盖其他文件，在日志中记下开始处理，再用预测过滤掉没有希望的文件
+            self._check_rename_target(image_path)
+            self._journal_encoding(image_path)
+            prediction = self._check_prediction(image_path, original_size)
+            if prediction is Prediction.SKIPPED:
+                return False
+
+            # 内容相同的图片直接复用缓存中的编码结果，否则编码一次到临时文件
+            source_hash = _file_digest(image_path) if self.cache is not None else None
+            if source_hash is not None:
+                temp_path = self._fetch_cached(image_path, source_hash)
+            if temp_path is None:
+                temp_path = self._encode_to_temp(image_path)
+                if source_hash is not None:
+                    self._store_cached(image_path, source_hash, temp_path)
+            converted_size = temp_path.stat().st_size
+
+            if not self._accept_result(image_path, original_size, converted_size, source_hash, prediction):
+                return False
+            self._commit(image_path, temp_path, original_size, converted_size)
+            return True
+
+        except AnimationNotSupported as e:
+            self._skip_animation(image_path, e)
+            return False
+
+        except Exception as e:
+            self._conversion_failed(image_path, e)
+            return False
+
+        finally:
+            # 未被替换到原位置的编码结果（跳过或失败）需要清理
+            if temp_path is not None and temp_path.exists():
+                temp_path.unlink()
+
+    def _journal_encoding(self, image_path: Path):
+        """在日志中记下开始处理及可能创建的备份位置，中断后据此恢复"""
+        # 与记录的键一样相对于处理目录保存，换一个工作目录执行恢复时仍能找到
+        self._journal(image_path, 'encoding', format=self.format,
+                      backup=None if self.backup_mode == 'none' or self.delete_backup
+                      else Path(os.path.relpath(self._backup_path(image_path), self.directory)).as_posix(),
+                      output=self._relative_key(self._output_path(image_path)) if self.rename else None)
+
+    def _check_prediction(self, image_path: Path, original_size: int,
+                          source: Optional[bytes] = None) -> Prediction:
+        """用预测过滤掉没有希望的文件，被预测跳过的文件同时记录结果
+
+        source 为已读入内存的文件内容时，试探编码从内存解码。
+        """
+        if not self.check_compression or self.predict == 'off':
+            return Prediction.ENCODE
+
+        with self._stage('predict', image_path):
+            predicted_size = self._predict_skip(image_path, original_size, source)
+        if predicted_size is None:
+            return Prediction.ENCODE
+        if self._should_audit(image_path):
+            return Prediction.AUDIT
+
+        self._record_result('skip_predicted', original_size)
+        self.logger.info(f"跳过（预测压缩无效）: {image_path.name} "
+                         f"(预计 {self._format_size(predicted_size)})")
+        self._record_outcome(image_path, 'skip_predicted', predicted_size)
+        return Prediction.SKIPPED
+
+    def _fetch_cached(self, image_path: Path, source_hash: str) -> Optional[Path]:
+        """从编码缓存取出编码结果到临时文件，未命中时返回None"""
+        temp_path = self._new_temp_path(image_path)
+        with self._stage('cache', image_path):
+            hit = self.cache.get(self._cache_key(source_hash), temp_path)
+        self._count('cache_hits' if hit else 'cache_misses')
+        if hit:
+            self.logger.debug(f"缓存命中: {image_path}")
+            return temp_path
+        temp_path.unlink()
+        return None
+
+    def _store_cached(self, image_path: Path, source_hash: str, temp_path: Path):
+        """把编码结果写入编码缓存"""
+        with self._stage('cache', image_path):
+            self.cache.put(self._cache_key(source_hash), temp_path)
+
+    def _accept_result(self, image_path: Path, original_size: int, converted_size: int,
+                       source_hash: Optional[str], prediction: Prediction) -> bool:
+        """用编码结果做压缩比检测，不值得替换时记录跳过结果并返回False"""
+        if not self.check_compression:
+            return True
+
+        test_result = self._evaluate_compression(original_size, converted_size)
+        if self.predict != 'off':
+            actually_skipped = test_result in ('skip_larger', 'skip_minimal')
+            if prediction is Prediction.AUDIT:
+                # 抽查的预测跳过文件：实际能转换说明预测错误
+                self._count('predict_audited')
+                if not actually_skipped:
+                    self._count('predict_wrong')
+            elif actually_skipped:
+                # 预测值得编码，实际却被跳过
+                self._count('predict_missed')
+        if test_result == 'skip_larger':
+            self._record_result('skip_larger', original_size, converted_size)
+            self.logger.info(f"跳过（转换后体积更大）: {image_path.name}")
+            self._record_outcome(image_path, 'skip_larger', converted_size, source_hash)
+            return False
+        elif test_result == 'skip_minimal':
+            self._record_result('skip_minimal', original_size, converted_size)
+            self.logger.info(f"跳过（压缩效果不明显）: {image_path.name}")
+            self._record_outcome(image_path, 'skip_minimal', converted_size, source_hash)
+            return False
+        return True
+
+    def _commit(self, image_path: Path, temp_path: Path, original_size: int, converted_size: int):
+        """备份原文件，用编码结果原子地替换原文件并记录结果
+
+        出错时原文件已被替换则从本次创建的备份恢复，否则原文件未受影响，只需清理备份。
+        改名模式下编码结果写入新扩展名的文件，结果写入清单后才删除原文件；
+        新文件只在原文件仍在或能从备份恢复时删除，不会丢失图片。
+        """
+        output_path = self._output_path(image_path)
+        backup_path = None
+        replaced = False  # 原文件已被替换或删除
+        written = False  # 改名模式下新文件已写入
+        try:
+            # 备份原文件（硬链接或备份目录方式不复制数据）
+            with self._stage('backup', image_path):
+                backup_path = self._create_backup(image_path)
+            if backup_path is not None:
+                self.logger.debug(f"创建备份: {backup_path}")
+
+            # 保留原文件的权限，然后用编码结果原子地替换原文件
+            content_hash = _file_digest(temp_path) if self.manifest else None
+            with self._stage('write', image_path):
+                shutil.copymode(image_path, temp_path)
+                if self.fsync:
+                    _fsync_path(temp_path)
+                if output_path != image_path:
+                    # 不覆盖不是本次写入的文件，包括开始处理之后才出现的文件
+                    if output_path.exists():
+                        raise FileExistsError(f"目标文件已存在: {output_path}")
+                    os.replace(temp_path, output_path)
+                    written = True
+                else:
+                    os.replace(temp_path, output_path)
+                    replaced = True
+            # 先写入清单：写入失败时改名前的原文件仍在，可以安全回滚
+            self._record_manifest(image_path, 'converted', converted_size, content_hash, output_path)
+            with self._stage('write', image_path):
+                if output_path != image_path:
+                    image_path.unlink()
+                    replaced = True
+                if self.decode_cache is not None:
+                    self.decode_cache.forget(image_path)
+                if self.fsync:
+                    _fsync_path(image_path.parent)
+            self._journal(image_path, 'committed', outcome='converted')
+        except Exception:
+            restored = False
+            if backup_path is not None and backup_path.exists():
+                try:
+                    if replaced:
+                        self._restore_backup(backup_path, image_path)
+                        restored = True
+                        self.logger.info(f"已恢复原文件: {image_path}")
+                    else:
+                        backup_path.unlink()
+                except Exception as restore_error:
+                    self.logger.error(f"恢复原文件失败: {restore_error}")
+            # 新文件只在原文件仍在或已从备份恢复时删除，否则它是图片仅存的副本
+            if written and (not replaced or restored):
+                output_path.unlink(missing_ok=True)
+            raise
+
+        # 计算压缩比和节省空间
+        saved_size = original_size - converted_size
+        compression_ratio = (saved_size / original_size) * 100
+
+        self._record_result('converted', original_size, converted_size)
+
+        self.logger.info(
+            f"转换成功: {image_path.name} "
+            f"({self._format_size(original_size)} -> {self._format_size(converted_size)}, "
+            f"压缩 {compression_ratio:.1f}%)"
+        )
+
+    def _skip_animation(self, image_path: Path, reason: Exception):
+        """目标格式不支持动画时保留原文件，不把动画压成单帧"""
+        self._record_result('skip_animated')
+        self.logger.info(f"跳过（{reason}）: {image_path.name}")
+        self._record_outcome(image_path, 'skip_animated', 0)
+
+    def _conversion_failed(self, image_path: Path, error: Exception):
+        """记录转换失败"""
+        error_msg = f"转换失败 {image_path}: {str(error)}"
+        self.logger.error(error_msg)
+
+        self._record_result('failed', error=error_msg)
+        self._journal(image_path, 'failed', error=str(error))
+
+    def process_image(self, image_path: Path) -> bool:
+        """处理单个图片：原地转换，或在响应式变体模式下生成变体"""
+        if self.variants:
+            return self.generate_variants(image_path)
+        return self.convert_image(image_path)
+
+    def _variant_path(self, image_path: Path, width: int, format: str) -> Path:
+        """变体文件路径，例如 foo.png -> foo-960w.avif
+
+        同一目录中有同名不同扩展名的原图（如 foo.png 和 foo.jpg）时，
+        这些原图的变体名中都带上原扩展名（foo-png-960w.avif、foo-jpg-960w.avif），避免相互覆盖。
+        """
+        stem = image_path.stem
+        if self._has_stem_collision(image_path):
+            stem = f"{stem}-{image_path.suffix.lstrip('.').lower()}"
+        return image_path.with_name(f'{stem}-{width}w.{format}')
+
+    def _has_stem_collision(self, image_path: Path) -> bool:
+        """同一目录中是否还有主文件名相同的其他原图"""
+        for sibling in image_path.parent.glob(glob.escape(image_path.stem) + '.*'):
+            if (sibling != image_path and sibling.stem == image_path.stem and
+                    sibling.suffix.lower() in SUPPORTED_FORMATS and sibling.is_file()):
+                return True
+        return False
+
+    def generate_variants(self, image_path: Path) -> bool:
+        """为单个图片生成多个宽度、多种格式的响应式变体，原图保持不变
+
+        图片只解码和处理透明度一次，各宽度从同一份解码结果缩放，
+        每个缩放结果再依次编码为各个格式。所有变体都已存在且比原图新时直接复用。
+        """
+        try:
+            st = image_path.stat()
+            self._count('total_original_size', st.st_size)
+
+            with Image.open(image_path) as img:
+                if getattr(img, 'is_animated', False):
+                    # 缩放和编码都按单帧进行，动画不生成变体，避免被压成静态图片
+                    self._record_result('skip_animated', st.st_size)
+                    self.logger.info(f"跳过（响应式变体不支持动画）: {image_path.name}")
+                    return False
+
+                src_width, src_height = img.size
+                # 比原图宽的尺寸没有意义；原图比最大尺寸还窄时，按原图宽度输出一份
+                widths = sorted({w for w in self.variant_widths if w < src_width} |
+                                ({src_width} if src_width <= max(self.variant_widths) else set()))
+                outputs = [(w, fmt, self._variant_path(image_path, w, fmt))
+                           for w in widths for fmt in self.variant_formats]
+
+                up_to_date = all(path.exists() and path.stat().st_mtime >= st.st_mtime for _, _, path in outputs)
+                if self.dry_run:
+                    self.logger.info(f"[预览] 将生成 {len(outputs)} 个变体: {image_path}")
+                    return True
+
+                if not up_to_date:
+                    with self._stage('decode', image_path):
+                        img.load()
+                    with self._stage('mode_convert', image_path):
+                        prepared = self._prepare_image(img)
+
+                    for width in widths:
+                        height = max(1, round(src_height * width / src_width))
+                        with self._stage('resize', image_path):
+                            resized = prepared if width == src_width else prepared.resize(
+                                (width, height), Image.LANCZOS)
+                        for fmt in self.variant_formats:
+                            target = self._variant_path(image_path, width, fmt)
+                            temp_path = self._new_temp_path(target)
+                            try:
+                                with self._stage('encode', image_path):
+                                    self._save_image(resized, temp_path, format=fmt)
+                                with self._stage('write', image_path):
+                                    os.replace(temp_path, target)
+                            finally:
+                                temp_path.unlink(missing_ok=True)
+
+            entry = {
+                'width': src_width,
+                'height': src_height,
+                'size': st.st_size,
+                'variants': [],
+            }
+            for width, fmt, path in outputs:
+                size = path.stat().st_size
+                entry['variants'].append({
+                    'path': self._relative_key(path),
+                    'width': width,
+                    'height': max(1, round(src_height * width / src_width)),
+                    'format': fmt,
+                    'type': VARIANT_MIME_TYPES[fmt],
+                    'size': size,
+                })
+
+            variant_bytes = sum(v['size'] for v in entry['variants'])
+            state = self._worker_stats()
+            state.variants[self._relative_key(image_path)] = entry
+            state.results.append(FileResult('variants', st.st_size, variant_bytes))
+            if not up_to_date:
+                state.counters['variants_generated'] += len(outputs)
+
+            self.logger.info(
+                f"{'变体已是最新' if up_to_date else '生成变体'}: {image_path.name} "
+                f"({len(widths)} 个尺寸 × {len(self.variant_formats)} 种格式, 共 {self._format_size(variant_bytes)})"
+            )
+            return True
+
+        except Exception as e:
+            error_msg = f"生成变体失败 {image_path}: {str(e)}"
+            self.logger.error(error_msg)
+            self._record_result('failed', error=error_msg)
+            return False
+
+    def update_markdown_links(self):
+        """改名模式下把Markdown中的图片链接改为新扩展名"""
+        rewritten, changed = 0, 0
+        for md_file in self.markdown_files:
+            try:
+                count = rewrite_markdown_links(md_file, str(self.site_root), self.format)
+            except OSError as e:
+                self.logger.error(f"更新Markdown链接失败 {md_file}: {e}")
+                continue
+            if count:
+                rewritten += count
+                changed += 1
+                self.logger.info(f"更新链接: {md_file} ({count} 处)")
+        print(f"Markdown链接已更新: {changed} 个文档中的 {rewritten} 处引用")
+
+    def write_variants_sidecar(self, sidecar_path: str):
+        """写入原图到变体的映射，保留已有文件中本次未处理的条目，供 VitePress 构建生成 srcset"""
+        sidecar = {}
+        if os.path.exists(sidecar_path):
+            try:
+                with open(sidecar_path, encoding='utf-8') as f:
+                    sidecar = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"无法读取已有的变体映射 {sidecar_path}: {e}")
+        sidecar.update(self.stats['variants'])
+
+        temp_path = Path(f'{sidecar_path}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(sidecar.items())), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, sidecar_path)
+
+    @contextlib.contextmanager
+    def _stage(self, stage: str, image_path: Path):
+        """记录一个处理阶段的耗时"""
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - t0
+            state = self._worker_stats()
+            state.stage_times.setdefault(stage, []).append(duration)
+            if self.collect_events:
+                state.stage_events.append(
+                    (str(image_path), stage, started, duration, os.getpid(), threading.get_ident()))
+
+    def stage_summary(self) -> Dict[str, Dict]:
+        """汇总各阶段耗时：次数、总计、均值、百分位和对数分桶直方图（单位秒）"""
+        summary = {}
+        for stage, durations in self.stats['stage_times'].items():
+            histogram = dict.fromkeys(_histogram_labels(), 0)
+            for duration in durations:
+                histogram[_histogram_label(duration)] += 1
+            summary[stage] = {
+                'count': len(durations),
+                'total': sum(durations),
+                'mean': sum(durations) / len(durations),
+                'p50': _percentile(durations, 50),
+                'p95': _percentile(durations, 95),
+                'max': max(durations),
+                'histogram': histogram,
+            }
+        return summary
+
+    def bottleneck(self) -> Optional[str]:
+        """按阶段类别（I/O、解码、编码）的总耗时判断瓶颈"""
+        totals = {}
+        for stage, durations in self.stats['stage_times'].items():
+            category = STAGE_CATEGORIES.get(stage, 'io')
+            totals[category] = totals.get(category, 0) + sum(durations)
+        return max(totals, key=totals.get) if totals else None
+
+    def file_timings(self) -> List[Dict]:
+        """按文件汇总各阶段耗时，需要启用事件收集"""
+        files = {}
+        for path, stage, _, duration, _, _ in self.stats['stage_events']:
+            stages = files.setdefault(path, {})
+            stages[stage] = stages.get(stage, 0) + duration
+        return [{'file': path, 'stages': stages, 'total': sum(stages.values())}
+                for path, stages in files.items()]
+
+    def write_report_json(self, report_path: str):
+        """导出机器可读的运行报告"""
+        stats = {k: v for k, v in self.stats.items() if k not in ('stage_times', 'stage_events', 'variants')}
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'directory': str(self.directory),
+            'format': self.format,
+            'quality': self.quality,
+            'effort': self.effort,
+            'threads': self.threads,
+            'executor': self.executor,
+            'stats': stats,
+            'stages': self.stage_summary(),
+            'bottleneck': self.bottleneck(),
+            'files': self.file_timings(),
+        }
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    # 分片结果中保存的设置，合并时用于还原统计报告的显示方式
+    SHARD_SETTINGS = ('format', 'quality', 'effort', 'check_compression', 'min_compression_ratio', 'predict',
+                      'variants', 'variant_widths', 'variant_formats', 'target_ssim', 'analyze', 'resume')
+
+    def write_shard_report(self, report_path: str):
+        """导出自包含的分片结果，可用 merge-reports 子命令与其他分片合并"""
+        settings = {name: getattr(self, name) for name in self.SHARD_SETTINGS}
+        settings.update(manifest=self.manifest is not None, cache=self.cache is not None,
+                        decode_cache_bytes=self.decode_cache.max_bytes if self.decode_cache else 0)
+        report = {
+            'kind': 'image-convert-shard',
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'directory': str(self.directory),
+            'shard': list(self.shard) if self.shard else None,
+            'shard_by': self.shard_by,
+            'settings': settings,
+            'stats': {k: v for k, v in self.stats.items() if k != 'stage_events'},
+            # 单文件结果，合并时据此重新计算压缩率等统计
+            'results': [result.to_list() for result in self.results],
+        }
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+
+    @classmethod
+    def from_shard_reports(cls, reports: List[Dict]) -> 'ImageConverter':
+        """由多个分片结果重建一个只用于汇总统计的转换器（不扫描目录，不创建日志文件）"""
+        converter = cls.__new__(cls)
+        settings = reports[0]['settings']
+        for name in cls.SHARD_SETTINGS:
+            setattr(converter, name, settings[name])
+        converter.manifest = True if settings['manifest'] else None
+        converter.cache = True if settings['cache'] else None
+        converter.decode_cache = DecodeCache(settings['decode_cache_bytes']) if settings['decode_cache_bytes'] else None
+        converter.show_report = True
+        converter.stats = _new_stats()
+        converter.results = []
+        converter.stats_lock = threading.Lock()
+        converter.logger = logging.getLogger('avif_converter')
+        converter._reset_worker_stats()
+
+        for report in reports:
+            stats = report['stats']
+            for key in WORKER_COUNTERS + ('found_images', 'skipped_resumed', 'skipped_unchanged'):
+                converter.stats[key] += stats[key]
+            for fmt, count in stats['format_counts'].items():
+                converter.stats['format_counts'][fmt] = converter.stats['format_counts'].get(fmt, 0) + count
+            converter.stats['chosen_qualities'].extend(stats['chosen_qualities'])
+            converter.stats['variants'].update(stats['variants'])
+            for stage, durations in stats['stage_times'].items():
+                converter.stats['stage_times'].setdefault(stage, []).extend(durations)
+            converter.results.extend(FileResult(*result) for result in report['results'])
+            # 各分片并行运行，总耗时取最慢的分片
+            converter.stats['conversion_time'] = max(converter.stats['conversion_time'], stats['conversion_time'])
+        converter.stats.update(summarize_results(converter.results))
+        return converter
+
+    @classmethod
+    def encoder(cls, format: str = 'avif', quality: int = 80, effort: int = 7, analyze: bool = False,
+                target_ssim: Optional[float] = None, quality_range: Tuple[int, int] = (30, 95),
+                search_steps: int = 6, encoder: str = 'auto',
+                encoder_settings: EncoderSettings = EncoderSettings()) -> 'ImageConverter':
+        """创建只用于 encode_bytes 的转换器（不关联目录，不创建日志文件）"""
+        converter = cls.__new__(cls)
+        converter.format = format.lower()
+        converter.encoder = encoder
+        converter.encoder_settings = encoder_settings
+        converter.quality = quality
+        converter.effort = effort
+        converter.analyze = analyze
+        converter.target_ssim = target_ssim
+        converter.quality_range = tuple(quality_range)
+        converter.search_steps = search_steps
+        converter.decode_cache = None
+        converter.collect_events = False
+        converter.stats = _new_stats()
+        converter.results = []
+        converter.stats_lock = threading.Lock()
+        converter.logger = logging.getLogger('avif_converter')
+        converter._reset_worker_stats()
+        return converter
+
+    def encode_bytes(self, data: bytes, name: str = 'image') -> Tuple[bytes, Dict]:
+        """把内存中的图片编码为目标格式，返回 (编码结果, 指标)；不读写磁盘，也不计入转换统计"""
+        # 每次调用使用单独的统计记录，不登记到汇总列表，调用结束后随下一次调用丢弃
+        state = self._local.stats = WorkerStats()
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        self._encode_image(Path(name), buffer, source=data)
+        output = buffer.getvalue()
+        metrics = {
+            'format': self.format,
+            'original_size': len(data),
+            'converted_size': len(output),
+            'compression': (len(data) - len(output)) / len(data) * 100 if data else 0.0,
+            'quality': state.qualities[-1] if state.qualities else self.quality,
+            'lossless': state.counters['analysis_lossless'] > 0,
+            'animated': state.counters['animations'] > 0,
+            'elapsed': time.perf_counter() - started,
+            'stages': {stage: sum(durations) for stage, durations in state.stage_times.items()},
+        }
+        return output, metrics
+
+    def write_chrome_trace(self, trace_path: str):
+        """导出 Chrome trace 格式（chrome://tracing 或 Perfetto 可直接打开）"""
+        origin = getattr(self, 'run_started', 0)
+        events = [
+            {
+                'name': stage,
+                'cat': STAGE_CATEGORIES.get(stage, 'io'),
+                'ph': 'X',
+                'ts': (started - origin) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': {'file': path},
+            }
+            for path, stage, started, duration, pid, tid in self.stats['stage_events']
+        ]
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def _format_size(self, size_bytes: int) -> str:
+        """格式化文件大小"""
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size_bytes < 1024:
+                return f"{size_bytes:.1f} {unit}"
+            size_bytes /= 1024
+        return f"{size_bytes:.1f} TB"
+
+    def print_statistics(self):
+        """打印统计信息"""
+        if not self.show_report:
+            return
+
+        print("\n" + "=" * 70)
+        formats = '+'.join(self.variant_formats) if self.variants else self.format
+        print(f"图像转换报告 ({formats.upper()}格式)")
+        print("=" * 70)
+
+        # 基本统计信息
+        print(
+            f"处理完成 │ 找到图片: {self.stats['found_images']} │ 成功转换: {self.stats['converted']} │ 失败: {self.stats['failed']}")
+
+        # 显示跳过的文件统计
+        if self.check_compression and not self.variants:
+            total_skipped = self.stats['skipped_larger'] + self.stats['skipped_minimal']
+            print(
+                f"跳过文件 │ 总计: {total_skipped} │ 体积变大: {self.stats['skipped_larger']} │ 压缩效果不明显: {self.stats['skipped_minimal']}")
+
+        if self.manifest:
+            print(f"增量跳过 │ 清单中未变化的文件: {self.stats['skipped_unchanged']}")
+
+        if self.stats['animations'] or self.stats['skipped_animated']:
+            print(f"动画文件 │ 按动画编码: {self.stats['animations']} │ "
+                  f"格式不支持动画而跳过: {self.stats['skipped_animated']}")
+
+        if self.resume:
+            print(f"续跑跳过 │ 上次运行已处理的文件: {self.stats['skipped_resumed']}")
+
+        if self.variants:
+            print(f"响应式变体 │ 生成: {self.stats['variants_generated']} 个文件 │ "
+                  f"变体总大小: {self.stats['total_converted_size'] / (1024 * 1024):.2f} MB │ "
+                  f"尺寸: {', '.join(map(str, self.variant_widths))} │ 格式: {', '.join(self.variant_formats)}")
+
+        if self.target_ssim is not None and self.stats['chosen_qualities']:
+            qualities = self.stats['chosen_qualities']
+            print(f"自适应质量 │ 目标SSIM: {self.target_ssim} │ 平均质量: {sum(qualities) / len(qualities):.1f} │ "
+                  f"范围: {min(qualities)}-{max(qualities)} │ 候选编码: {self.stats['search_encodes']} 次")
+
+        if self.analyze:
+            print(f"图像分析 │ 无损编码: {self.stats['analysis_lossless']} │ 灰度: {self.stats['analysis_grayscale']} │ "
+                  f"丢弃未用透明通道: {self.stats['analysis_alpha_dropped']}")
+
+        if self.cache:
+            lookups = self.stats['cache_hits'] + self.stats['cache_misses']
+            hit_rate = self.stats['cache_hits'] / lookups if lookups else 0
+            print(f"编码缓存 │ 命中: {self.stats['cache_hits']} │ 未命中: {self.stats['cache_misses']} │ "
+                  f"命中率: {hit_rate:.1%}")
+
+        if self.decode_cache:
+            print(f"解码缓存 │ 命中: {self.stats['decode_cache_hits']} │ 实际解码: {self.stats['decode_cache_misses']} │ "
+                  f"预算: {self.decode_cache.max_bytes / (1024 * 1024):.0f} MB")
+
+        # 空间节省统计
+        if self.stats['total_original_size'] > 0 and not self.variants:
+            original_size_mb = self.stats['total_original_size'] / (1024 * 1024)
+
+            if self.stats['converted'] > 0:
+                converted_size_mb = self.stats['total_converted_size'] / (1024 * 1024)
+                saved_mb = self.stats['total_saved_size'] / (1024 * 1024)
+                saved_percent = (self.stats['total_saved_size'] / self.stats['total_original_size']) * 100
+
+                print("\n" + "-" * 70)
+                print("空间节省统计")
+                print("-" * 70)
+                print(f"原始总大小    : {original_size_mb:.2f} MB")
+                print(f"转换后总大小  : {converted_size_mb:.2f} MB")
+                print(f"节省空间      : {saved_mb:.2f} MB")
+                print(f"总体压缩率    : {saved_percent:.2f}%")
+
+                # 按文件计算的压缩率分布
+                print(f"平均压缩率    : {self.stats['avg_compression']:.2f}% "
+                      f"(最小 {self.stats['min_compression']:.2f}%, 最大 {self.stats['max_compression']:.2f}%)")
+                percentiles = self.stats['compression_percentiles']
+                if percentiles:
+                    print("压缩率分位数  : " + " │ ".join(f"{name.upper()} {value:.2f}%"
+                                                         for name, value in percentiles.items()))
+
+                # 显示格式统计信息
+                if self.stats['format_counts'] and len(self.stats['format_counts']) > 0:
+                    print("\n" + "-" * 70)
+                    print("原始图片格式统计")
+                    print("-" * 70)
+                    for fmt, count in sorted(self.stats['format_counts'].items(), key=lambda x: x[1], reverse=True):
+                        percent = (count / self.stats['found_images']) * 100 if self.stats['found_images'] > 0 else 0
+                        print(f"{fmt.upper():<10}: {count:>5} 个文件 ({percent:.1f}%)")
+
+        # 显示压缩比检测信息
+        if self.check_compression and not self.variants:
+            print("\n" + "-" * 70)
+            print("压缩检测设置")
+            print("-" * 70)
+            print(f"检测阈值      : {self.min_compression_ratio:.1%}")
+            print(f"跳过体积变大  : {self.stats['skipped_larger']} 个文件")
+            print(f"跳过效果不佳  : {self.stats['skipped_minimal']} 个文件")
+
+        # 显示预测过滤的效果和准确率
+        if self.check_compression and self.predict != 'off':
+            audited = self.stats['predict_audited']
+            wrong = self.stats['predict_wrong']
+            encoded = self.stats['converted'] + self.stats['skipped_larger'] + self.stats['skipped_minimal']
+            print("\n" + "-" * 70)
+            print(f"预测过滤 ({self.predict})")
+            print("-" * 70)
+            print(f"节省完整编码  : {self.stats['skipped_predicted']} 个文件")
+            if audited >= PREDICT_MIN_AUDIT_SAMPLES:
+                print(f"抽查预测跳过  : {audited} 个文件，其中误判 {wrong} 个 (误判率 {wrong / audited:.1%})")
+            else:
+                print(f"抽查预测跳过  : {audited} 个文件，其中误判 {wrong} 个"
+                      f"（样本少于 {PREDICT_MIN_AUDIT_SAMPLES} 个，不足以估计误判率）")
+            print(f"漏判          : {self.stats['predict_missed']} 个文件预测值得编码但实际被跳过" +
+                  (f" (占完整编码 {self.stats['predict_missed'] / encoded:.1%})" if encoded else ""))
+
+        # 显示各阶段耗时
+        summary = self.stage_summary()
+        if summary:
+            total_time = sum(item['total'] for item in summary.values())
+            print("\n" + "-" * 70)
+            print(f"阶段耗时 (总处理时间 {self.stats['conversion_time']:.2f} 秒)")
+            print("-" * 70)
+            print(f"{'阶段':<14}{'次数':>7}{'总计(s)':>10}{'平均(ms)':>10}{'P50(ms)':>10}{'P95(ms)':>10}{'占比':>8}")
+            for stage in sorted(summary, key=lambda k: summary[k]['total'], reverse=True):
+                item = summary[stage]
+                share = item['total'] / total_time if total_time else 0
+                print(f"{stage:<14}{item['count']:>7}{item['total']:>10.2f}{item['mean'] * 1000:>10.1f}"
+                      f"{item['p50'] * 1000:>10.1f}{item['p95'] * 1000:>10.1f}{share:>8.1%}")
+            print(f"瓶颈判断      : {BOTTLENECK_NAMES[self.bottleneck()]}")
+
+        # 显示错误信息
+        if self.stats['errors']:
+            print("\n" + "-" * 70)
+            print("错误列表")
+            print("-" * 70)
+            for error in self.stats['errors'][:5]:  # 只显示前5个错误
+                print(f"  - {error}")
+            if len(self.stats['errors']) > 5:
+                print(f"  ... 还有 {len(self.stats['errors']) - 5} 个错误")
+
+        # 总结报告
+        if self.variants:
+            print("\n" + "=" * 70)
+            print(f"总结: 为 {self.stats['converted']} 个图片生成了响应式变体，"
+                  f"新写入 {self.stats['variants_generated']} 个文件")
+        elif self.stats['total_original_size'] > 0 and self.stats['converted'] > 0:
+            saved_mb = self.stats['total_saved_size'] / (1024 * 1024)
+            saved_percent = (self.stats['total_saved_size'] / self.stats['total_original_size']) * 100
+
+            print("\n" + "=" * 70)
+            print(
+                f"总结: 成功将 {self.stats['converted']} 个图片转换为 {self.format.upper()} 格式，节省了 {saved_mb:.2f} MB 空间 ({saved_percent:.2f}%)")
+        else:
+            print("\n" + "=" * 70)
+            print(f"总结: 没有成功转换任何图片")
+
+        print("=" * 70)
+
+    def convert_all(self):
+        """转换所有图片
+
+        扫描与转换以流水线方式进行：目录扫描器边发现边产出图片，
+        转换任务通过有界窗口提交给执行器，不会一次性为所有文件创建任务。
+        """
+        start_time = time.time()  # 记录开始时间
+        self.run_started = start_time
+
+        if self.dry_run:
+            images = self.find_images()
+            if not images:
+                print("没有找到需要转换的图片文件")
+                return
+
+            print(f"\n[预览模式] 将要转换 {len(images)} 个图片文件:")
+            for img in images[:10]:  # 只显示前10个
+                print(f"  - {img}")
+            if len(images) > 10:
+                print(f"  ... 还有 {len(images) - 10} 个文件")
+            print("\n使用 --execute 参数执行实际转换")
+            return
+
+        if self.journal is not None:
+            self.recover()
+
+        if self.shard is not None and self.shard_by == 'size':
+            # 按大小均衡需要完整的文件列表，先列出目录（只读取文件大小）再处理本分片的文件
+            self.files = [str(path) for path in self._assign_size_shard()]
+            print(f"分片 {self.shard[0]}/{self.shard[1]}：按文件大小分配到 {len(self.files)} 个文件")
+
+        print("\n开始转换图片文件（边扫描边转换）...")
+
+        # 异步流水线：文件读写与编码在各自的线程池中重叠进行
+        if self.executor == 'async':
+            print(f"使用异步流水线处理图片：{self.threads} 个编码线程，{self.io_workers} 个I/O线程，"
+                  f"预读 {self.prefetch} 个文件...")
+            with tqdm(total=0, desc="图片转换进度", unit="个") as pbar:
+                import asyncio
+
+                asyncio.run(self._run_async(pbar))
+        # 单线程处理
+        elif self.threads <= 1:
+            for i, image_path in enumerate(self.iter_images(), 1):
+                print(f"[{i}] 处理: {image_path.name}")
+                self._journal(image_path, 'pending')
+                self.process_image(image_path)
+        else:
+            # 多进程处理，绕开GIL，适合CPU密集的解码和编码
+            if self.executor == 'process':
+                print(f"使用 {self.threads} 个进程并行处理图片...")
+                # 子进程通过初始化函数获得转换器副本，任务只传递可序列化的路径字符串
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.threads,
+                    initializer=_init_process_worker,
+                    initargs=(self,))
+            # 多线程处理
+            else:
+                print(f"使用 {self.threads} 个线程并行处理图片...")
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+            # 使用tqdm创建进度条，总数随扫描进度增长
+            with tqdm(total=0, desc="图片转换进度", unit="个") as pbar, executor:
+                self._run_pipeline(executor, pbar)
+
+        self._aggregate_stats()
+        if self.stats['found_images'] == 0:
+            print("没有找到需要转换的图片文件")
+        if self.journal is not None:
+            # 所有文件都已到达终态，日志不再需要
+            self.journal.remove()
+
+        # 记录总处理时间
+        end_time = time.time()
+        self.stats['conversion_time'] = end_time - start_time
+
+        if self.variants and self.stats['variants']:
+            self.write_variants_sidecar(self.variants_sidecar)
+            print(f"变体映射已写入: {self.variants_sidecar}")
+
+        if self.rename and self.markdown_files:
+            self.update_markdown_links()
+
+        if self.shard_report:
+            self.write_shard_report(self.shard_report)
+            print(f"分片结果已写入: {self.shard_report}")
+
+        self.print_statistics()
+        if self.report_json:
+            self.write_report_json(self.report_json)
+            print(f"运行报告已写入: {self.report_json}")
+        if self.trace_json:
+            self.write_chrome_trace(self.trace_json)
+            print(f"Chrome trace 已写入: {self.trace_json}")
+
+    def watch(self, debounce: float = 1.0, poll_interval: Optional[float] = None):
+        """监视模式：先完整处理一次目录，之后只把新增或修改的图片交给常驻的执行器，直到 Ctrl-C
+
+        写入完成的文件按批次经过与目录扫描相同的筛选（清单、分片、已是目标格式等），
+        转换后的文件替换原文件时触发的事件会因已是目标格式而被跳过。
+        """
+        self.convert_all()
+        # 续跑只影响第一次完整处理，之后被修改的文件需要重新处理
+        self.resume_done = set()
+
+        watcher = ImageWatcher(self, debounce, poll_interval)
+        if self.executor == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.threads, initializer=_init_process_worker, initargs=(self,))
+        else:
+            # 异步模式的流水线面向批量处理，监视模式中改用线程池
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+        # 正在处理的文件数；降为0时所有记录都已到达终态，清空日志，避免长时间监视时日志无限增长
+        in_flight = [0]
+        in_flight_lock = threading.Lock()
+
+        def finished(_future):
+            with in_flight_lock:
+                in_flight[0] -= 1
+                if in_flight[0] == 0 and self.journal is not None:
+                    self.journal.truncate()
+
+        watcher.start()
+        print(f"\n正在监视 {self.directory}（{watcher.backend}，防抖 {debounce} 秒），按 Ctrl-C 退出...")
+        start_time = time.time()
+        try:
+            while True:
+                ready = watcher.wait_ready()
+                self.files = [str(path) for path in ready]
+                for image_path in self.iter_images():
+                    with in_flight_lock:
+                        in_flight[0] += 1
+                        self._journal(image_path, 'pending')
+                    if self.executor == 'process':
+                        future = executor.submit(_process_worker, str(image_path))
+                        future.add_done_callback(lambda f, path=image_path: self._collect_result(f, path))
+                    else:
+                        future = executor.submit(self._convert_thread_worker, image_path)
+                    future.add_done_callback(finished)
+        except KeyboardInterrupt:
+            print("\n停止监视，等待正在处理的文件完成...")
+        finally:
+            watcher.stop()
+            executor.shutdown(wait=True, cancel_futures=True)
+        if self.journal is not None:
+            self.journal.remove()
+
+        self._aggregate_stats()
+        self.stats['conversion_time'] += time.time() - start_time
+        self.print_statistics()
+
+    def _run_pipeline(self, executor: concurrent.futures.Executor, pbar: tqdm):
+        """从扫描器取出图片并提交转换，正在执行和排队的任务数不超过窗口大小
+
+        设置了内存预算时，由 MemoryScheduler 按预估峰值内存准入任务，并在扫描器
+        领先的一个窗口内重新排序，使大图和小图交错执行。
+        """
+        max_pending = self.threads * PIPELINE_DEPTH
+        scheduler = MemoryScheduler(self.max_memory)
+        images = self.iter_images()
+        exhausted = False
+        pending = {}
+
+        def collect():
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                image_path, estimate = pending.pop(future)
+                scheduler.release(estimate)
+                self._collect_result(future, image_path)
+                pbar.update(1)
+
+        try:
+            while True:
+                # 扫描器领先于执行的文件数不超过窗口大小
+                while not exhausted and len(scheduler) < max_pending:
+                    image_path = next(images, None)
+                    if image_path is None:
+                        exhausted = True
+                        break
+                    scheduler.add(image_path, self._estimate_memory(image_path))
+                    pbar.total = self.stats['found_images']
+                    pbar.refresh()
+
+                job = scheduler.pop() if len(pending) < max_pending else None
+                if job is not None:
+                    image_path, estimate = job
+                    self._journal(image_path, 'pending')
+                    if self.executor == 'process':
+                        future = executor.submit(_process_worker, str(image_path))
+                    else:
+                        future = executor.submit(self._convert_thread_worker, image_path)
+                    pending[future] = job
+                    continue
+
+                if not pending:
+                    break
+                # 窗口已满或剩余内存不足时，等待至少一个任务完成
+                collect()
+        except KeyboardInterrupt:
+            # 取消尚未开始的任务，正在处理的文件在日志中保持未完成状态，续跑时恢复
+            for future in pending:
+                future.cancel()
+            raise
+
+    def _estimate_memory(self, image_path: Path) -> int:
+        """预估转换一个图片的峰值内存；未设置内存预算时不读取文件头"""
+        if self.max_memory is None:
+            return 0
+        try:
+            return estimate_peak_memory(self._image_info(image_path), self.format, self.analyze)
+        except Exception:
+            # 无法读取文件头的文件在转换时会失败，不占用预算
+            return 0
+
+    def _next_candidate(self, images: Iterator[Path]) -> Optional[Tuple[Path, int]]:
+        """从扫描器取出下一个图片及其预估内存"""
+        image_path = next(images, None)
+        if image_path is None:
+            return None
+        return image_path, self._estimate_memory(image_path)
+
+    async def _run_async(self, pbar: tqdm):
+        """异步流水线
+
+        文件读取、编码结果写回和备份在I/O线程池中进行，解码和编码在编码线程池中进行，
+        两者的并发数分别由 io_workers 和 threads 控制。同时在处理中的文件（包括已读入内存
+        等待编码的文件）不超过 threads + prefetch 个，从而限制内存中的文件缓冲区数量；
+        设置了内存预算时还由 MemoryScheduler 按预估峰值内存准入。
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='io')
+        cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='encode')
+        window = self.threads + self.prefetch
+        scheduler = MemoryScheduler(self.max_memory)
+        images = self.iter_images()
+        exhausted = False
+        tasks = {}
+
+        def run_io(fn, *args):
+            return loop.run_in_executor(io_pool, fn, *args)
+
+        def run_cpu(fn, *args):
+            return loop.run_in_executor(cpu_pool, fn, *args)
+
+        try:
+            while True:
+                while not exhausted and len(scheduler) < window:
+                    # 目录扫描和读取文件头会阻塞，放到I/O线程中进行
+                    candidate = await run_io(self._next_candidate, images)
+                    if candidate is None:
+                        exhausted = True
+                        break
+                    scheduler.add(*candidate)
+                    pbar.total = self.stats['found_images']
+                    pbar.refresh()
+
+                job = scheduler.pop() if len(tasks) < window else None
+                if job is not None:
+                    self._journal(job[0], 'pending')
+                    tasks[asyncio.create_task(self._convert_async(job[0], run_io, run_cpu))] = job
+                    continue
+
+                if not tasks:
+                    break
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scheduler.release(tasks.pop(task)[1])
+                    pbar.update(1)
+        finally:
+            io_pool.shutdown(wait=True, cancel_futures=True)
+            cpu_pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _convert_async(self, image_path: Path, run_io, run_cpu) -> bool:
+        """异步模式下转换单个图片，步骤与 convert_image 相同
+
+        原文件先整个读入内存，编码线程从内存解码，编码结果同样先留在内存中，
+        写入临时文件、备份和替换原文件都交给I/O线程。
+        """
+        if self.variants:
+            return await run_cpu(self.generate_variants, image_path)
+
+        temp_path = None
+        try:
+            source = await run_io(self._read_source, image_path)
+            original_size = len(source)
+            self._count('total_original_size', original_size)
+
+            await run_io(self._check_rename_target, image_path)
+            await run_io(self._journal_encoding, image_path)
+            prediction = await run_cpu(self._check_prediction, image_path, original_size, source)
+            if prediction is Prediction.SKIPPED:
+                return False
+
+            source_hash = None
+            if self.cache is not None:
+                source_hash = hashlib.sha256(source).hexdigest()
+                temp_path = await run_io(self._fetch_cached, image_path, source_hash)
+            if temp_path is None:
+                buffer = io.BytesIO()
+                await run_cpu(self._encode_image, image_path, buffer, 'encode', source)
+                # 原文件内容已不再需要，尽早释放
+                source = None
+                temp_path = await run_io(self._write_temp, image_path, buffer.getvalue(), source_hash)
+            converted_size = temp_path.stat().st_size
+
+            if not await run_io(self._accept_result, image_path, original_size, converted_size,
+                                source_hash, prediction):
+                return False
+            await run_io(self._commit, image_path, temp_path, original_size, converted_size)
+            return True
+
+        except AnimationNotSupported as e:
+            await run_io(self._skip_animation, image_path, e)
+            return False
+
+        except Exception as e:
+            self._conversion_failed(image_path, e)
+            return False
+
+        finally:
+            # 未被替换到原位置的编码结果（跳过或失败）需要清理
+            if temp_path is not None and temp_path.exists():
+                temp_path.unlink()
+
+    def _read_source(self, image_path: Path) -> bytes:
+        """把原文件整个读入内存"""
+        with self._stage('read', image_path):
+            return image_path.read_bytes()
+
+    def _write_temp(self, image_path: Path, data: bytes, source_hash: Optional[str]) -> Path:
+        """把内存中的编码结果写入同目录下的临时文件，并存入编码缓存"""
+        temp_path = self._new_temp_path(image_path)
+        try:
+            with self._stage('write', image_path):
+                temp_path.write_bytes(data)
+            if source_hash is not None:
+                self._store_cached(image_path, source_hash, temp_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return temp_path
+
+    def _collect_result(self, future: concurrent.futures.Future, image_path: Path):
+        """处理一个已完成的转换任务"""
+        if self.executor != 'process':
+            # 线程工作函数已自行处理异常并更新统计信息
+            return
+
+        try:
+            _, _, states = future.result()
+            with self.stats_lock:
+                self._worker_stats_list.extend(states)
+        except Exception as e:
+            # 子进程崩溃等无法返回结果的情况
+            error_msg = f"进程处理错误 {image_path}: {str(e)}"
+            self.logger.error(error_msg)
+            self._record_result('failed', error=error_msg)
+
+    def _convert_thread_worker(self, image_path):
+        """线程工作函数，负责转换单个图片"""
+        try:
+            # 获取图片名称，用于日志显示
+            image_name = image_path.name
+
+            # 转换图片
+            success = self.process_image(image_path)
+
+            # 由于多线程环境，不在控制台打印信息，所有信息由日志和进度条处理
+            return success
+        except Exception as e:
+            # 捕获线程中的所有异常
+            error_msg = f"线程处理错误 {image_path}: {str(e)}"
+            self.logger.error(error_msg)
+            self._record_result('failed', error=error_msg)
+            return False
+
+
+def _new_stats() -> Dict:
+    """创建一份空的统计信息字典"""
+    return {
+        'found_images': 0,
+        'converted': 0,
+        'failed': 0,
+        'skipped_larger': 0,  # 因体积变大而跳过的文件
+        'skipped_minimal': 0,  # 因压缩效果不明显而跳过的文件
+        'skipped_animated': 0,  # 目标格式不支持动画而跳过的动画文件
+        'animations': 0,  # 按动画编码的文件
+        'skipped_resumed': 0,  # 续跑时上次运行已处理而跳过的文件
+        'skipped_unchanged': 0,  # 清单中记录过且未变化而跳过的文件
+        'skipped_predicted': 0,  # 预测压缩无效而跳过完整编码的文件
+        'predict_audited': 0,  # 预测跳过但被抽查、仍做了完整编码的文件
+        'predict_wrong': 0,  # 抽查中实际可以转换的文件（预测错误）
+        'predict_missed': 0,  # 预测值得编码但实际被跳过的文件
+        'cache_hits': 0,  # 命中编码缓存、无需编码的文件
+        'cache_misses': 0,  # 未命中编码缓存的文件
+        'decode_cache_hits': 0,  # 解码缓存命中次数
+        'decode_cache_misses': 0,  # 解码缓存未命中（实际解码）次数
+        'variants_generated': 0,  # 生成的响应式变体文件数
+        'variants': {},  # 原图相对路径 -> 变体信息，用于写入变体映射文件
+        'search_encodes': 0,  # 自适应质量搜索中的候选编码次数
+        'chosen_qualities': [],  # 自适应质量搜索为每个图片选定的质量
+        'analysis_lossless': 0,  # 图像分析后选择无损编码的文件
+        'analysis_grayscale': 0,  # 图像分析后按灰度编码的文件
+        'analysis_alpha_dropped': 0,  # 图像分析后丢弃未使用透明通道的文件
+        'total_original_size': 0,
+        'total_converted_size': 0,
+        'total_saved_size': 0,  # 总节省空间
+        'format_counts': {},  # 各种格式的统计
+        'conversion_time': 0,  # 总转换时间
+        'max_compression': 0,  # 最大压缩率
+        'min_compression': 100,  # 最小压缩率
+        'avg_compression': 0,  # 平均压缩率
+        'compression_percentiles': {},  # 压缩率百分位，如 {'p50': 35.2}
+        'stage_times': {},  # 各处理阶段的耗时列表（秒）
+        'stage_events': [],  # 计时事件 (文件, 阶段, 开始时间, 耗时, 进程号, 线程号)，仅在需要导出时收集
+        'errors': []
+    }
+
+
+# 进程池中每个子进程持有的转换器副本
+_worker_converter = None
+
+
+def _init_process_worker(converter: 'ImageConverter'):
+    """进程池初始化函数，保存父进程传来的转换器"""
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _process_worker(path: str) -> Tuple[str, bool, List[WorkerStats]]:
+    """进程池工作函数，转换单个图片并返回该文件的统计记录"""
+    converter = _worker_converter
+    # 每个任务使用独立的统计记录，由父进程在结束时统一汇总
+    converter._reset_worker_stats()
+    success = converter._convert_thread_worker(Path(path))
+    return path, success, converter._worker_stats_list
+
+
+def _benchmark_encode(converter: 'ImageConverter', path: str) -> Tuple[float, int, int]:
+    """基准测试中编码单个图片，返回 (耗时秒数, 原始大小, 编码后大小)，编码结果不保留"""
+    image_path = Path(path)
+    start = time.perf_counter()
+    temp_path = converter._encode_to_temp(image_path)
+    elapsed = time.perf_counter() - start
+    try:
+        return elapsed, image_path.stat().st_size, temp_path.stat().st_size
+    finally:
+        temp_path.unlink()
+
+
+def _benchmark_process_worker(path: str) -> Tuple[float, int, int]:
+    """进程池中的基准测试工作函数"""
+    return _benchmark_encode(_worker_converter, path)
+
+
+class _PeakRssSampler:
+    """后台线程定期采样本进程及其子进程的常驻内存，记录峰值（字节）"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _rss(self, pid) -> int:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            total = self._rss('self') + sum(self._rss(p.pid) for p in multiprocessing.active_children())
+            self.peak = max(self.peak, total)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # 没有 /proc 的平台退回到进程生命周期内的最大常驻内存
+        if self.peak == 0:
+            import resource
+            scale = 1 if sys.platform == 'darwin' else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class ImageAnalysis(NamedTuple):
+    """解码后图像的统计特征"""
+    colors: int  # 不同颜色的数量（大图按采样计算）
+    grayscale: bool  # 各像素的RGB分量是否几乎相等
+    has_alpha: bool  # 图像是否带透明通道
+    alpha_used: bool  # 透明通道中是否存在不透明以外的值
+    edge_density: float  # 亮度梯度超过阈值的像素比例
+
+
+def analyze_image(img: 'Image.Image') -> ImageAnalysis:
+    """用NumPy对解码后的图像做向量化分析（输入为 RGB、RGBA、L 或 LA 模式）"""
+    import numpy as np
+
+    pixels = np.asarray(img)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, np.newaxis]
+
+    # 大图按固定步长采样，控制分析耗时
+    height, width = pixels.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(height * width / ANALYSIS_MAX_SAMPLES))))
+    sample = pixels[::step, ::step]
+
+    channels = sample.shape[2]
+    has_alpha = img.mode in ('RGBA', 'LA')
+    color_channels = sample[:, :, :channels - 1] if has_alpha else sample
+    alpha_used = bool(has_alpha and (sample[:, :, -1] != 255).any())
+
+    if color_channels.shape[2] >= 3:
+        rgb = color_channels[:, :, :3].astype(np.int16)
+        grayscale = bool(
+            (np.abs(rgb[:, :, 0] - rgb[:, :, 1]) <= ANALYSIS_GRAY_TOLERANCE).all() and
+            (np.abs(rgb[:, :, 1] - rgb[:, :, 2]) <= ANALYSIS_GRAY_TOLERANCE).all()
+        )
+        luma = rgb.mean(axis=2)
+    else:
+        grayscale = True
+        luma = color_channels[:, :, 0].astype(np.int16)
+
+    # 把每个像素的所有通道打包成一个整数后统计不同值的数量
+    packed = np.zeros(sample.shape[:2], dtype=np.uint32)
+    for c in range(channels):
+        packed = (packed << 8) | sample[:, :, c].astype(np.uint32)
+    colors = int(np.unique(packed).size)
+
+    gx = np.abs(np.diff(luma, axis=1))[:-1, :] > ANALYSIS_EDGE_THRESHOLD
+    gy = np.abs(np.diff(luma, axis=0))[:, :-1] > ANALYSIS_EDGE_THRESHOLD
+    edge_density = float((gx | gy).mean()) if gx.size else 0.0
+
+    return ImageAnalysis(colors, grayscale, has_alpha, alpha_used, edge_density)
+
+
+def _luma_plane(img: 'Image.Image', shape: Optional[Tuple[int, int]] = None) -> 'np.ndarray':
+    """取图像的亮度平面并缩小到不超过 SSIM_MAX_SIDE，返回float64数组
+
+    shape 指定时缩放到与参考平面相同的尺寸 (高, 宽)。
+    """
+    import numpy as np
+
+    luma = img.convert('L')
+    if shape is None:
+        luma.thumbnail((SSIM_MAX_SIDE, SSIM_MAX_SIDE), Image.BILINEAR)
+    elif luma.size != (shape[1], shape[0]):
+        luma = luma.resize((shape[1], shape[0]), Image.BILINEAR)
+    return np.asarray(luma, dtype=np.float64)
+
+
+def _box_filter(plane: 'np.ndarray', size: int) -> 'np.ndarray':
+    """用积分图计算每个 size×size 窗口的均值（只保留完整窗口）"""
+    import numpy as np
+
+    integral = np.pad(plane, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    window_sum = (integral[size:, size:] - integral[:-size, size:]
+                  - integral[size:, :-size] + integral[:-size, :-size])
+    return window_sum / (size * size)
+
+
+def ssim(reference: 'np.ndarray', candidate: 'np.ndarray', window: int = 7) -> float:
+    """计算两个亮度平面的平均结构相似度（SSIM），取值越接近1越相似"""
+    if min(reference.shape) < window:
+        window = max(1, min(reference.shape))
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    mu_x = _box_filter(reference, window)
+    mu_y = _box_filter(candidate, window)
+    sigma_x = _box_filter(reference * reference, window) - mu_x * mu_x
+    sigma_y = _box_filter(candidate * candidate, window) - mu_y * mu_y
+    sigma_xy = _box_filter(reference * candidate, window) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / \
+               ((mu_x * mu_x + mu_y * mu_y + c1) * (sigma_x + sigma_y + c2))
+    return float(ssim_map.mean())
+
+
+def _histogram_labels() -> List[str]:
+    """耗时直方图各分桶的名称"""
+    labels = [f'<{bound * 1000:g}ms' for bound in HISTOGRAM_BOUNDS]
+    labels.append(f'>={HISTOGRAM_BOUNDS[-1] * 1000:g}ms')
+    return labels
+
+
+def _histogram_label(duration: float) -> str:
+    """返回耗时所在的直方图分桶"""
+    for bound in HISTOGRAM_BOUNDS:
+        if duration < bound:
+            return f'<{bound * 1000:g}ms'
+    return f'>={HISTOGRAM_BOUNDS[-1] * 1000:g}ms'
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """计算百分位数（线性插值）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * percent / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def generate_synthetic_corpus(directory: Path, count: int, seed: int = 0) -> List[Path]:
+    """生成合成测试图片：照片类渐变+噪点、截图类色块和文字线条，
+    覆盖 PNG/JPEG/GIF 以及 RGB、RGBA、灰度和调色板（含透明）模式"""
+    from PIL import ImageDraw
+
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    kinds = ['photo_jpeg', 'screenshot_png', 'alpha_png', 'palette_png', 'gray_png', 'palette_gif']
+    paths = []
+
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        width, height = rng.randint(320, 1600), rng.randint(240, 1200)
+
+        if kind == 'photo_jpeg':
+            # 渐变叠加噪点，近似照片的高频细节
+            base = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+            noise = Image.effect_noise((width, height), rng.randint(20, 60)).convert('RGB')
+            img = Image.blend(base, noise, 0.4)
+        else:
+            # 平坦色块和细线，近似界面截图和示意图
+            img = Image.new('RGB', (width, height), tuple(rng.randint(200, 255) for _ in range(3)))
+            draw = ImageDraw.Draw(img)
+            for _ in range(rng.randint(10, 40)):
+                x0, y0 = rng.randint(0, width - 1), rng.randint(0, height - 1)
+                x1, y1 = min(width, x0 + rng.randint(10, 300)), min(height, y0 + rng.randint(5, 120))
+                draw.rectangle([x0, y0, x1, y1], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+            for y in range(0, height, rng.randint(14, 24)):
+                draw.line([(rng.randint(0, 40), y), (rng.randint(width // 3, width), y)], fill=(20, 20, 20))
+
+        if kind == 'photo_jpeg':
+            path = directory / f'synthetic_{i:04d}.jpg'
+            img.save(path, 'JPEG', quality=rng.randint(80, 95))
+        elif kind == 'screenshot_png':
+            path = directory / f'synthetic_{i:04d}.png'
+            img.save(path, 'PNG')
+        elif kind == 'alpha_png':
+            path = directory / f'synthetic_{i:04d}.png'
+            img = img.convert('RGBA')
+            img.putalpha(Image.linear_gradient('L').resize((width, height)))
+            img.save(path, 'PNG')
+        elif kind == 'palette_png':
+            path = directory / f'synthetic_{i:04d}.png'
+            img = img.convert('P', palette=Image.ADAPTIVE, colors=64)
+            img.info['transparency'] = 0
+            img.save(path, 'PNG', transparency=0)
+        elif kind == 'gray_png':
+            path = directory / f'synthetic_{i:04d}.png'
+            img.convert('L').save(path, 'PNG')
+        else:
+            path = directory / f'synthetic_{i:04d}.gif'
+            img.convert('P', palette=Image.ADAPTIVE, colors=128).save(path, 'GIF')
+        paths.append(path)
+
+    return paths
+
+
+def sample_corpus(source: Path, directory: Path, count: int, seed: int = 0) -> List[Path]:
+    """从目录树中随机抽取图片复制到工作目录，基准测试不会修改原目录"""
+    candidates = []
+    for root, _, files in os.walk(source):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in SUPPORTED_FORMATS:
+                candidates.append(Path(root) / name)
+    candidates.sort()
+
+    rng = random.Random(seed)
+    chosen = rng.sample(candidates, min(count, len(candidates)))
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i, path in enumerate(chosen):
+        target = directory / f'{i:04d}_{path.name}'
+        shutil.copy2(path, target)
+        paths.append(target)
+    return paths
+
+
+def run_benchmark(corpus: List[Path], workdir: Path, formats: List[str], qualities: List[int],
+                  efforts: List[int], workers: List[int], executor: str = 'thread') -> List[Dict]:
+    """在给定语料上遍历 格式 × 质量 × 速度等级 × 并行数 的组合，测量编码路径的性能"""
+    results = []
+    paths = [str(p) for p in corpus]
+    input_bytes = sum(p.stat().st_size for p in corpus)
+
+    for fmt in formats:
+        # effort 只对JXL有效，其他格式只测一次
+        fmt_efforts = efforts if fmt == 'jxl' else efforts[:1]
+        for quality in qualities:
+            for effort in fmt_efforts:
+                converter = ImageConverter(str(workdir), format=fmt, quality=quality, effort=effort,
+                                           threads=max(workers), executor=executor, quiet=True)
+                for num_workers in workers:
+                    latencies, original_total, encoded_total, failed = [], 0, 0, 0
+
+                    if executor == 'process':
+                        pool = concurrent.futures.ProcessPoolExecutor(
+                            max_workers=num_workers, initializer=_init_process_worker, initargs=(converter,))
+                        submit = lambda p: pool.submit(_benchmark_process_worker, p)
+                    else:
+                        pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+                        submit = lambda p: pool.submit(_benchmark_encode, converter, p)
+
+                    with _PeakRssSampler() as sampler, pool:
+                        start = time.perf_counter()
+                        for future in concurrent.futures.as_completed([submit(p) for p in paths]):
+                            try:
+                                elapsed, original_size, encoded_size = future.result()
+                            except Exception as e:
+                                converter.logger.warning(f"基准测试编码失败: {e}")
+                                failed += 1
+                                continue
+                            latencies.append(elapsed)
+                            original_total += original_size
+                            encoded_total += encoded_size
+                        wall = time.perf_counter() - start
+
+                    encoded_count = len(latencies)
+                    results.append({
+                        'format': fmt,
+                        'quality': quality,
+                        'effort': effort if fmt == 'jxl' else None,
+                        'workers': num_workers,
+                        'executor': executor,
+                        'images': encoded_count,
+                        'failed': failed,
+                        'wall_seconds': wall,
+                        'images_per_second': encoded_count / wall if wall else 0.0,
+                        'mb_per_second': input_bytes / (1024 * 1024) / wall if wall else 0.0,
+                        'p50_ms': _percentile(latencies, 50) * 1000,
+                        'p95_ms': _percentile(latencies, 95) * 1000,
+                        'peak_rss_mb': sampler.peak / (1024 * 1024),
+                        'original_bytes': original_total,
+                        'encoded_bytes': encoded_total,
+                        'compression_ratio': (1 - encoded_total / original_total) if original_total else 0.0,
+                        # 每秒节省的字节数，用于比较“吞吐量/节省空间”的综合效率
+                        'saved_mb_per_second': (original_total - encoded_total) / (1024 * 1024) / wall if wall else 0.0,
+                    })
+
+    return results
+
+
+def print_benchmark_table(results: List[Dict]):
+    """以表格形式打印基准测试结果"""
+    header = (f"{'格式':<6}{'质量':>6}{'速度':>6}{'并行':>6}{'图片/秒':>10}{'MB/秒':>9}"
+              f"{'P50(ms)':>10}{'P95(ms)':>10}{'峰值内存MB':>12}{'压缩率':>9}{'节省MB/秒':>11}")
+    print("\n" + "=" * 100)
+    print(header)
+    print("-" * 100)
+    for r in results:
+        effort = '-' if r['effort'] is None else str(r['effort'])
+        print(f"{r['format'].upper():<6}{r['quality']:>6}{effort:>6}{r['workers']:>6}"
+              f"{r['images_per_second']:>10.2f}{r['mb_per_second']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['peak_rss_mb']:>12.1f}"
+              f"{r['compression_ratio']:>9.1%}{r['saved_mb_per_second']:>11.3f}")
+    print("=" * 100)
+
+    if results:
+        best = max(results, key=lambda r: r['saved_mb_per_second'])
+        effort = '' if best['effort'] is None else f", effort {best['effort']}"
+        print(f"每秒节省空间最多: {best['format'].upper()} 质量 {best['quality']}{effort}, "
+              f"{best['workers']} 个并行 ({best['saved_mb_per_second']:.3f} MB/秒)")
+
+
+def _parse_memory_size(value: str) -> int:
+    """解析内存大小，如 4096、512M、4G，不带单位时按MB计算，返回字节数"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value) * units['M'])
+
+
+def _parse_int_list(value: str) -> List[int]:
+    """解析逗号分隔的整数列表"""
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+# convert_bytes 和转换服务接受的编码设置及其类型
+ENCODE_OPTIONS = {
+    'format': str,
+    'quality': int,
+    'effort': int,
+    'analyze': bool,
+    'target_ssim': float,
+    'quality_range': tuple,
+    'search_steps': int,
+    'encoder': str,
+}
+
+# 编码结果的MIME类型
+FORMAT_MIME_TYPES = {'avif': 'image/avif', 'jxl': 'image/jxl', 'webp': 'image/webp'}
+
+
+@functools.lru_cache(maxsize=32)
+def _bytes_encoder(format: str, quality: int, effort: int, analyze: bool, target_ssim: Optional[float],
+                   quality_range: Tuple[int, int], search_steps: int, encoder: str) -> 'ImageConverter':
+    """按编码设置缓存的转换器，同一进程中重复调用不再重新创建"""
+    return ImageConverter.encoder(format, quality, effort, analyze, target_ssim, quality_range, search_steps,
+                                  encoder)
+
+
+def check_encode_options(options: Dict) -> Dict:
+    """校验编码设置并补全默认值，设置无效或缺少编码器时抛出 ValueError"""
+    unknown = set(options) - set(ENCODE_OPTIONS)
+    if unknown:
+        raise ValueError(f"未知的编码设置: {', '.join(sorted(unknown))}")
+    checked = {'format': 'avif', 'quality': 80, 'effort': 7, 'analyze': False, 'target_ssim': None,
+               'quality_range': (30, 95), 'search_steps': 6, 'encoder': 'auto'}
+    for key, value in options.items():
+        kind = ENCODE_OPTIONS[key]
+        if value is None or value == '':
+            continue
+        if kind is bool and isinstance(value, str):
+            value = value.lower() in ('1', 'true', 'yes', 'on')
+        elif kind is tuple:
+            value = tuple(_parse_int_list(value) if isinstance(value, str) else (int(v) for v in value))
+        else:
+            try:
+                value = kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"无效的编码设置 {key}: {value!r}")
+        checked[key] = value
+
+    checked['format'] = checked['format'].lower()
+    if checked['format'] in ENCODER_BACKENDS and checked['encoder'] not in ('auto', *ENCODER_BACKENDS[checked['format']]):
+        raise ValueError(f"{checked['format'].upper()} 没有名为 {checked['encoder']} 的编码器")
+    try:
+        get_encoder(checked['format'], checked['encoder'])
+    except EncoderUnavailable as e:
+        raise ValueError(str(e))
+    if not 1 <= checked['quality'] <= 100:
+        raise ValueError("quality 必须在 1-100 之间")
+    if not 1 <= checked['effort'] <= 9:
+        raise ValueError("effort 必须在 1-9 之间")
+    if checked['target_ssim'] is not None:
+        if not HAS_NUMPY:
+            raise ValueError("target_ssim 需要安装 numpy")
+        if not 0 < checked['target_ssim'] <= 1:
+            raise ValueError("target_ssim 必须在 0-1 之间")
+    low_high = checked['quality_range']
+    if len(low_high) != 2 or not 1 <= low_high[0] <= low_high[1] <= 100:
+        raise ValueError("quality_range 必须是 MIN,MAX 且 1 <= MIN <= MAX <= 100")
+    if checked['analyze'] and not HAS_NUMPY:
+        raise ValueError("analyze 需要安装 numpy")
+    return checked
+
+
+def convert_bytes(data: bytes, **options) -> Tuple[bytes, Dict]:
+    """把图片字节编码为目标格式，返回 (编码结果, 指标)
+
+    options 为编码设置：format、quality、effort、analyze、target_ssim、quality_range、search_steps 和 encoder，
+    未指定的项使用与命令行相同的默认值。不做压缩比检测，是否采用结果由调用方根据指标中的
+    original_size、converted_size 决定。
+
+    示例::
+
+        data, metrics = convert_bytes(Path('a.png').read_bytes(), format='webp', quality=75)
+    """
+    checked = check_encode_options(options)
+    return _bytes_encoder(**checked).encode_bytes(data)
+
+
+def _init_service_worker(defaults: Dict):
+    """转换服务的工作进程初始化：提前创建默认设置的编码器，导入编码插件"""
+    if multiprocessing.current_process().name != 'MainProcess':
+        # Ctrl-C 由主进程处理，工作进程随工作池关闭退出
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _bytes_encoder(**defaults)
+
+
+def _convert_batch(items: List[Tuple[bytes, Dict]]) -> List[Tuple[Optional[bytes], Dict]]:
+    """依次转换一批图片，单个失败不影响其他图片；失败的结果为 (None, {'error': 原因})"""
+    results = []
+    for data, options in items:
+        try:
+            results.append(convert_bytes(data, **options))
+        except Exception as e:
+            results.append((None, {'error': str(e)}))
+    return results
+
+
+class ConversionService:
+    """常驻的转换服务：预热的工作池、请求分批和排队上限
+
+    同时排队和处理中的图片数超过 max_pending 时，新请求最多等待 queue_timeout 秒，
+    仍没有空位则拒绝（HTTP 503），使客户端放慢发送速度，而不是让内存中的请求无限堆积。
+    批量请求按 batch_size 切分后作为一个任务交给工作池，减少任务调度和进程间传输的次数。
+    """
+
+    def __init__(self, defaults: Dict, workers: int = 1, executor: str = 'thread',
+                 max_pending: Optional[int] = None, batch_size: int = 8, queue_timeout: float = 30.0):
+        self.defaults = defaults
+        self.workers = max(1, workers)
+        self.executor = executor
+        self.max_pending = max_pending or self.workers * 4
+        self.batch_size = max(1, batch_size)
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+        self.failed = 0
+        self.rejected = 0
+        if executor == 'process':
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_service_worker, initargs=(defaults,))
+        else:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            _init_service_worker(defaults)
+
+    def _options(self, options: Dict) -> Dict:
+        return check_encode_options(dict(self.defaults, **options))
+
+    def _acquire(self, count: int) -> int:
+        """为 count 张图片占用排队位置，超时返回已占用的数量"""
+        deadline = time.monotonic() + self.queue_timeout
+        acquired = 0
+        while acquired < count:
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                break
+            acquired += 1
+        with self._lock:
+            self.pending += acquired
+        return acquired
+
+    def _release(self, count: int):
+        with self._lock:
+            self.pending -= count
+        for _ in range(count):
+            self._slots.release()
+
+    def convert(self, items: List[Tuple[bytes, Dict]]) -> Optional[List[Tuple[Optional[bytes], Dict]]]:
+        """转换一批图片，结果与输入顺序相同；排队已满时返回None
+
+        超过 max_pending 张的批量请求按 max_pending 张一组依次处理。
+        """
+        results = []
+        for start in range(0, len(items), self.max_pending):
+            window = items[start:start + self.max_pending]
+            acquired = self._acquire(len(window))
+            if acquired < len(window):
+                self._release(acquired)
+                with self._lock:
+                    self.rejected += len(items) - start
+                return None
+            try:
+                results.extend(self._convert_window(window))
+            finally:
+                self._release(len(window))
+
+        with self._lock:
+            self.served += sum(1 for data, _ in results if data is not None)
+            self.failed += sum(1 for data, _ in results if data is None)
+        return results
+
+    def _convert_window(self, items: List[Tuple[bytes, Dict]]) -> List[Tuple[Optional[bytes], Dict]]:
+        """校验设置后把图片分批交给工作池"""
+        checked = []
+        for data, options in items:
+            try:
+                checked.append((data, self._options(options), None))
+            except ValueError as e:
+                checked.append((data, None, str(e)))
+
+        valid = [(data, options) for data, options, error in checked if error is None]
+        # 批次大小不超过 batch_size，并且尽量让每个工作者都分到任务
+        size = min(self.batch_size, max(1, -(-len(valid) // self.workers)))
+        futures = [self.pool.submit(_convert_batch, valid[i:i + size]) for i in range(0, len(valid), size)]
+        converted = iter([result for future in futures for result in future.result()])
+        return [next(converted) if error is None else (None, {'error': error}) for _, _, error in checked]
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {'status': 'ok', 'workers': self.workers, 'executor': self.executor,
+                    'max_pending': self.max_pending, 'pending': self.pending,
+                    'served': self.served, 'failed': self.failed, 'rejected': self.rejected,
+                    'defaults': self.defaults}
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class _ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """转换服务的HTTP接口
+
+    - POST /convert?format=webp&quality=75  请求体为原图，响应体为编码结果，指标在 X-Convert-Metrics 头中（JSON）
+    - POST /batch  请求体为JSON：{"options": {...}, "items": [{"data": base64, "options": {...}}, ...]}，
+      响应为 {"results": [{"data": base64, "metrics": {...}} 或 {"error": 原因}, ...]}
+    - GET /health  服务状态
+    """
+
+    server_version = 'ImageConvertService/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.getLogger('avif_converter').debug(format % args)
+
+    def address_string(self):
+        # Unix套接字没有客户端地址
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json', headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), headers=headers)
+
+    def _busy(self):
+        self._send_json(503, {'error': '服务繁忙，请稍后重试'}, headers={'Retry-After': '1'})
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == '/health':
+            self._send_json(200, self.server.service.status())
+        else:
+            self._send_json(404, {'error': f'未知的路径: {self.path}'})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            if url.path == '/convert':
+                options = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+                self._convert_one(body, options)
+            elif url.path == '/batch':
+                self._convert_batch(json.loads(body))
+            else:
+                self._send_json(404, {'error': f'未知的路径: {url.path}'})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': f'无效的请求: {e}'})
+        except Exception as e:
+            self._send_json(500, {'error': f'转换服务错误: {e}'})
+
+    def _convert_one(self, body: bytes, options: Dict):
+        results = self.server.service.convert([(body, options)])
+        if results is None:
+            return self._busy()
+        data, metrics = results[0]
+        if data is None:
+            return self._send_json(422, metrics)
+        self._send(200, data, FORMAT_MIME_TYPES[metrics['format']],
+                   headers={'X-Convert-Metrics': json.dumps(metrics)})
+
+    def _convert_batch(self, request: Dict):
+        defaults = request.get('options', {})
+        items = [(base64.b64decode(item['data']), dict(defaults, **item.get('options', {})))
+                 for item in request['items']]
+        results = self.server.service.convert(items)
+        if results is None:
+            return self._busy()
+        self._send_json(200, {'results': [
+            {'data': base64.b64encode(data).decode('ascii'), 'metrics': metrics} if data is not None else metrics
+            for data, metrics in results
+        ]})
+
+
+class _ServiceHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _ServiceUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_main(argv: List[str]):
+    """serve 子命令：启动常驻的本地转换服务"""
+    parser = argparse.ArgumentParser(
+        prog='convert.py serve',
+        description='启动常驻的本地转换服务（HTTP），工作池预热后处理请求，无需每张图片都启动Python',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  %(prog)s --port 8765 --format webp                    # 在 127.0.0.1:8765 上提供服务
+  %(prog)s --socket /tmp/convert.sock --threads 4       # 使用Unix套接字
+  curl --data-binary @a.png 'http://127.0.0.1:8765/convert?quality=70' -o a.webp
+        """
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址（默认: 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口（默认: 8765）')
+    parser.add_argument('--socket', type=str, default=None, metavar='PATH', help='改为监听Unix套接字')
+    parser.add_argument('--format', type=str, choices=['avif', 'jxl', 'webp'], default='avif',
+                        help='默认输出格式（默认: avif），请求中可以覆盖')
+    parser.add_argument('--quality', type=int, default=80, metavar='1-100', help='默认压缩质量（默认: 80）')
+    parser.add_argument('--effort', type=int, default=7, choices=range(1, 10), metavar='1-9',
+                        help='默认JXL速度等级（默认: 7）')
+    parser.add_argument('--analyze', action='store_true', help='默认开启图像分析')
+    parser.add_argument('--encoder', type=str, default='auto', help='默认编码器后端（默认: auto）')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, metavar='NUM',
+                        help='工作池大小（默认: CPU核数）')
+    parser.add_argument('--executor', type=str, choices=['thread', 'process'], default='thread',
+                        help='工作池类型（默认: thread）')
+    parser.add_argument('--max-pending', type=int, default=None, metavar='NUM',
+                        help='同时排队和处理的图片数上限，超过时请求等待或被拒绝（默认: 工作池大小×4）')
+    parser.add_argument('--batch-size', type=int, default=8, metavar='NUM',
+                        help='批量请求中每个任务包含的图片数上限（默认: 8）')
+    parser.add_argument('--queue-timeout', type=float, default=30.0, metavar='SECONDS',
+                        help='排队已满时请求最多等待的秒数（默认: 30）')
+    args = parser.parse_args(argv)
+
+    try:
+        defaults = check_encode_options({'format': args.format, 'quality': args.quality, 'effort': args.effort,
+                                         'analyze': args.analyze, 'encoder': args.encoder})
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    service = ConversionService(defaults, args.threads, args.executor, args.max_pending,
+                                args.batch_size, args.queue_timeout)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = _ServiceUnixServer(args.socket, _ServiceHandler)
+        address = args.socket
+    else:
+        server = _ServiceHTTPServer((args.host, args.port), _ServiceHandler)
+        address = f"http://{args.host}:{server.server_address[1]}"
+    server.service = service
+
+    print(f"转换服务已启动: {address}（{args.threads} 个{'进程' if args.executor == 'process' else '线程'}，"
+          f"默认 {args.format.upper()} 质量 {args.quality}），按 Ctrl-C 退出")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止转换服务...")
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    status = service.status()
+    print(f"共转换 {status['served']} 张图片，失败 {status['failed']}，因排队已满拒绝 {status['rejected']}")
+
+
+def merge_reports_main(argv: List[str]):
+    """merge-reports 子命令：合并各分片的结果文件，输出与单机运行相同的统计报告"""
+    parser = argparse.ArgumentParser(
+        prog='convert.py merge-reports',
+        description='合并 --shard 各分片输出的结果文件',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  %(prog)s image-shard-*.json                        # 打印合并后的统计报告
+  %(prog)s shards/*.json --json merged.json          # 同时输出合并后的结果文件
+        """
+    )
+    parser.add_argument('reports', nargs='+', help='分片结果文件')
+    parser.add_argument('--json', type=str, default=None, metavar='PATH', help='将合并结果写入JSON文件')
+    args = parser.parse_args(argv)
+
+    reports = []
+    for path in args.reports:
+        try:
+            with open(path, encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法读取分片结果 {path}: {e}")
+            sys.exit(1)
+        if report.get('kind') != 'image-convert-shard':
+            print(f"错误: {path} 不是分片结果文件")
+            sys.exit(1)
+        reports.append(report)
+
+    formats = {report['settings']['format'] for report in reports}
+    if len(formats) > 1:
+        print(f"警告: 分片使用了不同的输出格式: {', '.join(sorted(formats))}")
 
-        print("=" * 70)
+    # 检查分片是否完整、是否重复
+    counts = {report['shard'][1] for report in reports if report['shard']}
+    if len(counts) == 1:
+        count = counts.pop()
+        seen = [report['shard'][0] for report in reports if report['shard']]
+        missing = sorted(set(range(1, count + 1)) - set(seen))
+        duplicated = sorted({k for k in seen if seen.count(k) > 1})
+        if missing:
+            print(f"警告: 缺少分片 {', '.join(map(str, missing))}（共 {count} 个）")
+        if duplicated:
+            print(f"警告: 分片 {', '.join(map(str, duplicated))} 重复，统计会被重复计算")
+    elif counts:
+        print(f"警告: 分片总数不一致: {', '.join(map(str, sorted(counts)))}")
 
-    def convert_all(self):
-        """转换所有图片"""
-        start_time = time.time()  # 记录开始时间
-        images = self.find_images()
+    print(f"合并 {len(reports)} 个分片结果")
+    converter = ImageConverter.from_shard_reports(reports)
+    converter.print_statistics()
 
-        if not images:
-            print("没有找到需要转换的图片文件")
-            return
+    if args.json:
+        merged = dict(reports[0], created_at=datetime.now().isoformat(timespec='seconds'),
+                      shard=None, merged_from=len(reports), stats=converter.stats,
+                      results=[result.to_list() for result in converter.results])
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, ensure_ascii=False)
+        print(f"合并结果已写入: {args.json}")
 
-        if self.dry_run:
-            print(f"\n[预览模式] 将要转换 {len(images)} 个图片文件:")
-            for img in images[:10]:  # 只显示前10个
-                print(f"  - {img}")
-            if len(images) > 10:
-                print(f"  ... 还有 {len(images) - 10} 个文件")
-            print("\n使用 --execute 参数执行实际转换")
-            return
 
-        print(f"\n开始转换 {len(images)} 个图片文件...")
+def benchmark_main(argv: List[str]):
+    """benchmark 子命令：测量不同编码器、质量、速度等级和并行数下的性能"""
+    parser = argparse.ArgumentParser(
+        prog='convert.py benchmark',
+        description='在目录抽样或合成图片上测量编码吞吐量、延迟、内存和压缩率',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  %(prog)s docs --sample 100                          # 从docs目录抽取100张图片
+  %(prog)s --synthetic 60 --formats jxl,webp          # 使用60张合成图片
+  %(prog)s docs --qualities 60,70,80 --workers 1,4,8  # 遍历质量和并行数
+  %(prog)s docs --json bench.json                     # 同时输出JSON结果
+        """
+    )
+    parser.add_argument('directory', nargs='?', help='从该目录抽样图片（不指定时使用合成图片）')
+    parser.add_argument('--sample', type=int, default=50, metavar='NUM', help='抽样图片数量（默认: 50）')
+    parser.add_argument('--synthetic', type=int, default=None, metavar='NUM',
+                        help='生成指定数量的合成图片作为测试语料')
+    parser.add_argument('--formats', type=str, default='avif,jxl,webp',
+                        help='要测试的输出格式，逗号分隔（默认: avif,jxl,webp）')
+    parser.add_argument('--qualities', type=_parse_int_list, default=[80], metavar='LIST',
+                        help='要测试的质量，逗号分隔（默认: 80）')
+    parser.add_argument('--efforts', type=_parse_int_list, default=[7], metavar='LIST',
+                        help='要测试的JXL速度等级，逗号分隔（默认: 7）')
+    parser.add_argument('--workers', type=_parse_int_list, default=[1, os.cpu_count() or 1], metavar='LIST',
+                        help='要测试的并行数，逗号分隔（默认: 1和CPU核数）')
+    parser.add_argument('--executor', type=str, choices=['thread', 'process'], default='thread',
+                        help='并行方式（默认: thread）')
+    parser.add_argument('--seed', type=int, default=0, help='抽样和合成图片的随机种子（默认: 0）')
+    parser.add_argument('--json', type=str, default=None, metavar='PATH', help='将结果写入JSON文件')
+    args = parser.parse_args(argv)
 
-        # 单线程处理
-        if self.threads <= 1:
-            for i, image_path in enumerate(images, 1):
-                print(f"[{i}/{len(images)}] 处理: {image_path.name}")
-                self.convert_image(image_path)
-        # 多线程处理
-        else:
-            print(f"使用 {self.threads} 个线程并行处理图片...")
-
-            # 使用tqdm创建进度条
-            with tqdm(total=len(images), desc="图片转换进度", unit="个") as pbar:
-                # 创建线程池
-                with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
-                    # 保存所有任务的Future对象
-                    future_to_path = {
-                        executor.submit(self._convert_thread_worker, image_path): image_path
-                        for image_path in images
-                    }
-
-                    # 当任务完成时更新进度条
-                    for future in concurrent.futures.as_completed(future_to_path):
-                        pbar.update(1)
+    if args.directory is None and args.synthetic is None:
+        args.synthetic = args.sample
 
-    def _convert_thread_worker(self, image_path):
-        """线程工作函数，负责转换单个图片"""
-        try:
-            # 获取图片名称，用于日志显示
-            image_name = image_path.name
+    # 跳过当前环境不支持的编码器
+    formats = []
+    for fmt in args.formats.split(','):
+        fmt = fmt.strip().lower()
+        if fmt not in ENCODER_BACKENDS:
+            print(f"错误: 不支持的格式: {fmt}")
+            sys.exit(1)
+        if not encoder_available(fmt):
+            print(f"警告: 缺少 {fmt.upper()} 编码支持，跳过该格式")
+            continue
+        formats.append(fmt)
+    if not formats:
+        print("错误: 没有可用的输出格式")
+        sys.exit(1)
 
-            # 转换图片
-            success = self.convert_image(image_path)
+    with tempfile.TemporaryDirectory(prefix='convert-benchmark-') as workdir:
+        workdir = Path(workdir)
+        if args.synthetic is not None:
+            print(f"生成 {args.synthetic} 张合成图片...")
+            corpus = generate_synthetic_corpus(workdir, args.synthetic, args.seed)
+        else:
+            if not os.path.isdir(args.directory):
+                print(f"错误: 不是一个目录: {args.directory}")
+                sys.exit(1)
+            corpus = sample_corpus(Path(args.directory), workdir, args.sample, args.seed)
+            print(f"从 {args.directory} 抽取了 {len(corpus)} 张图片")
 
-            # 由于多线程环境，不在控制台打印信息，所有信息由日志和进度条处理
-            return success
-        except Exception as e:
-            # 捕获线程中的所有异常
-            with self.stats_lock:
-                error_msg = f"线程处理错误 {image_path}: {str(e)}"
-                self.logger.error(error_msg)
-                self.stats['errors'].append(error_msg)
-                self.stats['failed'] += 1
-            return False
+        if not corpus:
+            print("没有找到可用于测试的图片文件")
+            return
 
-        # 记录总处理时间
-        end_time = time.time()
-        self.stats['conversion_time'] = end_time - start_time
+        corpus_mb = sum(p.stat().st_size for p in corpus) / (1024 * 1024)
+        print(f"测试语料: {len(corpus)} 张图片, {corpus_mb:.2f} MB")
+        results = run_benchmark(corpus, workdir, formats, args.qualities, args.efforts,
+                                args.workers, args.executor)
 
-        self.print_statistics()
+    print_benchmark_table(results)
+
+    if args.json:
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'corpus': {'images': len(corpus), 'megabytes': corpus_mb,
+                       'source': args.directory or f'synthetic:{args.synthetic}', 'seed': args.seed},
+            'results': results,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.json}")
 
 
-def check_dependencies(format):
-    """检查依赖包"""
-    global MISSING_PACKAGES
-    if format == 'avif' and not HAS_AVIF:
-        print("错误：缺少AVIF支持所需的Python包。")
-        print("请先安装以下包：")
-        for package in MISSING_PACKAGES:
-            print(f"  pip install {package}")
-        print("\n或者使用：")
-        print("  pip install Pillow pillow-avif")
+def check_dependencies(format, encoder='auto'):
+    """检查依赖包和输出格式所需的编码器"""
+    if not HAS_PIL:
+        print("错误：缺少Pillow。")
+        print("请先安装：")
+        print("  pip install Pillow")
         sys.exit(1)
-    elif format == 'jxl' and not HAS_JXL:
-        print("错误：缺少JXL支持所需的Python包。")
-        print("请先安装以下包：")
-        for package in MISSING_PACKAGES:
-            print(f"  pip install {package}")
-        print("\n或者使用：")
-        print("  pip install Pillow pillow-jpegxl")
+    try:
+        get_encoder(format, encoder)
+    except EncoderUnavailable as e:
+        print(f"错误：{e}")
         sys.exit(1)
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """主函数"""
+    argv = sys.argv[1:] if argv is None else argv
+
+    # 子命令
+    if argv and argv[0] == 'benchmark':
+        benchmark_main(argv[1:])
+        return
+    if argv and argv[0] == 'merge-reports':
+        merge_reports_main(argv[1:])
+        return
+    if argv and argv[0] == 'serve':
+        serve_main(argv[1:])
+        return
+
     parser = argparse.ArgumentParser(
         description='将图片转换为AVIF或JXL格式，保持原文件名不变',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -619,12 +4234,34 @@ def main():
   %(prog)s /path/to/images --dry-run                 # 预览模式
   %(prog)s /path/to/images --quality 90              # 设置质量为90
   %(prog)s /path/to/images --threads 4               # 使用4个线程加速处理
+  %(prog)s /path/to/images --workers 8 --executor process  # 使用8个进程并行处理
+  %(prog)s /mnt/nas/images --executor async --threads 4 --io-workers 16  # 网络存储上读写与编码重叠
+  %(prog)s /path/to/images --threads 8 --max-memory 6G  # 按图片尺寸调度并行任务，避免内存耗尽
   %(prog)s /path/to/images --no-recursive            # 不处理子目录
   %(prog)s /path/to/images --delete-backup           # 删除备份文件
+  %(prog)s /path/to/images --backup-mode hardlink    # 用硬链接备份，不复制数据
   %(prog)s /path/to/images --no-compression-check    # 强制转换所有文件
-  %(prog)s /path/to/images --min-compression 10      # 设置最小压缩比为10%
+  %(prog)s /path/to/images --min-compression 10      # 设置最小压缩比为10%%
   %(prog)s /path/to/images --format jxl --effort 5   # JXL格式的编码速度/质量平衡
   %(prog)s /path/to/images --report                    # 显示详细的转换统计报告
+  %(prog)s /path/to/images --manifest                  # 增量转换，跳过未变化的文件
+  %(prog)s /path/to/images --resume                    # 从上次中断处继续转换
+  %(prog)s docs --watch --manifest                     # 持续监视，新增或修改的图片自动转换
+  %(prog)s docs --encoder avifenc --encoder-threads 4 --speed 6   # 使用 avifenc 命令行编码器
+  %(prog)s docs --markdown-dir docs/article --markdown-dir docs/nav --site-root docs/public --rename-ext
+                                                       # 只转换被引用的图片并改写链接
+  %(prog)s docs --since origin/main                    # 只转换相对 origin/main 变更的图片
+  git diff --name-only HEAD~1 | %(prog)s docs --files-from -   # 转换管道传入的文件
+  %(prog)s /path/to/images --predict probe            # 预测过滤，跳过没有希望的完整编码
+  %(prog)s /path/to/images --cache-dir ~/.cache/img    # 复用内容相同图片的编码结果
+  %(prog)s /path/to/images --variants                  # 生成 480/960/1920 宽的 AVIF+WebP 变体
+  %(prog)s /path/to/images --target-ssim 0.95          # 按图片自适应选择满足SSIM目标的最低质量
+  %(prog)s /path/to/images --format jxl --analyze      # 按图片内容选择无损/有损和像素模式
+  %(prog)s /path/to/images --report-json run.json      # 导出运行报告和各阶段耗时
+  %(prog)s benchmark docs --workers 1,4,8             # 基准测试（详见 %(prog)s benchmark --help）
+  %(prog)s docs --shard 2/4                            # 多机分片：只处理4个分片中的第2个
+  %(prog)s merge-reports image-shard-*.json            # 合并各分片的统计结果
+  %(prog)s serve --port 8765 --format webp             # 常驻转换服务（详见 %(prog)s serve --help）
 
 注意：
 - 转换后的图片仍保持原文件名，MD文件中的链接无需修改
@@ -673,6 +4310,29 @@ def main():
         help='转换后删除备份文件（谨慎使用）'
     )
 
+    parser.add_argument(
+        '--backup-mode',
+        type=str,
+        choices=['copy', 'hardlink', 'dir', 'none'],
+        default='copy',
+        help='原文件备份方式：copy 复制为 .backup 文件，hardlink 用硬链接代替复制，'
+             'dir 以硬链接（或复制）保存到 --backup-dir，none 不备份（默认: copy）'
+    )
+
+    parser.add_argument(
+        '--backup-dir',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='--backup-mode dir 时的备份目录，按原目录结构保存'
+    )
+
+    parser.add_argument(
+        '--fsync',
+        action='store_true',
+        help='替换原文件前将编码结果刷写到磁盘，保证断电后文件完整'
+    )
+
     parser.add_argument(
         '--no-compression-check',
         action='store_true',
@@ -688,11 +4348,45 @@ def main():
     )
 
     parser.add_argument(
-        '--threads',
+        '--threads', '--workers',
+        dest='threads',
         type=int,
         default=1,
         metavar='NUM',
-        help='使用的线程数（默认: 1）'
+        help='并行处理的线程数或进程数（默认: 1）'
+    )
+
+    parser.add_argument(
+        '--executor',
+        type=str,
+        choices=['thread', 'process', 'async'],
+        default='thread',
+        help='并行方式：thread 使用线程池，process 使用进程池绕开GIL，'
+             'async 使用异步流水线让文件读写与编码重叠，适合慢速或远程存储（默认: thread）'
+    )
+
+    parser.add_argument(
+        '--max-memory',
+        type=str,
+        default=None,
+        metavar='SIZE',
+        help='并行任务预估峰值内存的总预算，如 4G、512M（不带单位按MB），按图片尺寸调度任务避免内存耗尽（默认: 不限制）'
+    )
+
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=4,
+        metavar='NUM',
+        help='async 模式中并发读写文件的线程数（默认: 4）'
+    )
+
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=8,
+        metavar='NUM',
+        help='async 模式中提前读入内存、等待编码的文件数（默认: 8）'
     )
 
     parser.add_argument(
@@ -710,16 +4404,326 @@ def main():
         help='JXL格式的编码速度等级 (1-9, 1最快/质量最低, 9最慢/质量最高, 默认: 7)'
     )
 
+    parser.add_argument(
+        '--encoder',
+        type=str,
+        choices=['auto'] + sorted({name for backends in ENCODER_BACKENDS.values() for name in backends}),
+        default='auto',
+        help='编码器后端：pillow（Pillow插件）、avifenc、cjxl（命令行工具，图像经标准输入传入）；'
+             'auto 优先使用Pillow（默认: auto）'
+    )
+
+    parser.add_argument(
+        '--encoder-threads',
+        type=int,
+        default=0,
+        metavar='NUM',
+        help='每次编码时编码器内部使用的线程数，0为编码器默认（默认: 0）'
+    )
+
+    parser.add_argument(
+        '--encoder-jobs',
+        type=int,
+        default=None,
+        metavar='NUM',
+        help='命令行编码器同时运行的进程数上限（默认: CPU核数）'
+    )
+
+    parser.add_argument(
+        '--speed',
+        type=int,
+        default=None,
+        choices=range(0, 11),
+        metavar='0-10',
+        help='AVIF编码速度等级 (0-10, 0最慢/质量最高, 10最快, 默认使用编码器的设置)'
+    )
+
+    parser.add_argument(
+        '--tiles',
+        type=_parse_tiles,
+        default=None,
+        metavar='auto|RxC',
+        help='AVIF分块编码：auto 自动选择，或行数和列数的log2（如 1x1 为2×2块），大图可更好地利用多线程'
+    )
+
+    parser.add_argument(
+        '--predict',
+        type=str,
+        choices=['off', 'heuristic', 'probe'],
+        default='off',
+        help='完整编码前的预测过滤：heuristic 按每像素比特数判断，probe 取原图中的几个小块快速试编码（默认: off）'
+    )
+
+    parser.add_argument(
+        '--predict-margin',
+        type=float,
+        default=1.25,
+        metavar='FACTOR',
+        help='预测过滤的安全系数，越大越保守（默认: 1.25）'
+    )
+
+    parser.add_argument(
+        '--predict-min-pixels',
+        type=int,
+        default=1024,
+        metavar='NUM',
+        help='像素数低于此值的图片直接预测跳过（默认: 1024）'
+    )
+
+    parser.add_argument(
+        '--predict-audit',
+        type=float,
+        default=5.0,
+        metavar='PERCENT',
+        help='预测跳过的文件中仍做完整编码以检验准确率的比例（默认: 5.0%%）'
+    )
+
+    parser.add_argument(
+        '--since',
+        metavar='REF',
+        help='只处理相对git引用（如 origin/main）新增或修改的图片，不扫描整个目录'
+    )
+
+    parser.add_argument(
+        '--changed-only',
+        action='store_true',
+        help='只处理git工作区中新增或修改的图片（相当于 --since HEAD）'
+    )
+
+    parser.add_argument(
+        '--files-from',
+        metavar='PATH',
+        help="从文件读取要处理的图片路径，每行一个；'-' 表示从标准输入读取"
+    )
+
+    parser.add_argument(
+        '--markdown-dir',
+        action='append',
+        metavar='DIR',
+        help='只转换该目录下Markdown文档实际引用的图片，可多次指定（如 docs/article、docs/nav）'
+    )
+
+    parser.add_argument(
+        '--site-root',
+        metavar='DIR',
+        default=None,
+        help='以 / 开头的图片链接所相对的站点根目录（默认: 处理目录下的 public 目录，不存在时为处理目录）'
+    )
+
+    parser.add_argument(
+        '--rename-ext',
+        action='store_true',
+        help='写入新扩展名的文件（foo.png -> foo.avif）并删除原文件，同时更新 --markdown-dir 中文档的链接'
+             '（必须同时指定 --markdown-dir）'
+    )
+
+    parser.add_argument(
+        '--shard',
+        type=str,
+        default=None,
+        metavar='K/N',
+        help='多机分片：只处理N个分片中的第K个（K从1开始），各节点无需协调即可得到相同的划分'
+    )
+
+    parser.add_argument(
+        '--shard-by',
+        choices=['hash', 'size'],
+        default='hash',
+        help='分片方式：hash 按相对路径哈希，边扫描边处理；size 先列出全部文件再按大小均衡（默认: hash）'
+    )
+
+    parser.add_argument(
+        '--shard-report',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='分片结果文件路径，供 merge-reports 合并（默认: image-shard-K-of-N.json）'
+    )
+
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='监视模式：处理完目录后继续监视，新增或修改的图片写入完成后自动转换，按 Ctrl-C 退出'
+    )
+
+    parser.add_argument(
+        '--watch-debounce',
+        type=float,
+        default=1.0,
+        metavar='SECONDS',
+        help='文件最后一次变化后等待多久再转换（默认: 1.0）'
+    )
+
+    parser.add_argument(
+        '--watch-poll',
+        type=float,
+        default=None,
+        metavar='SECONDS',
+        help='改用轮询方式监视并设置间隔；未安装 watchdog 时自动使用2秒轮询'
+    )
+
+    parser.add_argument(
+        '--manifest',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='PATH',
+        help='启用增量转换清单，跳过上次处理后未变化的文件（默认路径: <目录>/.image-manifest.sqlite）'
+    )
+
+    parser.add_argument(
+        '--journal',
+        metavar='PATH',
+        help='任务日志路径，记录每个文件的处理状态，用于中断后恢复，正常结束后删除（默认: <目录>/.image-journal.jsonl）'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='从上次中断处继续，跳过任务日志中已转换或已跳过的文件，失败的文件会重试'
+    )
+
+    parser.add_argument(
+        '--analyze',
+        action='store_true',
+        help='编码前分析图像内容（颜色数、透明度、灰度、边缘密度），按图片选择无损/有损、像素模式和速度等级（需要NumPy）'
+    )
+
+    parser.add_argument(
+        '--target-ssim',
+        type=float,
+        default=None,
+        metavar='0-1',
+        help='自适应质量：为每个图片二分查找满足该SSIM的最低质量（例如 0.95，需要NumPy）'
+    )
+
+    parser.add_argument(
+        '--quality-range',
+        type=_parse_int_list,
+        default=[30, 95],
+        metavar='MIN,MAX',
+        help='自适应质量的搜索区间（默认: 30,95）'
+    )
+
+    parser.add_argument(
+        '--search-steps',
+        type=int,
+        default=6,
+        metavar='NUM',
+        help='自适应质量最多尝试的候选编码次数（默认: 6）'
+    )
+
+    parser.add_argument(
+        '--variants',
+        action='store_true',
+        help='响应式变体模式：为每个图片生成多个宽度、多种格式的新文件，原图保持不变'
+    )
+
+    parser.add_argument(
+        '--variant-widths',
+        type=_parse_int_list,
+        default=[480, 960, 1920],
+        metavar='LIST',
+        help='变体宽度，逗号分隔（默认: 480,960,1920）'
+    )
+
+    parser.add_argument(
+        '--variant-formats',
+        type=str,
+        default='avif,webp',
+        metavar='LIST',
+        help='变体格式，逗号分隔，按优先顺序排列（默认: avif,webp）'
+    )
+
+    parser.add_argument(
+        '--variants-sidecar',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='原图到变体的JSON映射文件（默认: <目录>/image-variants.json）'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='内容寻址编码缓存目录，内容相同的图片只编码一次，可在多次运行和多台机器间共享'
+    )
+
+    parser.add_argument(
+        '--decode-cache-mb',
+        type=int,
+        default=0,
+        metavar='MB',
+        help='解码结果内存缓存的大小上限，同一图片的预测探测和完整编码只解码一次；多进程时为每个进程的上限（默认: 0，不启用）'
+    )
+
+    parser.add_argument(
+        '--cache-max-mb',
+        type=int,
+        default=2048,
+        metavar='MB',
+        help='编码缓存目录的大小上限，超出后淘汰最久未使用的条目（0 表示不限制，默认: 2048）'
+    )
+
+    parser.add_argument(
+        '--cache-backend',
+        type=str,
+        default=None,
+        metavar='MODULE:CLASS',
+        help='可选的远程缓存后端类，需实现 get(key, dest) 和 put(key, src) 方法'
+    )
+
+    parser.add_argument(
+        '--cache-url',
+        type=str,
+        default=None,
+        metavar='URL',
+        help='传给远程缓存后端构造函数的参数'
+    )
+
+    parser.add_argument(
+        '--report-json',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='将运行报告（统计信息、各阶段耗时直方图、逐文件耗时）写入JSON文件'
+    )
+
+    parser.add_argument(
+        '--trace-json',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='将各阶段计时写入Chrome trace文件，可在 chrome://tracing 或 Perfetto 中查看'
+    )
+
     parser.add_argument(
         '--version',
         action='version',
         version='Image Converter (Keep Name) v1.3'
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 检查依赖
-    check_dependencies(args.format)
+    variant_formats = [f.strip().lower() for f in args.variant_formats.split(',') if f.strip()]
+    if args.variants:
+        for fmt in variant_formats:
+            if fmt not in VARIANT_MIME_TYPES:
+                print(f"错误: 不支持的变体格式: {fmt}")
+                sys.exit(1)
+            check_dependencies(fmt, args.encoder)
+        if not args.variant_widths or min(args.variant_widths) <= 0:
+            print("错误: 变体宽度必须为正整数")
+            sys.exit(1)
+    else:
+        if args.encoder not in ('auto', *ENCODER_BACKENDS[args.format]):
+            print(f"错误: {args.format.upper()} 没有名为 {args.encoder} 的编码器，"
+                  f"可选: {', '.join(ENCODER_BACKENDS[args.format])}")
+            sys.exit(1)
+        check_dependencies(args.format, args.encoder)
 
     # 验证参数
     if not os.path.exists(args.directory):
@@ -730,6 +4734,10 @@ def main():
         print(f"错误: 不是一个目录: {args.directory}")
         sys.exit(1)
 
+    if args.encoder_threads < 0 or (args.encoder_jobs is not None and args.encoder_jobs < 1):
+        print("错误: --encoder-threads 不能为负数，--encoder-jobs 必须为正整数")
+        sys.exit(1)
+
     if not (1 <= args.quality <= 100):
         print("错误: 质量参数必须在1-100之间")
         sys.exit(1)
@@ -738,6 +4746,114 @@ def main():
         print("错误: 最小压缩比必须在0-100之间")
         sys.exit(1)
 
+    if args.analyze and not HAS_NUMPY:
+        print("错误：图像分析需要NumPy，请先安装：")
+        print("  pip install numpy")
+        sys.exit(1)
+
+    if args.target_ssim is not None:
+        if not HAS_NUMPY:
+            print("错误：自适应质量搜索需要NumPy，请先安装：")
+            print("  pip install numpy")
+            sys.exit(1)
+        if not (0 < args.target_ssim <= 1):
+            print("错误: 目标SSIM必须在0-1之间")
+            sys.exit(1)
+        if (len(args.quality_range) != 2 or not (1 <= args.quality_range[0] <= args.quality_range[1] <= 100)):
+            print("错误: 质量搜索区间必须为 MIN,MAX 且在1-100之间")
+            sys.exit(1)
+
+    if args.backup_mode == 'dir' and not args.backup_dir:
+        print("错误: --backup-mode dir 需要同时指定 --backup-dir")
+        sys.exit(1)
+
+    if not (0 <= args.predict_audit <= 100):
+        print("错误: 预测抽查比例必须在0-100之间")
+        sys.exit(1)
+
+    cache = None
+    if args.cache_dir:
+        remote = None
+        if args.cache_backend:
+            try:
+                remote = load_cache_backend(args.cache_backend, args.cache_url)
+            except Exception as e:
+                print(f"错误: 无法加载缓存后端 {args.cache_backend}: {e}")
+                sys.exit(1)
+        cache = EncodeCache(LocalDirectoryBackend(args.cache_dir, args.cache_max_mb * 1024 * 1024), remote)
+    elif args.cache_backend:
+        print("错误: --cache-backend 需要同时指定 --cache-dir 作为本地缓存")
+        sys.exit(1)
+
+    shard = None
+    if args.shard:
+        match = re.fullmatch(r'(\d+)/(\d+)', args.shard.strip())
+        if not match or not (1 <= int(match.group(1)) <= int(match.group(2))):
+            print(f"错误: 分片格式应为 K/N 且 1 <= K <= N: {args.shard}")
+            sys.exit(1)
+        shard = (int(match.group(1)), int(match.group(2)))
+
+    max_memory = None
+    if args.max_memory:
+        try:
+            max_memory = _parse_memory_size(args.max_memory)
+        except ValueError:
+            print(f"错误: 无法解析内存大小: {args.max_memory}")
+            sys.exit(1)
+        if max_memory <= 0:
+            print("错误: 内存预算必须大于0")
+            sys.exit(1)
+
+    files = None
+    if sum(bool(x) for x in (args.since, args.changed_only, args.files_from)) > 1:
+        print("错误: --since、--changed-only 和 --files-from 只能指定一个")
+        sys.exit(1)
+    if args.since or args.changed_only:
+        try:
+            files = git_changed_files(args.directory, args.since or 'HEAD')
+        except RuntimeError as e:
+            print(f"错误: 无法获取git变更文件: {e}")
+            sys.exit(1)
+    elif args.files_from:
+        try:
+            files = read_file_list(args.files_from)
+        except OSError as e:
+            print(f"错误: 无法读取文件列表 {args.files_from}: {e}")
+            sys.exit(1)
+
+    if args.rename_ext and not args.markdown_dir:
+        print("错误: --rename-ext 会删除原文件，必须用 --markdown-dir 指定需要更新链接的文档")
+        sys.exit(1)
+
+    markdown_files = None
+    site_root = args.site_root or str(default_site_root(args.directory))
+    if args.markdown_dir:
+        markdown_files = list(iter_markdown_files(args.markdown_dir))
+        references = collect_markdown_references(markdown_files, site_root)
+        referenced = [path for path in references if os.path.isfile(path)]
+        print(f"Markdown引用: {len(markdown_files)} 个文档引用了 {len(references)} 个图片"
+              f"（{len(references) - len(referenced)} 个不存在）")
+        # 与git变更或文件列表同时使用时取交集
+        if files is None:
+            files = referenced
+        else:
+            files = [f for f in files if os.path.normpath(os.path.abspath(f)) in references]
+
+    if args.watch and args.dry_run:
+        print("错误: --watch 不能与 --dry-run 同时使用")
+        sys.exit(1)
+    if args.watch and not HAS_WATCHDOG and args.watch_poll is None:
+        print("提示: 未安装 watchdog，监视模式将使用轮询；安装后可使用inotify等系统通知：")
+        print("  pip install watchdog")
+
+    if args.rename_ext and args.variants:
+        print("错误: --rename-ext 不能与 --variants 同时使用")
+        sys.exit(1)
+
+    manifest_path = args.manifest
+    if manifest_path == '':
+        manifest_path = os.path.join(args.directory, '.image-manifest.sqlite')
+
     # 创建转换器实例
     converter = ImageConverter(
         directory=args.directory,
@@ -750,14 +4866,54 @@ def main():
         min_compression_ratio=args.min_compression / 100.0,
         threads=args.threads,
         effort=args.effort,
-        show_report=args.report
+        show_report=args.report,
+        executor=args.executor,
+        manifest_path=manifest_path,
+        predict=args.predict,
+        predict_margin=args.predict_margin,
+        predict_min_pixels=args.predict_min_pixels,
+        predict_audit_rate=args.predict_audit / 100.0,
+        report_json=args.report_json,
+        trace_json=args.trace_json,
+        backup_mode=args.backup_mode,
+        backup_dir=args.backup_dir,
+        fsync=args.fsync,
+        cache=cache,
+        variants=args.variants,
+        variant_widths=tuple(args.variant_widths),
+        variant_formats=tuple(variant_formats),
+        variants_sidecar=args.variants_sidecar,
+        target_ssim=args.target_ssim,
+        quality_range=tuple(args.quality_range),
+        search_steps=args.search_steps,
+        analyze=args.analyze,
+        journal_path=args.journal,
+        resume=args.resume,
+        files=files,
+        decode_cache_mb=args.decode_cache_mb,
+        io_workers=args.io_workers,
+        prefetch=args.prefetch,
+        max_memory=max_memory,
+        rename=args.rename_ext,
+        markdown_files=markdown_files,
+        site_root=site_root,
+        shard=shard,
+        shard_by=args.shard_by,
+        shard_report=args.shard_report,
+        encoder=args.encoder,
+        encoder_settings=EncoderSettings(args.encoder_threads, args.speed, args.tiles, args.encoder_jobs)
     )
 
     # 执行转换
     try:
-        converter.convert_all()
+        if args.watch:
+            converter.watch(args.watch_debounce, args.watch_poll)
+        else:
+            converter.convert_all()
     except KeyboardInterrupt:
         print("\n\n用户中断操作")
+        if converter.journal is not None:
+            print(f"处理进度已记录在 {converter.journal.path}，使用 --resume 从中断处继续")
         sys.exit(1)
     except Exception as e:
         print(f"\n发生错误: {e}")
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image  # noqa: E402
+
+
+def make_image(path: Path, size=(64, 48), color=(200, 30, 30), format=None) -> Path:
+    """写入一张带渐变的测试图片（纯色图片压缩率过高，不利于检验跳过逻辑）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    img = Image.new('RGB', size, color)
+    for x in range(size[0]):
+        for y in range(0, size[1], 4):
+            img.putpixel((x, y), ((x * 7) % 256, (y * 5) % 256, (x * y) % 256))
+    img.save(path, format=format)
+    return path
+
+
+@pytest.fixture
+def image_factory():
+    return make_image
+
+
+def make_corpus(directory: Path) -> Path:
+    """写入一组覆盖各种处理结果的图片：可转换的噪声图片（含子目录）、转换后更大的规则图案和损坏的文件"""
+    for i in range(4):
+        path = directory / ('sub' if i % 2 else '') / f'noise-{i}.png'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.effect_noise((96 + i * 16, 64), 40).convert('RGB').save(path)
+    make_image(directory / 'pattern.png', size=(400, 300))
+    (directory / 'broken.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 32)
+    return directory
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return make_corpus(tmp_path / 'images')
@@ -0,0 +1,62 @@
+import pytest
+from PIL import Image
+
+from convert import ImageConverter
+
+DURATIONS = [80, 120, 200]
+
+
+def make_animation(path, size=(64, 48)):
+    """写入每帧内容和显示时长都不同的GIF动画"""
+    frames = [Image.effect_noise(size, 20 + 30 * i).convert('RGB') for i in range(len(DURATIONS))]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=DURATIONS, loop=0)
+    return path
+
+
+def convert(directory, format, **kwargs):
+    converter = ImageConverter(str(directory), format=format, check_compression=False, rename=True,
+                               backup_mode='none', show_report=False, quiet=True, **kwargs)
+    converter.convert_all()
+    return converter
+
+
+@pytest.mark.parametrize('executor', ['thread', 'async'])
+@pytest.mark.parametrize('format', ['webp', 'avif'])
+def test_animated_gif_keeps_frames_and_durations(tmp_path, format, executor):
+    make_animation(tmp_path / 'anim.gif')
+
+    converter = convert(tmp_path, format, executor=executor)
+
+    assert converter.stats['converted'] == 1
+    assert not (tmp_path / 'anim.gif').exists()
+    with Image.open(tmp_path / f'anim.{format}') as img:
+        assert img.n_frames == len(DURATIONS)
+        durations = []
+        for i in range(img.n_frames):
+            img.seek(i)
+            img.load()
+            durations.append(img.info['duration'])
+        assert durations == DURATIONS
+        assert img.info.get('loop', 0) == 0
+
+
+def test_static_gif_is_not_treated_as_animation(tmp_path):
+    Image.effect_noise((64, 48), 40).convert('RGB').save(tmp_path / 'still.gif')
+
+    converter = convert(tmp_path, 'webp')
+
+    assert converter.stats['converted'] == 1
+    with Image.open(tmp_path / 'still.webp') as img:
+        assert getattr(img, 'n_frames', 1) == 1
+
+
+def test_animation_is_kept_when_format_cannot_animate(tmp_path):
+    path = make_animation(tmp_path / 'anim.gif')
+    original = path.read_bytes()
+
+    converter = convert(tmp_path, 'jxl')
+
+    assert converter.stats['skipped_animated'] == 1
+    assert converter.stats['converted'] == 0 and converter.stats['failed'] == 0
+    assert path.read_bytes() == original
+    assert not (tmp_path / 'anim.jxl').exists()
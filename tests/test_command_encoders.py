@@ -0,0 +1,187 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+import convert
+from convert import (AnimationNotSupported, AvifencEncoder, CjxlEncoder, EncoderSettings, EncoderUnavailable,
+                     ImageConverter, get_encoder, sniff_image_format)
+
+# 假的编码器：记录参数和标准输入，再用 Pillow 完成编码；设置 FAKE_ENCODER_FAIL 时以错误退出
+FAKE_AVIFENC = '''
+import json, os, sys
+from PIL import Image
+args = sys.argv[1:]
+if args == ['--version']:
+    print('Version: 1.2.3 (aom [enc/dec]:3.9.0)')
+    sys.exit(0)
+data = sys.stdin.buffer.read()
+with open(os.environ['FAKE_ENCODER_LOG'], 'a') as log:
+    log.write(json.dumps({'args': args, 'stdin': data.hex()}) + '\\n')
+if os.environ.get('FAKE_ENCODER_FAIL'):
+    sys.stderr.write('Reading input\\nERROR: Failed to encode image\\n')
+    sys.exit(1)
+header, _, frame = data.partition(b'\\n')
+fields = header.decode().split()
+width, height = int(fields[1][1:]), int(fields[2][1:])
+planes = frame[len(b'FRAME\\n'):]
+size = width * height
+img = Image.merge('YCbCr', [Image.frombytes('L', (width, height), planes[i * size:(i + 1) * size]) for i in range(3)])
+img.convert('RGB').save(args[-1], 'AVIF', quality=int(args[args.index('-q') + 1]))
+'''
+
+FAKE_CJXL = '''
+import io, json, os, sys
+from PIL import Image
+import pillow_jxl
+args = sys.argv[1:]
+if args == ['--version']:
+    print('cjxl v0.11.1 [AVX2,SSE4]')
+    sys.exit(0)
+data = sys.stdin.buffer.read()
+with open(os.environ['FAKE_ENCODER_LOG'], 'a') as log:
+    log.write(json.dumps({'args': args, 'stdin': data.hex()}) + '\\n')
+if os.environ.get('FAKE_ENCODER_FAIL'):
+    sys.stderr.write('JPEG XL encoder v0.11.1\\nEncoding failed.\\n')
+    sys.exit(1)
+output = io.BytesIO()
+Image.open(io.BytesIO(data)).save(output, 'JXL', lossless='-d' in args)
+sys.stdout.buffer.write(output.getvalue())
+'''
+
+
+@pytest.fixture
+def fake_tools(tmp_path, monkeypatch):
+    """把假的 avifenc 和 cjxl 放到 PATH 最前面，返回记录调用的日志文件"""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for program, script in (('avifenc', FAKE_AVIFENC), ('cjxl', FAKE_CJXL)):
+        path = bin_dir / program
+        path.write_text(f'#!{sys.executable}\n{script}')
+        path.chmod(0o755)
+    log = tmp_path / 'calls.jsonl'
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_ENCODER_LOG', str(log))
+    # 注册表中的实例会缓存找到的路径，换成新实例
+    monkeypatch.setitem(convert.ENCODER_BACKENDS['avif'], 'avifenc', AvifencEncoder())
+    monkeypatch.setitem(convert.ENCODER_BACKENDS['jxl'], 'cjxl', CjxlEncoder())
+    return log
+
+
+def calls(log):
+    return [json.loads(line) for line in log.read_text().splitlines()]
+
+
+def rgb_image(size=(6, 4)):
+    return Image.effect_noise(size, 40).convert('RGB')
+
+
+def test_missing_program_is_unavailable(monkeypatch, tmp_path):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    monkeypatch.setitem(convert.ENCODER_BACKENDS['avif'], 'avifenc', AvifencEncoder())
+
+    with pytest.raises(EncoderUnavailable, match='avifenc'):
+        get_encoder('avif', 'avifenc')
+
+
+def test_version(fake_tools):
+    assert get_encoder('avif', 'avifenc').version() == 'avifenc-Version: 1.2.3 (aom [enc/dec]:3.9.0)'
+    assert get_encoder('jxl', 'cjxl').version() == 'cjxl-cjxl v0.11.1 [AVX2,SSE4]'
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+def test_avifenc_receives_y4m(fake_tools, mode):
+    img = rgb_image().convert(mode)
+    output = io.BytesIO()
+
+    get_encoder('avif', 'avifenc').encode(img, output, quality=70, effort=7)
+
+    call, = calls(fake_tools)
+    stdin = bytes.fromhex(call['stdin'])
+    header, _, frame = stdin.partition(b'\n')
+    colorspace = 'C444alpha' if mode == 'RGBA' else 'C444'
+    assert header.decode() == f'YUV4MPEG2 W6 H4 F25:1 Ip A1:1 {colorspace} XCOLORRANGE=FULL'
+    assert frame.startswith(b'FRAME\n')
+    assert len(frame) == len(b'FRAME\n') + 6 * 4 * len(mode)
+    assert call['args'][:7] == ['--stdin', '--cicp', '1/13/6', '-q', '70', '--qalpha', '70']
+    with Image.open(io.BytesIO(output.getvalue())) as result:
+        assert result.format == 'AVIF' and result.size == img.size
+
+
+@pytest.mark.parametrize('settings, fast, expected', [
+    (EncoderSettings(), False, []),
+    (EncoderSettings(speed=4, threads=2), False, ['--speed', '4', '--jobs', '2']),
+    (EncoderSettings(speed=4, tiles='auto'), True, ['--speed', '10', '--autotiling']),
+    (EncoderSettings(tiles=(1, 2)), False, ['--tilerowslog2', '1', '--tilecolslog2', '2']),
+])
+def test_avifenc_settings(fake_tools, settings, fast, expected):
+    get_encoder('avif', 'avifenc').encode(rgb_image(), io.BytesIO(), quality=60, effort=7, fast=fast,
+                                          settings=settings)
+
+    args = calls(fake_tools)[0]['args']
+    assert args[7:-1] == expected
+    # 输出写到临时文件，编码后删除
+    assert args[-1].endswith('.avif') and not os.path.exists(args[-1])
+
+
+@pytest.mark.parametrize('lossless, fast, settings, expected', [
+    (False, False, EncoderSettings(), ['-e', '7', '-q', '85']),
+    (True, False, EncoderSettings(), ['-e', '7', '-d', '0']),
+    (False, True, EncoderSettings(threads=3), ['-e', '1', '-q', '85', '--num_threads', '3']),
+])
+def test_cjxl_receives_png_and_writes_stdout(fake_tools, lossless, fast, settings, expected):
+    img = rgb_image()
+    output = io.BytesIO()
+
+    get_encoder('jxl', 'cjxl').encode(img, output, quality=85, effort=7, lossless=lossless, fast=fast,
+                                      settings=settings)
+
+    call, = calls(fake_tools)
+    assert call['args'] == ['-', '-', '--quiet'] + expected
+    with Image.open(io.BytesIO(bytes.fromhex(call['stdin']))) as source:
+        assert source.format == 'PNG' and source.tobytes() == img.tobytes()
+    # 读取JXL需要导入 Pillow 插件
+    get_encoder('jxl', 'pillow').load()
+    with Image.open(io.BytesIO(output.getvalue())) as result:
+        assert result.format == 'JXL' and result.size == img.size
+
+
+@pytest.mark.parametrize('format, backend, message', [
+    ('avif', 'avifenc', 'avifenc 编码失败: ERROR: Failed to encode image'),
+    ('jxl', 'cjxl', 'cjxl 编码失败: Encoding failed.'),
+])
+def test_encoder_failure_raises(fake_tools, monkeypatch, format, backend, message):
+    monkeypatch.setenv('FAKE_ENCODER_FAIL', '1')
+
+    with pytest.raises(RuntimeError, match=message):
+        get_encoder(format, backend).encode(rgb_image(), io.BytesIO(), quality=80, effort=7)
+
+
+@pytest.mark.parametrize('format, backend', [('avif', 'avifenc'), ('jxl', 'cjxl')])
+def test_animation_is_not_supported(fake_tools, format, backend):
+    frames = [rgb_image(), rgb_image()]
+
+    with pytest.raises(AnimationNotSupported):
+        get_encoder(format, backend).encode(frames[0], io.BytesIO(), quality=80, effort=7, save_all=True,
+                                            append_images=frames[1:], duration=[100, 100], loop=0)
+    assert not fake_tools.exists()
+
+
+@pytest.mark.parametrize('format, backend', [('avif', 'avifenc'), ('jxl', 'cjxl')])
+def test_directory_conversion_with_command_encoder(fake_tools, tmp_path, format, backend):
+    images = tmp_path / 'images'
+    images.mkdir()
+    for i in range(3):
+        Image.effect_noise((64, 48), 40).convert('RGB').save(images / f'{i}.png')
+
+    converter = ImageConverter(str(images), format=format, encoder=backend, check_compression=False,
+                               backup_mode='none', show_report=False, quiet=True, threads=2,
+                               encoder_settings=EncoderSettings(jobs=1))
+    converter.convert_all()
+
+    assert converter.stats['converted'] == 3
+    assert len(calls(fake_tools)) == 3
+    assert {sniff_image_format(path) for path in images.glob('*.png')} == {format}
@@ -0,0 +1,27 @@
+from convert import DecodeCache, ImageConverter
+
+
+def test_decode_from_prefetched_source(tmp_path, image_factory):
+    path = image_factory(tmp_path / 'a.png', color=(200, 30, 30))
+    source = path.read_bytes()
+    # 读入内存之后磁盘上的文件被改写
+    image_factory(path, color=(30, 30, 200))
+
+    converter = ImageConverter(str(tmp_path), decode_cache_mb=16, show_report=False, quiet=True)
+    with converter._open_image(path, source) as img:
+        assert img.getpixel((0, 1)) == (200, 30, 30)
+    with converter._open_image(path, source) as img:
+        assert img.getpixel((0, 1)) == (200, 30, 30)
+    assert converter._worker_stats().counters['decode_cache_hits'] == 1
+    with converter._open_image(path) as img:
+        assert img.getpixel((0, 1)) == (30, 30, 200)
+
+
+def test_decode_cache_evicts_least_recently_used(tmp_path, image_factory):
+    paths = [image_factory(tmp_path / f'{i}.png', size=(32, 32)) for i in range(3)]
+    cache = DecodeCache(max_bytes=32 * 32 * 3 * 2)
+    for path in paths:
+        assert cache.decode(path)[1] is False
+    assert cache.bytes_used <= cache.max_bytes
+    assert cache.decode(paths[2])[1] is True
+    assert cache.decode(paths[0])[1] is False
@@ -0,0 +1,71 @@
+import shutil
+
+import pytest
+from PIL import Image
+
+from convert import ImageConverter
+
+COUNTERS = ('found_images', 'converted', 'skipped_larger', 'skipped_minimal', 'failed',
+            'total_original_size', 'total_converted_size', 'total_saved_size')
+
+
+def run(directory, **kwargs):
+    converter = ImageConverter(str(directory), format='webp', backup_mode='none', show_report=False,
+                               quiet=True, **kwargs)
+    converter.convert_all()
+    return converter
+
+
+def contents(directory):
+    return {path.relative_to(directory).as_posix(): path.read_bytes()
+            for path in sorted(directory.rglob('*.png'))}
+
+
+@pytest.mark.parametrize('executor', ['process', 'async'])
+def test_executor_matches_thread_pool(tmp_path, corpus, executor):
+    other = tmp_path / executor
+    shutil.copytree(corpus, other)
+
+    baseline = run(corpus, threads=2, executor='thread')
+    result = run(other, threads=2, executor=executor)
+
+    for key in COUNTERS:
+        assert result.stats[key] == baseline.stats[key], key
+    assert baseline.stats['converted'] == 4
+    assert baseline.stats['failed'] == 1
+    assert sorted(r.outcome for r in result.results) == sorted(r.outcome for r in baseline.results)
+    assert contents(other) == contents(corpus)
+
+
+def test_single_thread_matches_thread_pool(tmp_path, corpus):
+    other = tmp_path / 'single'
+    shutil.copytree(corpus, other)
+
+    baseline = run(corpus, threads=4)
+    result = run(other, threads=1)
+
+    for key in COUNTERS:
+        assert result.stats[key] == baseline.stats[key], key
+    assert contents(other) == contents(corpus)
+
+
+def test_async_pipeline_bounds_files_in_memory(tmp_path, monkeypatch):
+    for i in range(30):
+        Image.effect_noise((40, 40), 40).convert('RGB').save(tmp_path / f'{i}.png')
+    active, peak = [0], [0]
+    original = ImageConverter._convert_async
+
+    async def tracked(self, *args):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        try:
+            return await original(self, *args)
+        finally:
+            active[0] -= 1
+
+    monkeypatch.setattr(ImageConverter, '_convert_async', tracked)
+    converter = run(tmp_path, executor='async', threads=2, prefetch=3, check_compression=False)
+
+    assert converter.stats['converted'] == 30
+    # 读入内存、等待或正在编码的文件不超过 threads + prefetch 个
+    assert 2 < peak[0] <= 5
@@ -0,0 +1,10 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_slow_modules_are_imported_lazily():
+    code = "import sys, convert; print(' '.join(m for m in ('numpy', 'asyncio', 'watchdog') if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).resolve().parent.parent,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
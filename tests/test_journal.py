@@ -0,0 +1,68 @@
+import json
+
+from PIL import Image
+
+from convert import ImageConverter, sniff_image_format
+
+
+def interrupted_run(directory):
+    """模拟在替换原文件的途中被中断：已记录日志、已创建备份和临时文件，原文件已被移走"""
+    converter = ImageConverter(directory, format='webp', show_report=False, quiet=True)
+    image_path = converter.directory / 'a.png'
+    converter._journal(image_path, 'pending')
+    converter._journal_encoding(image_path)
+    converter._create_backup(image_path)
+    converter._new_temp_path(image_path).write_bytes(b'partial')
+    image_path.unlink()
+    converter.journal.close()
+
+
+def test_recover_from_another_working_directory(tmp_path, monkeypatch):
+    images = tmp_path / 'images'
+    images.mkdir()
+    Image.effect_noise((120, 90), 40).convert('RGB').save(images / 'a.png')
+    original = (images / 'a.png').read_bytes()
+
+    monkeypatch.chdir(tmp_path)
+    # 以相对路径指定处理目录
+    interrupted_run('images')
+    entries = [json.loads(line) for line in (images / '.image-journal.jsonl').read_text(encoding='utf-8').splitlines()]
+    assert entries[-1]['state'] == 'encoding'
+    assert entries[-1]['backup'] == 'a.png.backup'
+
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    converter = ImageConverter(str(images), format='webp', check_compression=False, delete_backup=True,
+                               show_report=False, quiet=True)
+    converter.recover()
+
+    assert (images / 'a.png').read_bytes() == original
+    assert not (images / 'a.png.backup').exists()
+    assert not list(images.glob('.a.png.*.tmp'))
+
+
+def test_recover_rename_output_and_clean_run_removes_journal(tmp_path, monkeypatch):
+    images = tmp_path / 'images'
+    images.mkdir()
+    Image.effect_noise((120, 90), 40).convert('RGB').save(images / 'a.png')
+    Image.effect_noise((120, 90), 40).convert('RGB').save(images / 'b.png')
+
+    monkeypatch.chdir(tmp_path)
+    converter = ImageConverter('images', format='webp', rename=True, show_report=False, quiet=True)
+    image_path = converter.directory / 'a.png'
+    converter._journal(image_path, 'encoding', format='webp', backup=None,
+                       output=converter._relative_key(converter._output_path(image_path)))
+    # 新文件已写入、原文件尚未删除时中断
+    Image.open(image_path).save(images / 'a.webp')
+    converter.journal.close()
+
+    monkeypatch.chdir(tmp_path.parent)
+    converter = ImageConverter(str(images), format='webp', rename=True, check_compression=False,
+                               backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+
+    assert not (images / 'a.png').exists()
+    assert sniff_image_format(images / 'a.webp') == 'webp'
+    assert sniff_image_format(images / 'b.webp') == 'webp'
+    assert not (images / '.image-journal.jsonl').exists()
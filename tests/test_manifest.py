@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+from PIL import Image
+
+from convert import ConversionManifest, ImageConverter, sniff_image_format
+
+
+def run(directory, manifest, **kwargs):
+    converter = ImageConverter(str(directory), format='webp', manifest_path=str(manifest), backup_mode='none',
+                               show_report=False, quiet=True, **kwargs)
+    converter.convert_all()
+    return converter
+
+
+def noise_png(path):
+    Image.effect_noise((200, 150), 40).convert('RGB').save(path)
+    return path
+
+
+def test_manifest_round_trip(tmp_path, image_factory):
+    images = tmp_path / 'images'
+    images.mkdir()
+    manifest = tmp_path / 'manifest.sqlite'
+    noise_png(images / 'photo.png')
+    # 规则图案的PNG转为有损WebP只会更大
+    image_factory(images / 'pattern.png', size=(600, 400))
+
+    first = run(images, manifest)
+    assert first.stats['converted'] == 1
+    assert first.stats['skipped_larger'] + first.stats['skipped_minimal'] == 1
+
+    rows = {key: ConversionManifest(str(manifest)).lookup(key) for key in ('photo.png', 'pattern.png')}
+    assert rows['photo.png']['outcome'] == 'converted'
+    assert rows['photo.png']['size'] == (images / 'photo.png').stat().st_size
+    assert rows['pattern.png']['outcome'] in ('skip_larger', 'skip_minimal')
+
+    # 未变化的文件不再打开
+    second = run(images, manifest)
+    assert second.stats['skipped_unchanged'] == 2
+    assert second.stats['found_images'] == 0
+
+    # 只改修改时间、内容不变时仍视为未变化
+    os.utime(images / 'pattern.png', (1, 1))
+    assert run(images, manifest).stats['skipped_unchanged'] == 2
+
+    # 内容改变后重新处理
+    noise_png(images / 'pattern.png')
+    third = run(images, manifest)
+    assert third.stats['skipped_unchanged'] == 1
+    assert third.stats['converted'] == 1
+
+
+def test_skip_verdicts_ignored_without_compression_check(tmp_path, image_factory):
+    images = tmp_path / 'images'
+    images.mkdir()
+    manifest = tmp_path / 'manifest.sqlite'
+    pattern = image_factory(images / 'pattern.png', size=(600, 400))
+
+    assert run(images, manifest).stats['converted'] == 0
+
+    converter = run(images, manifest, check_compression=False)
+    assert converter.stats['skipped_unchanged'] == 0
+    assert converter.stats['converted'] == 1
+    assert sniff_image_format(pattern) == 'webp'
+    assert ConversionManifest(str(manifest)).lookup('pattern.png')['outcome'] == 'converted'
+
+
+def test_skip_verdicts_depend_on_all_encode_settings(tmp_path, image_factory):
+    images = tmp_path / 'images'
+    images.mkdir()
+    manifest = tmp_path / 'manifest.sqlite'
+    palette = image_factory(images / 'palette.png', size=(200, 150))
+    Image.open(palette).quantize(8).save(palette)
+
+    first = run(images, manifest)
+    assert first.stats['skipped_larger'] == 1
+    assert run(images, manifest).stats['skipped_unchanged'] == 1
+
+    # 图像分析会为少色图片选择无损编码，之前的跳过结论不再成立
+    analyzed = run(images, manifest, analyze=True)
+    assert analyzed.stats['skipped_unchanged'] == 0
+    assert analyzed.stats['converted'] == 1
+
+
+def test_manifest_without_signature_column_is_migrated(tmp_path):
+    manifest = tmp_path / 'manifest.sqlite'
+    with sqlite3.connect(manifest) as conn:
+        conn.execute(ConversionManifest.SCHEMA.replace(",\n            encode_signature TEXT NOT NULL DEFAULT ''", ''))
+        conn.execute("INSERT INTO files VALUES ('a.png', 1, 1, 'x', 'skip_larger', 'webp', 80, 7, 2, 'now')")
+    conn.close()
+
+    row = ConversionManifest(str(manifest)).lookup('a.png')
+    assert row['outcome'] == 'skip_larger'
+    assert row['encode_signature'] == ''
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import convert
+from convert import ImageConverter, collect_markdown_references, default_site_root, resolve_markdown_link
+
+
+def vitepress_tree(root: Path, image_factory) -> Path:
+    """docs/public 下放根路径引用的图片，docs/article 下放相对路径引用的图片"""
+    docs = root / 'docs'
+    image_factory(docs / 'public' / 'others' / 'root.png')
+    image_factory(docs / 'article' / 'img' / 'local.png')
+    (docs / 'article').mkdir(parents=True, exist_ok=True)
+    (docs / 'article' / 'post.md').write_text(
+        '# Post\n'
+        '![root](/others/root.png)\n'
+        '![local](./img/local.png "title")\n'
+        '<img src="/others/root.png?v=1" alt="x">\n'
+        '![remote](https://example.com/a.png)\n',
+        encoding='utf-8')
+    return docs
+
+
+def test_resolve_root_and_relative_links(tmp_path):
+    md = tmp_path / 'docs' / 'article' / 'post.md'
+    site_root = str(tmp_path / 'docs' / 'public')
+    assert resolve_markdown_link('/others/a.png', md, site_root) == str(tmp_path / 'docs' / 'public' / 'others' / 'a.png')
+    assert resolve_markdown_link('img/b%20c.png#x', md, site_root) == str(tmp_path / 'docs' / 'article' / 'img' / 'b c.png')
+    assert resolve_markdown_link('https://example.com/a.png', md, site_root) is None
+    assert resolve_markdown_link('#anchor', md, site_root) is None
+
+
+def test_default_site_root_is_public_dir(tmp_path, image_factory):
+    docs = vitepress_tree(tmp_path, image_factory)
+    assert default_site_root(docs) == docs / 'public'
+    assert default_site_root(docs / 'article') == docs / 'article'
+
+
+def test_collect_references_in_vitepress_tree(tmp_path, image_factory):
+    docs = vitepress_tree(tmp_path, image_factory)
+    md_files = list(convert.iter_markdown_files([str(docs / 'article')]))
+    references = collect_markdown_references(md_files, str(default_site_root(docs)))
+    assert set(references) == {str(docs / 'public' / 'others' / 'root.png'),
+                               str(docs / 'article' / 'img' / 'local.png')}
+    assert all(os.path.isfile(path) for path in references)
+
+
+def test_rename_rewrites_links(tmp_path, image_factory):
+    docs = vitepress_tree(tmp_path, image_factory)
+    md_files = list(convert.iter_markdown_files([str(docs / 'article')]))
+    references = collect_markdown_references(md_files, str(default_site_root(docs)))
+    converter = ImageConverter(str(docs), format='webp', check_compression=False, show_report=False,
+                               quiet=True, files=list(references), rename=True, markdown_files=md_files)
+    converter.convert_all()
+
+    assert (docs / 'public' / 'others' / 'root.webp').exists()
+    assert not (docs / 'public' / 'others' / 'root.png').exists()
+    text = (docs / 'article' / 'post.md').read_text(encoding='utf-8')
+    assert '![root](/others/root.webp)' in text
+    assert '![local](./img/local.webp "title")' in text
+    assert '<img src="/others/root.webp?v=1"' in text
+    assert 'https://example.com/a.png' in text
+
+    # 再次执行不会重复改写
+    assert convert.rewrite_markdown_links(docs / 'article' / 'post.md', str(docs / 'public'), 'webp') == 0
+
+
+def test_rename_requires_markdown_dir(tmp_path, image_factory, capsys):
+    docs = vitepress_tree(tmp_path, image_factory)
+    try:
+        convert.main([str(docs), '--format', 'webp', '--rename-ext'])
+    except SystemExit as e:
+        assert e.code == 1
+    else:
+        raise AssertionError('--rename-ext 未指定 --markdown-dir 时应退出')
+    assert (docs / 'public' / 'others' / 'root.png').exists()
+
+
+def test_rename_refuses_same_stem_sources(tmp_path, image_factory):
+    docs = tmp_path / 'docs'
+    image_factory(docs / 'public' / 'img' / 'foo.png', color=(200, 30, 30))
+    image_factory(docs / 'public' / 'img' / 'foo.jpg', color=(30, 30, 200))
+    image_factory(docs / 'public' / 'img' / 'bar.png')
+    existing = image_factory(docs / 'public' / 'img' / 'bar.webp', format='WEBP').read_bytes()
+    (docs / 'article').mkdir()
+    post = docs / 'article' / 'post.md'
+    post.write_text('![a](/img/foo.png)\n![b](/img/foo.jpg)\n![c](/img/bar.png)\n', encoding='utf-8')
+
+    converter = ImageConverter(str(docs), format='webp', check_compression=False, backup_mode='none',
+                               show_report=False, quiet=True, rename=True, markdown_files=[post])
+    converter.convert_all()
+
+    images = docs / 'public' / 'img'
+    assert converter.stats['failed'] == 3
+    assert (images / 'foo.png').exists() and (images / 'foo.jpg').exists() and (images / 'bar.png').exists()
+    assert not (images / 'foo.webp').exists()
+    assert (images / 'bar.webp').read_bytes() == existing
+    assert post.read_text(encoding='utf-8') == '![a](/img/foo.png)\n![b](/img/foo.jpg)\n![c](/img/bar.png)\n'
+
+
+def test_rename_keeps_original_when_recording_fails(tmp_path, image_factory, monkeypatch):
+    source = image_factory(tmp_path / 'foo.png')
+    original = source.read_bytes()
+    converter = ImageConverter(str(tmp_path), format='webp', check_compression=False, backup_mode='none',
+                               show_report=False, quiet=True, rename=True,
+                               manifest_path=str(tmp_path / 'manifest.sqlite'))
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(converter.manifest, 'record', locked)
+    converter.convert_all()
+
+    assert converter.stats['failed'] == 1
+    assert source.read_bytes() == original
+    assert not (tmp_path / 'foo.webp').exists()
@@ -0,0 +1,111 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from convert import ImageConverter, ImageInfo, MemoryScheduler, estimate_peak_memory
+
+
+def drain(scheduler):
+    """依次取出所有任务，每个任务取出后立即结束"""
+    order = []
+    while (job := scheduler.pop()) is not None:
+        order.append(job)
+        scheduler.release(job[1])
+    return order
+
+
+def test_without_budget_jobs_run_in_order():
+    scheduler = MemoryScheduler()
+    for i, estimate in enumerate([50, 10, 90, 30]):
+        scheduler.add(Path(f'{i}.png'), estimate)
+
+    assert [path.name for path, _ in drain(scheduler)] == ['0.png', '1.png', '2.png', '3.png']
+    assert len(scheduler) == 0 and scheduler.in_use == 0 and scheduler.running == 0
+
+
+def test_jobs_are_admitted_within_budget():
+    scheduler = MemoryScheduler(100)
+    for i, estimate in enumerate([60, 30, 30, 20]):
+        scheduler.add(Path(f'{i}.png'), estimate)
+
+    started = []
+    while (job := scheduler.pop()) is not None:
+        started.append(job)
+    assert scheduler.in_use <= 100
+    assert sum(estimate for _, estimate in started) == scheduler.in_use
+    assert len(scheduler) == 4 - len(started) > 0
+
+    # 归还预算后剩余的任务才能开始
+    scheduler.release(started[0][1])
+    assert scheduler.pop() is not None
+
+
+def test_largest_and_smallest_jobs_alternate():
+    scheduler = MemoryScheduler(1000)
+    for i, estimate in enumerate([10, 400, 20, 300, 30, 200]):
+        scheduler.add(Path(f'{i}.png'), estimate)
+
+    assert [estimate for _, estimate in drain(scheduler)] == [400, 10, 300, 20, 200, 30]
+
+
+def test_oversized_job_runs_alone():
+    scheduler = MemoryScheduler(100)
+    scheduler.add(Path('small.png'), 40)
+    scheduler.add(Path('huge.png'), 500)
+
+    small = scheduler.pop()
+    assert small[0].name == 'small.png'
+    # 还有任务在运行时，超过整个预算的任务不会开始
+    assert scheduler.pop() is None
+
+    scheduler.release(small[1])
+    huge = scheduler.pop()
+    assert huge[0].name == 'huge.png' and scheduler.running == 1
+    scheduler.release(huge[1])
+    assert scheduler.in_use == 0
+
+
+def test_estimate_grows_with_size_frames_and_analysis():
+    small = estimate_peak_memory(ImageInfo('PNG', 'RGB', (100, 100)), 'avif')
+    large = estimate_peak_memory(ImageInfo('PNG', 'RGB', (1000, 1000)), 'avif')
+    animated = estimate_peak_memory(ImageInfo('GIF', 'P', (1000, 1000), frames=10), 'avif')
+
+    assert small < large < animated
+    assert estimate_peak_memory(ImageInfo('PNG', 'RGB', (1000, 1000)), 'avif', analyze=True) > large
+
+
+@pytest.mark.parametrize('executor', ['thread', 'async'])
+def test_tight_budget_serializes_conversions(tmp_path, monkeypatch, executor):
+    for i in range(6):
+        Image.effect_noise((64 + i * 8, 64), 40).convert('RGB').save(tmp_path / f'{i}.png')
+    lock = threading.Lock()
+    active, peak = [0], [0]
+    original = ImageConverter.convert_image
+
+    def tracked(self, *args, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            time.sleep(0.02)
+            return original(self, *args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(ImageConverter, 'convert_image', tracked)
+    if executor == 'async':
+        async def tracked_async(self, image_path, run_io, run_cpu):
+            return await run_cpu(self.convert_image, image_path)
+        monkeypatch.setattr(ImageConverter, '_convert_async', tracked_async)
+
+    # 每个图片的预估内存都超过预算，只能逐个转换
+    converter = ImageConverter(str(tmp_path), format='webp', backup_mode='none', show_report=False,
+                               quiet=True, threads=4, executor=executor, max_memory=1)
+    converter.convert_all()
+
+    assert converter.stats['converted'] == 6
+    assert peak[0] == 1
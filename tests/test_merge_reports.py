@@ -0,0 +1,61 @@
+import json
+import shutil
+
+from PIL import Image
+
+import convert
+from convert import ImageConverter
+
+TOTALS = ('found_images', 'converted', 'skipped_larger', 'skipped_minimal', 'failed',
+          'total_original_size', 'total_converted_size', 'total_saved_size')
+
+
+def corpus(directory, image_factory):
+    for i in range(6):
+        Image.effect_noise((80 + i * 10, 60), 40).convert('RGB').save(directory / f'noise-{i}.png')
+    # 规则图案的PNG转为有损WebP只会更大
+    image_factory(directory / 'pattern.png', size=(400, 300))
+
+
+def run(directory, **kwargs):
+    converter = ImageConverter(str(directory), format='webp', backup_mode='none', show_report=False,
+                               quiet=True, **kwargs)
+    converter.convert_all()
+    return converter
+
+
+def test_merged_shards_match_single_run(tmp_path, image_factory, capsys):
+    single_dir = tmp_path / 'single'
+    single_dir.mkdir()
+    corpus(single_dir, image_factory)
+    sharded_dir = tmp_path / 'sharded'
+    shutil.copytree(single_dir, sharded_dir)
+
+    single = run(single_dir)
+
+    reports = []
+    for k in (1, 2):
+        report = tmp_path / f'shard-{k}.json'
+        run(sharded_dir, shard=(k, 2), shard_report=str(report))
+        reports.append(str(report))
+    merged_path = tmp_path / 'merged.json'
+    convert.main(['merge-reports', *reports, '--json', str(merged_path)])
+
+    merged = json.loads(merged_path.read_text(encoding='utf-8'))
+    assert merged['merged_from'] == 2
+    for key in TOTALS:
+        assert merged['stats'][key] == single.stats[key], key
+    assert single.stats['converted'] == 6
+    assert single.stats['skipped_larger'] + single.stats['skipped_minimal'] == 1
+    # 每个文件恰好被一个分片处理
+    assert len(merged['results']) == 7
+    assert '缺少分片' not in capsys.readouterr().out
+
+
+def test_merge_reports_warns_about_missing_shard(tmp_path, image_factory, capsys):
+    corpus(tmp_path, image_factory)
+    report = tmp_path / 'shard-1.json'
+    run(tmp_path, shard=(1, 3), shard_report=str(report))
+
+    convert.main(['merge-reports', str(report)])
+    assert '警告: 缺少分片 2, 3（共 3 个）' in capsys.readouterr().out
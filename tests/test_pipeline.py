@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from convert import ImageConverter
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_encoding_starts_before_discovery_finishes(tmp_path, monkeypatch, threads):
+    for i in range(12):
+        Image.effect_noise((32, 32), 40).convert('RGB').save(tmp_path / f'{i}.png')
+    (tmp_path / 'late').mkdir()
+    Image.effect_noise((32, 32), 40).convert('RGB').save(tmp_path / 'late' / 'last.png')
+
+    first_converted = threading.Event()
+    streamed = []
+    original_scan = ImageConverter._scan_directory
+    original_process = ImageConverter.process_image
+
+    def slow_scan(self, directory):
+        if directory.name == 'late':
+            # 目录列举很慢时，已发现的图片应该已经开始转换
+            streamed.append(first_converted.wait(timeout=10))
+        return original_scan(self, directory)
+
+    def process(self, image_path):
+        result = original_process(self, image_path)
+        first_converted.set()
+        return result
+
+    monkeypatch.setattr(ImageConverter, '_scan_directory', slow_scan)
+    monkeypatch.setattr(ImageConverter, 'process_image', process)
+    converter = ImageConverter(str(tmp_path), format='webp', threads=threads, check_compression=False,
+                               backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+
+    assert streamed == [True]
+    assert converter.stats['found_images'] == 13
+    assert converter.stats['converted'] == 13
+
+
+def test_every_discovered_image_is_processed_once(tmp_path, monkeypatch):
+    for d in range(5):
+        for i in range(7):
+            path = tmp_path / f'dir{d}' / f'{i}.png'
+            path.parent.mkdir(exist_ok=True)
+            Image.effect_noise((24, 24), 40).convert('RGB').save(path)
+    processed = []
+    lock = threading.Lock()
+    original_process = ImageConverter.process_image
+
+    def process(self, image_path):
+        with lock:
+            processed.append(image_path)
+        return original_process(self, image_path)
+
+    monkeypatch.setattr(ImageConverter, 'process_image', process)
+    converter = ImageConverter(str(tmp_path), format='webp', threads=3, check_compression=False,
+                               backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+
+    assert len(processed) == len(set(processed)) == 35
+    assert converter.stats['converted'] == 35
@@ -0,0 +1,66 @@
+from PIL import Image
+
+from convert import PREDICT_PROBE_GRID, PREDICT_PROBE_SIZE, ImageConverter, Prediction, sniff_image_format
+
+
+def test_probe_tiles_keep_full_resolution():
+    img = Image.new('RGB', (3000, 200))
+    probe = ImageConverter._probe_tiles(img)
+    assert probe.size == (PREDICT_PROBE_SIZE * PREDICT_PROBE_GRID, 100 * PREDICT_PROBE_GRID)
+
+    small = Image.new('RGB', (300, 200))
+    assert ImageConverter._probe_tiles(small) is small
+
+
+def test_probe_skips_only_images_that_would_grow(tmp_path, image_factory):
+    # 规则图案的PNG压缩得极好，有损编码只会更大；噪声图片有损编码后明显变小
+    pattern = image_factory(tmp_path / 'pattern.png', size=(1200, 900))
+    Image.effect_noise((1200, 900), 40).convert('RGB').save(tmp_path / 'noise.png')
+    converter = ImageConverter(str(tmp_path), format='webp', predict='probe', predict_audit_rate=0,
+                               backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+
+    assert converter.stats['skipped_predicted'] == 1
+    assert converter.stats['converted'] == 1
+    assert pattern.exists()
+    assert sniff_image_format(tmp_path / 'noise.png') == 'webp'
+
+
+def test_async_probe_uses_prefetched_source(tmp_path, monkeypatch):
+    Image.effect_noise((600, 400), 40).convert('RGB').save(tmp_path / 'noise.png')
+    converter = ImageConverter(str(tmp_path), format='webp', predict='probe', executor='async', threads=2,
+                               backup_mode='none', show_report=False, quiet=True)
+    opened = []
+    original_open = ImageConverter._open_image
+
+    def spy(self, image_path, source=None):
+        opened.append(source is not None)
+        return original_open(self, image_path, source)
+
+    monkeypatch.setattr(ImageConverter, '_open_image', spy)
+    converter.convert_all()
+
+    assert converter.stats['converted'] == 1
+    # 试探编码和完整编码都从预读的内容解码
+    assert opened == [True, True]
+
+
+def test_check_prediction_verdicts(tmp_path, image_factory):
+    pattern = image_factory(tmp_path / 'pattern.png', size=(1200, 900))
+    size = pattern.stat().st_size
+
+    def check(**kwargs):
+        converter = ImageConverter(str(tmp_path), format='webp', predict='probe', backup_mode='none',
+                                   show_report=False, quiet=True, **kwargs)
+        return converter, converter._check_prediction(pattern, size)
+
+    assert check(predict_audit_rate=0)[1] is Prediction.SKIPPED
+    assert check(predict_audit_rate=1)[1] is Prediction.AUDIT
+    assert check(check_compression=False)[1] is Prediction.ENCODE
+
+    # 抽查的文件仍做完整编码，实际仍被跳过说明预测正确
+    converter = ImageConverter(str(tmp_path), format='webp', predict='probe', predict_audit_rate=1,
+                               backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+    assert converter.stats['predict_audited'] == 1
+    assert converter.stats['predict_wrong'] == 0
@@ -0,0 +1,175 @@
+import base64
+import http.client
+import io
+import json
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import convert
+from convert import ConversionService, _ServiceHandler, _ServiceHTTPServer, check_encode_options, convert_bytes
+
+
+def png_bytes(size=(96, 64)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 40).convert('RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def decode(data):
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return img.format, img.size
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, '等待超时'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def service():
+    service = ConversionService(check_encode_options({'format': 'webp', 'quality': 75}), workers=2,
+                                max_pending=2, queue_timeout=0.2)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def server(service):
+    server = _ServiceHTTPServer(('127.0.0.1', 0), _ServiceHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def blocked_pool(monkeypatch):
+    """让工作池中的转换一直等待，直到返回的事件被设置"""
+    release = threading.Event()
+    original = convert._convert_batch
+
+    def slow_batch(items):
+        release.wait(10)
+        return original(items)
+
+    monkeypatch.setattr(convert, '_convert_batch', slow_batch)
+    yield release
+    release.set()
+
+
+def test_convert_bytes_returns_encoded_image_and_metrics():
+    data = png_bytes()
+
+    output, metrics = convert_bytes(data, format='webp', quality='60')
+
+    assert decode(output) == ('WEBP', (96, 64))
+    assert metrics['format'] == 'webp' and metrics['quality'] == 60
+    assert metrics['original_size'] == len(data)
+    assert metrics['converted_size'] == len(output)
+
+
+@pytest.mark.parametrize('options', [{'quality': 0}, {'effort': 12}, {'format': 'bmp'}, {'speed': 3},
+                                     {'quality': 'high'}])
+def test_convert_bytes_rejects_bad_options(options):
+    with pytest.raises(ValueError):
+        convert_bytes(png_bytes(), **options)
+
+
+def test_service_keeps_order_and_isolates_failures(service):
+    good = png_bytes()
+    results = service.convert([(good, {}), (b'not an image', {}), (good, {'quality': 500}), (good, {'format': 'avif'})])
+
+    assert decode(results[0][0]) == ('WEBP', (96, 64))
+    assert results[1][0] is None and results[1][1]['error']
+    assert results[2] == (None, {'error': 'quality 必须在 1-100 之间'})
+    assert decode(results[3][0])[0] == 'AVIF'
+    assert service.status()['served'] == 2 and service.status()['failed'] == 2
+
+
+def test_service_rejects_when_queue_is_full(service, blocked_pool):
+    first = threading.Thread(target=service.convert, args=([(png_bytes(), {})] * 2,))
+    first.start()
+    try:
+        wait_until(lambda: service.status()['pending'] == 2)
+        assert service.convert([(png_bytes(), {})]) is None
+        assert service.status()['rejected'] == 1
+    finally:
+        blocked_pool.set()
+        first.join()
+    assert service.status()['pending'] == 0
+
+
+def test_http_convert(server):
+    status, headers, body = request(server, 'POST', '/convert?quality=50', png_bytes())
+
+    assert status == 200
+    assert headers['Content-Type'] == 'image/webp'
+    assert decode(body) == ('WEBP', (96, 64))
+    metrics = json.loads(headers['X-Convert-Metrics'])
+    assert metrics['quality'] == 50 and metrics['converted_size'] == len(body)
+
+
+@pytest.mark.parametrize('query', ['quality=500', 'format=bmp', 'effort=x'])
+def test_http_convert_rejects_bad_options(server, query):
+    status, _, body = request(server, 'POST', f'/convert?{query}', png_bytes())
+
+    assert status == 422
+    assert json.loads(body)['error']
+
+
+def test_http_batch(server):
+    payload = {'options': {'quality': 60}, 'items': [
+        {'data': base64.b64encode(png_bytes()).decode('ascii')},
+        {'data': base64.b64encode(png_bytes((32, 32))).decode('ascii'), 'options': {'format': 'avif'}},
+        {'data': base64.b64encode(b'broken').decode('ascii')},
+    ]}
+    status, _, body = request(server, 'POST', '/batch', json.dumps(payload))
+
+    assert status == 200
+    results = json.loads(body)['results']
+    assert decode(base64.b64decode(results[0]['data'])) == ('WEBP', (96, 64))
+    assert results[0]['metrics']['quality'] == 60
+    assert decode(base64.b64decode(results[1]['data'])) == ('AVIF', (32, 32))
+    assert 'error' in results[2]
+
+
+def test_http_health_and_errors(server):
+    status, _, body = request(server, 'GET', '/health')
+    assert status == 200
+    health = json.loads(body)
+    assert health['status'] == 'ok' and health['defaults']['format'] == 'webp'
+
+    assert request(server, 'GET', '/missing')[0] == 404
+    assert request(server, 'POST', '/missing', b'')[0] == 404
+    assert request(server, 'POST', '/batch', b'{not json')[0] == 400
+    assert request(server, 'POST', '/batch', b'{"options": {}}')[0] == 400
+
+
+def test_http_busy_returns_503(server, service, blocked_pool):
+    first = threading.Thread(target=service.convert, args=([(png_bytes(), {})] * 2,))
+    first.start()
+    try:
+        wait_until(lambda: service.status()['pending'] == 2)
+        status, headers, _ = request(server, 'POST', '/convert', png_bytes())
+        assert status == 503 and headers['Retry-After'] == '1'
+    finally:
+        blocked_pool.set()
+        first.join()
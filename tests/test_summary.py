@@ -0,0 +1,67 @@
+import pytest
+
+import convert
+from convert import FileResult, ImageConverter, summarize_results
+
+RESULTS = [
+    FileResult('converted', 1000, 400),
+    FileResult('converted', 2000, 1500),
+    FileResult('converted', 500, 450),
+    FileResult('variants', 0, 300),
+    FileResult('skip_larger', 800),
+    FileResult('skip_minimal', 900),
+    FileResult('skip_predicted', 700),
+    FileResult('skip_animated', 600),
+    FileResult('failed', 100, error='文件损坏'),
+    FileResult('failed', 200),
+]
+
+
+def summarize_without_numpy(results, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(convert, 'HAS_NUMPY', False)
+        return summarize_results(results)
+
+
+def test_counts_sizes_and_compression():
+    summary = summarize_results(RESULTS)
+
+    assert summary['converted'] == 4
+    assert summary['failed'] == 2
+    assert summary['skipped_larger'] == summary['skipped_minimal'] == 1
+    assert summary['skipped_predicted'] == summary['skipped_animated'] == 1
+    assert summary['errors'] == ['文件损坏']
+    # 变体的输出计入总大小，但不参与压缩率统计
+    assert summary['total_converted_size'] == 400 + 1500 + 450 + 300
+    assert summary['total_saved_size'] == 600 + 500 + 50
+    assert summary['max_compression'] == pytest.approx(60)
+    assert summary['min_compression'] == pytest.approx(10)
+    assert summary['avg_compression'] == pytest.approx(95 / 3)
+    assert summary['compression_percentiles']['p50'] == pytest.approx(25)
+
+
+@pytest.mark.parametrize('results', [RESULTS, [], [FileResult('failed', error='x')], [FileResult('converted', 10, 3)]],
+                         ids=['mixed', 'empty', 'failed-only', 'single'])
+def test_numpy_and_pure_python_agree(results, monkeypatch):
+    if not convert.HAS_NUMPY:
+        pytest.skip('需要 NumPy')
+    expected = summarize_results(results)
+    summary = summarize_without_numpy(results, monkeypatch)
+
+    assert summary.keys() == expected.keys()
+    for key, value in expected.items():
+        assert summary[key] == pytest.approx(value), key
+        assert type(summary[key]) is type(value), key
+
+
+def test_run_statistics_match_results(corpus):
+    converter = ImageConverter(str(corpus), format='webp', backup_mode='none', show_report=False, quiet=True)
+    converter.convert_all()
+    results = converter.results
+    summary = summarize_results(results)
+
+    assert len(results) == converter.stats['found_images'] == 6
+    for key in ('converted', 'skipped_larger', 'failed', 'total_converted_size', 'total_saved_size'):
+        assert converter.stats[key] == summary[key], key
+    assert summary['converted'] == 4 and summary['failed'] == 1
+    assert len(summary['errors']) == 1
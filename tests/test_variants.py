@@ -0,0 +1,42 @@
+import json
+
+from convert import ImageConverter
+
+
+def run_variants(directory, **kwargs):
+    converter = ImageConverter(str(directory), format='webp', variants=True, variant_widths=(16, 32),
+                               variant_formats=('webp',), show_report=False, quiet=True, **kwargs)
+    converter.convert_all()
+    return converter
+
+
+def test_source_already_in_target_format_gets_variants(tmp_path, image_factory):
+    image_factory(tmp_path / 'bar.webp', format='WEBP')
+    run_variants(tmp_path)
+
+    assert (tmp_path / 'bar-16w.webp').exists()
+    assert (tmp_path / 'bar-32w.webp').exists()
+    sidecar = json.loads((tmp_path / 'image-variants.json').read_text(encoding='utf-8'))
+    assert [v['path'] for v in sidecar['bar.webp']['variants']] == ['bar-16w.webp', 'bar-32w.webp']
+
+
+def test_same_stem_sources_do_not_collide(tmp_path, image_factory):
+    image_factory(tmp_path / 'foo.png', color=(200, 30, 30))
+    image_factory(tmp_path / 'foo.jpg', color=(30, 30, 200))
+    image_factory(tmp_path / 'solo.png')
+    run_variants(tmp_path)
+
+    sidecar = json.loads((tmp_path / 'image-variants.json').read_text(encoding='utf-8'))
+    assert [v['path'] for v in sidecar['foo.png']['variants']] == ['foo-png-16w.webp', 'foo-png-32w.webp']
+    assert [v['path'] for v in sidecar['foo.jpg']['variants']] == ['foo-jpg-16w.webp', 'foo-jpg-32w.webp']
+    assert [v['path'] for v in sidecar['solo.png']['variants']] == ['solo-16w.webp', 'solo-32w.webp']
+    assert not (tmp_path / 'foo-16w.webp').exists()
+
+
+def test_variants_are_not_discovered_as_sources(tmp_path, image_factory):
+    image_factory(tmp_path / 'foo.png')
+    run_variants(tmp_path)
+    converter = run_variants(tmp_path)
+
+    assert converter.find_images() == [tmp_path / 'foo.png']
+    assert converter.stats['variants_generated'] == 0
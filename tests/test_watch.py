@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from convert import ImageConverter, ImageWatcher, sniff_image_format
+
+
+def make_converter(directory, **kwargs):
+    return ImageConverter(str(directory), format='webp', check_compression=False, backup_mode='none',
+                          show_report=False, quiet=True, **kwargs)
+
+
+def noise(path, size=(96, 64)):
+    Image.effect_noise(size, 40).convert('RGB').save(path)
+    return path
+
+
+def test_polling_reports_written_images_after_debounce(tmp_path):
+    watcher = ImageWatcher(make_converter(tmp_path), debounce=0.2, poll_interval=0.05)
+    assert watcher.backend == 'polling'
+    watcher.start()
+    # 防止断言失败时测试一直阻塞
+    timer = threading.Timer(10, watcher.stop)
+    timer.start()
+    try:
+        noise(tmp_path / '.partial.png')
+        (tmp_path / 'notes.txt').write_text('不是图片')
+        path = noise(tmp_path / 'new.png')
+
+        assert watcher.wait_ready() == [path]
+    finally:
+        timer.cancel()
+        watcher.stop()
+    assert watcher.wait_ready() == []
+
+
+def test_file_still_being_written_waits_for_debounce(tmp_path):
+    watcher = ImageWatcher(make_converter(tmp_path), debounce=0.5, poll_interval=0.05)
+    path = noise(tmp_path / 'growing.png')
+    watcher.changed(str(path))
+    # 防抖期间文件再次变化，以最后一次变化后的大小为准
+    threading.Timer(0.1, noise, (path, (160, 120))).start()
+
+    assert watcher.wait_ready() == [path]
+    with Image.open(path) as img:
+        assert img.size == (160, 120)
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_watch_converts_new_images_and_removes_journal(tmp_path, monkeypatch, executor):
+    existing = noise(tmp_path / 'existing.png')
+    converter = make_converter(tmp_path, threads=2, executor=executor)
+    journal = tmp_path / '.image-journal.jsonl'
+    added = tmp_path / 'sub' / 'added.png'
+    original_wait = ImageWatcher.wait_ready
+    calls = []
+
+    def wait_ready(self):
+        calls.append(self)
+        if len(calls) > 1:
+            # 第二次等待时模拟 Ctrl-C
+            raise KeyboardInterrupt
+        added.parent.mkdir()
+        noise(added)
+        timer = threading.Timer(10, self.stop)
+        timer.start()
+        try:
+            return original_wait(self)
+        finally:
+            timer.cancel()
+
+    monkeypatch.setattr(ImageWatcher, 'wait_ready', wait_ready)
+    converter.watch(debounce=0.2, poll_interval=0.05)
+
+    assert sniff_image_format(existing) == 'webp'
+    assert sniff_image_format(added) == 'webp'
+    assert converter.stats['converted'] == 2
+    assert not journal.exists()